@@ -172,10 +172,12 @@ class Lockout(wsgi.Middleware):
         res = req.get_response(self.application)
         if res.status_int == 403:
             failures = self.mc.incr(failures_key)
-            if failures is None:
-                # NOTE(vish): To use incr, failures has to be a string.
-                self.mc.set(failures_key, '1', time=FLAGS.lockout_window * 60)
-            elif failures >= FLAGS.lockout_attempts:
+            # NOTE(vish): To use incr, failures has to be a string.
+            if failures is None and not self.mc.add(failures_key, '1',
+                    time=FLAGS.lockout_window * 60):
+                # Another request recorded the first failure meanwhile
+                failures = self.mc.incr(failures_key)
+            if failures is not None and failures >= FLAGS.lockout_attempts:
                 lock_mins = FLAGS.lockout_minutes
                 msg = _('Access key %(access_key)s has had %(failures)d'
                         ' failed authentications and will be locked out'
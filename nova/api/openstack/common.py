@@ -286,9 +286,8 @@ def dict_to_query_str(params):
     return param_str.rstrip('&')
 
 
-def get_networks_for_instance_from_nw_info(nw_info):
+def _networks_from_nw_info(nw_info):
     networks = {}
-    LOG.debug(_('Converting nw_info: %s') % nw_info)
     for vif in nw_info:
         ips = vif.fixed_ips()
         floaters = vif.floating_ips()
@@ -298,7 +297,13 @@ def get_networks_for_instance_from_nw_info(nw_info):
 
         networks[label]['ips'].extend(ips)
         networks[label]['floating_ips'].extend(floaters)
-        LOG.debug(_('Converted networks: %s') % networks)
+    return networks
+
+
+def get_networks_for_instance_from_nw_info(nw_info):
+    LOG.debug(_('Converting nw_info: %s') % nw_info)
+    networks = _networks_from_nw_info(nw_info)
+    LOG.debug(_('Converted networks: %s') % networks)
     return networks
 
 
@@ -323,6 +328,30 @@ def get_networks_for_instance(context, instance):
     return get_networks_for_instance_from_nw_info(nw_info)
 
 
+def get_networks_for_instances(context, instances):
+    """Returns prepared nw_info for a list of instances, keyed by uuid.
+
+    The same as calling get_networks_for_instance() for each instance,
+    but without dumping every instance's network info to the debug log.
+    """
+    networks = {}
+    for instance in instances:
+        nw_info = get_nw_info_for_instance(context, instance)
+        networks[instance['uuid']] = _networks_from_nw_info(nw_info)
+    LOG.debug(_('Converted nw_info for %d instances') % len(instances))
+    return networks
+
+
+def get_request_cache(request, name):
+    """Returns a dict for memoizing data while building a response.
+
+    The dict is kept in the request environment, so it is shared by the
+    view builders handling the request and discarded along with it.
+    """
+    caches = request.environ.setdefault('nova.api.view_cache', {})
+    return caches.setdefault(name, {})
+
+
 def raise_http_conflict_for_instance_invalid_state(exc, action):
     """Return a webob.exc.HTTPConflict instance containing a message
     appropriate to return via the API based on the original
@@ -450,23 +479,33 @@ class ViewBuilder(object):
 
     def _get_href_link(self, request, identifier):
         """Return an href string pointing to this object."""
-        prefix = self._update_link_prefix(request.application_url,
-                                          FLAGS.osapi_compute_link_prefix)
-        return os.path.join(prefix,
-                            request.environ["nova.context"].project_id,
-                            self._collection_name,
+        return os.path.join(self._get_link_base(request, "self"),
                             str(identifier))
 
     def _get_bookmark_link(self, request, identifier):
         """Create a URL that refers to a specific resource."""
-        base_url = remove_version_from_href(request.application_url)
-        base_url = self._update_link_prefix(base_url,
-                                            FLAGS.osapi_compute_link_prefix)
-        return os.path.join(base_url,
-                            request.environ["nova.context"].project_id,
-                            self._collection_name,
+        return os.path.join(self._get_link_base(request, "bookmark"),
                             str(identifier))
 
+    def _get_link_base(self, request, rel):
+        """Return the URL the collection's self or bookmark links extend.
+
+        Building it means parsing the request's application URL, so it is
+        done once per request rather than once per link.
+        """
+        cache = get_request_cache(request, "link_bases")
+        key = (self._collection_name, rel)
+        if key not in cache:
+            base_url = request.application_url
+            if rel == "bookmark":
+                base_url = remove_version_from_href(base_url)
+            prefix = FLAGS.osapi_compute_link_prefix
+            base_url = self._update_link_prefix(base_url, prefix)
+            project_id = request.environ["nova.context"].project_id
+            cache[key] = os.path.join(base_url, project_id,
+                                      self._collection_name)
+        return cache[key]
+
     def _get_collection_links(self, request, items, id_key="uuid"):
         """Retrieve 'next' link, if applicable."""
         links = []
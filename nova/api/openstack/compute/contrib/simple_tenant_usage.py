@@ -103,8 +103,35 @@ class SimpleTenantUsageController(object):
             # instance hasn't launched, so no charge
             return 0
 
+    def _tenant_usage_totals_for_period(self, context, period_start,
+                                        period_stop, tenant_id=None):
+        compute_api = api.API()
+        totals = compute_api.get_usage_totals_by_window(context,
+                                                        period_start,
+                                                        period_stop,
+                                                        tenant_id)
+        rval = []
+        for values in totals:
+            summary = {}
+            summary['tenant_id'] = values['project_id']
+            summary['total_local_gb_usage'] = values['local_gb_hours']
+            summary['total_vcpus_usage'] = values['vcpus_hours']
+            summary['total_memory_mb_usage'] = values['memory_mb_hours']
+            summary['total_hours'] = values['hours']
+            summary['start'] = period_start
+            summary['stop'] = period_stop
+            rval.append(summary)
+        return rval
+
     def _tenant_usages_for_period(self, context, period_start,
                                   period_stop, tenant_id=None, detailed=True):
+        if not detailed:
+            # NOTE: without per server usages the totals are aggregated
+            # by the database instead of loading every instance
+            return self._tenant_usage_totals_for_period(context,
+                                                        period_start,
+                                                        period_stop,
+                                                        tenant_id)
 
         compute_api = api.API()
         instances = compute_api.get_active_by_window(context,
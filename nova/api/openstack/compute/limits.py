@@ -17,8 +17,8 @@
 Module dedicated functions/classes dealing with rate limiting requests.
 """
 
-import collections
 import copy
+import hashlib
 import httplib
 import json
 import math
@@ -31,11 +31,31 @@ import webob.exc
 from nova.api.openstack.compute.views import limits as limits_views
 from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
+from nova import flags
+from nova import log as logging
+from nova.openstack.common import cfg
 from nova import quota
 from nova import utils
 from nova import wsgi as base_wsgi
 
 
+limits_opts = [
+    cfg.IntOpt('rate_limit_max_users',
+               default=10000,
+               help='Maximum number of users whose rate limit state each '
+                    'API worker keeps; the least recently seen are '
+                    'forgotten'),
+    cfg.BoolOpt('rate_limit_use_memcached',
+                default=False,
+                help='Keep rate limit state in memcached_servers, so that '
+                     'all API workers enforce the limits together'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(limits_opts)
+LOG = logging.getLogger(__name__)
+
+
 # Convenience constants for the limits dictionary passed to Limiter().
 PER_SECOND = 1
 PER_MINUTE = 60
@@ -148,9 +168,21 @@ class Limit(object):
         @param verb: string http verb (POST, GET, etc.)
         @param url: string URL
         """
-        if self.verb != verb or not re.match(self.regex, url):
+        if not self.matches(verb, url):
             return
 
+        return self.record()
+
+    def matches(self, verb, url):
+        """Determine whether a request is subject to this limit."""
+        return self.verb == verb and re.match(self.regex, url)
+
+    def record(self):
+        """
+        Record a request against this limit.
+
+        @return: Seconds until the request would be allowed, or None
+        """
         now = self._get_time()
 
         if self.last_request is None:
@@ -182,6 +214,18 @@ class Limit(object):
         """Retrieve the current time. Broken out for testability."""
         return time.time()
 
+    def get_state(self):
+        """Return the state of the bucket as a tuple."""
+        return (self.water_level, self.last_request, self.next_request,
+                self.remaining)
+
+    def set_state(self, state):
+        """Restore state from get_state(), or reset it if None."""
+        if state is None:
+            state = (0, None, None, self.value)
+        (self.water_level, self.last_request, self.next_request,
+         self.remaining) = state
+
     def display_unit(self):
         """Display the string name of the unit."""
         return self.UNITS.get(self.unit, "UNKNOWN")
@@ -272,11 +316,66 @@ class RateLimitingMiddleware(base_wsgi.Middleware):
         return self.application
 
 
+def _group_by_verb(limits):
+    """Map each HTTP verb to the indexes of the limits applying to it."""
+    verbs = {}
+    for index, limit in enumerate(limits):
+        verbs.setdefault(limit.verb, []).append(index)
+    return verbs
+
+
+class UserLimits(object):
+    """
+    Per-user copies of the limits, kept for the most recent users.
+
+    Users with limits of their own are always kept.  Everyone else
+    gets a copy of the default limits on first use, which is forgotten
+    once `max_users` other users have been seen since.
+    """
+
+    def __init__(self, limits, max_users):
+        self.limits = limits
+        self.configured = {}
+        self.recent = utils.LRUCache(max_users)
+        self._verbs = {}
+        self._default_verbs = _group_by_verb(limits)
+
+    def __getitem__(self, username):
+        if username in self.configured:
+            return self.configured[username]
+
+        levels = self.recent.get(username)
+        if levels is None:
+            # Limit attributes are all immutable, so shallow copies of
+            # each will do, and are much cheaper than a deepcopy()
+            levels = [copy.copy(limit) for limit in self.limits]
+            self.recent[username] = levels
+        return levels
+
+    def __setitem__(self, username, limits):
+        """Give a user limits of their own."""
+        self.recent.pop(username, None)
+        self.configured[username] = limits
+        self._verbs[username] = _group_by_verb(limits)
+
+    def candidates(self, username, verb):
+        """Return the (index, limit) pairs of a user's limits for a verb."""
+        levels = self[username]
+        verbs = self._verbs.get(username, self._default_verbs)
+        return [(index, levels[index]) for index in verbs.get(verb, ())]
+
+
 class Limiter(object):
     """
     Rate-limit checking class which handles limits in memory.
+
+    With rate_limit_use_memcached set, the state of the limits is kept
+    in memcached instead, so that it is shared by all API workers.
     """
 
+    # Attempts to update a limit in memcached before giving up
+    CAS_RETRIES = 5
+
     def __init__(self, limits, **kwargs):
         """
         Initialize the new `Limiter`.
@@ -284,7 +383,7 @@ class Limiter(object):
         @param limits: List of `Limit` objects
         """
         self.limits = copy.deepcopy(limits)
-        self.levels = collections.defaultdict(lambda: copy.deepcopy(limits))
+        self.levels = UserLimits(limits, FLAGS.rate_limit_max_users)
 
         # Pick up any per-user limit information
         for key, value in kwargs.items():
@@ -292,6 +391,15 @@ class Limiter(object):
                 username = key[5:]
                 self.levels[username] = self.parse_limits(value)
 
+        self._cache = None
+        if FLAGS.rate_limit_use_memcached:
+            if FLAGS.memcached_servers:
+                import memcache
+            else:
+                from nova.common import memorycache as memcache
+            self._cache = memcache.Client(FLAGS.memcached_servers, debug=0,
+                                          cache_cas=True)
+
     def get_limits(self, username=None):
         """
         Return the limits for a given user.
@@ -306,8 +414,14 @@ class Limiter(object):
         """
         delays = []
 
-        for limit in self.levels[username]:
-            delay = limit(verb, url)
+        for index, limit in self.levels.candidates(username, verb):
+            if self._cache is None:
+                delay = limit(verb, url)
+            elif limit.matches(verb, url):
+                delay = self._record_shared(username, limit)
+            else:
+                continue
+
             if delay:
                 delays.append((delay, limit.error_message))
 
@@ -317,6 +431,41 @@ class Limiter(object):
 
         return None, None
 
+    def _record_shared(self, username, limit):
+        """
+        Record a request against a limit whose state is in memcached.
+
+        The state is updated with gets/cas, starting over if another
+        worker changed it in the meantime, so that concurrent requests
+        cannot both take the last slot.  If every attempt loses the race
+        the request is treated as over the limit.
+        """
+        key = 'ratelimit-%s' % hashlib.md5(repr((username, limit.verb,
+                limit.regex, limit.value, limit.unit))).hexdigest()
+
+        for attempt in xrange(self.CAS_RETRIES):
+            state = self._cache.gets(key)
+            limit.set_state(state)
+            delay = limit.record()
+
+            if state is None:
+                stored = self._cache.add(key, limit.get_state(),
+                                         time=limit.unit)
+            else:
+                stored = self._cache.cas(key, limit.get_state(),
+                                         time=limit.unit)
+            if stored:
+                break
+        else:
+            LOG.warn(_("Could not record a %(verb)s request to %(uri)s "
+                       "against its rate limit after %(retries)d attempts, "
+                       "rejecting it"),
+                     {'verb': limit.verb, 'uri': limit.uri,
+                      'retries': self.CAS_RETRIES})
+            delay = delay or limit.request_value
+
+        return delay
+
     # Note: This method gets called before the class is instantiated,
     # so this must be either a static method or a class method.  It is
     # used to develop a list of limits to feed to the constructor.  We
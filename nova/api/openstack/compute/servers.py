@@ -393,9 +393,16 @@ class Controller(wsgi.Controller):
         return None
 
     def _add_instance_faults(self, ctxt, instances):
-        faults = self.compute_api.get_instance_faults(ctxt, instances)
+        # Faults are only shown for instances in a fault status, so
+        # don't bother fetching them for the rest.
+        fault_statuses = self._view_builder._fault_statuses
+        faulted = [instance for instance in instances
+                   if common.status_from_state(instance.get('vm_state'),
+                                               instance.get('task_state'))
+                   in fault_statuses]
+        faults = self.compute_api.get_instance_faults(ctxt, faulted)
         if faults is not None:
-            for instance in instances:
+            for instance in faulted:
                 faults_list = faults.get(instance['uuid'], [])
                 try:
                     instance['fault'] = faults_list[0]
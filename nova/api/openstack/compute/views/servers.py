@@ -92,7 +92,7 @@ class ViewBuilder(common.ViewBuilder):
                 "tenant_id": instance.get("project_id") or "",
                 "user_id": instance.get("user_id") or "",
                 "metadata": self._get_metadata(instance),
-                "hostId": self._get_host_id(instance) or "",
+                "hostId": self._get_host_id(request, instance) or "",
                 "image": self._get_image(request, instance),
                 "flavor": self._get_flavor(request, instance),
                 "created": utils.isotime(instance["created_at"]),
@@ -120,8 +120,17 @@ class ViewBuilder(common.ViewBuilder):
 
     def detail(self, request, instances):
         """Detailed view of a list of instance."""
+        self._prefetch_networks(request, instances)
         return self._list_view(self.show, request, instances)
 
+    def _prefetch_networks(self, request, instances):
+        """Convert the cached network info of all listed instances."""
+        context = request.environ["nova.context"]
+        instances = [instance for instance in instances
+                     if not instance.get("_is_precooked")]
+        networks = common.get_networks_for_instances(context, instances)
+        common.get_request_cache(request, "networks").update(networks)
+
     def _list_view(self, func, request, servers):
         """Provide a view for a list of servers."""
         server_list = [func(request, server)["server"] for server in servers]
@@ -144,22 +153,37 @@ class ViewBuilder(common.ViewBuilder):
                                         instance.get("task_state"))
 
     @staticmethod
-    def _get_host_id(instance):
+    def _get_host_id(request, instance):
         host = instance.get("host")
         project = str(instance.get("project_id"))
-        if host:
+        if not host:
+            return None
+
+        host_ids = common.get_request_cache(request, "host_ids")
+        key = (project, host)
+        if key not in host_ids:
             sha_hash = hashlib.sha224(project + host)  # pylint: disable=E1101
-            return sha_hash.hexdigest()
+            host_ids[key] = sha_hash.hexdigest()
+        return host_ids[key]
 
     def _get_addresses(self, request, instance):
-        context = request.environ["nova.context"]
-        networks = common.get_networks_for_instance(context, instance)
+        networks = common.get_request_cache(request, "networks")
+        if instance["uuid"] in networks:
+            networks = networks[instance["uuid"]]
+        else:
+            context = request.environ["nova.context"]
+            networks = common.get_networks_for_instance(context, instance)
         return self._address_builder.index(networks)["addresses"]
 
     def _get_image(self, request, instance):
         image_ref = instance["image_ref"]
-        image_id = str(common.get_id_from_href(image_ref))
-        bookmark = self._image_builder._get_bookmark_link(request, image_id)
+        image_links = common.get_request_cache(request, "image_links")
+        if image_ref not in image_links:
+            image_id = str(common.get_id_from_href(image_ref))
+            bookmark = self._image_builder._get_bookmark_link(request,
+                                                              image_id)
+            image_links[image_ref] = (image_id, bookmark)
+        image_id, bookmark = image_links[image_ref]
         return {
             "id": image_id,
             "links": [{
@@ -170,11 +194,17 @@ class ViewBuilder(common.ViewBuilder):
 
     def _get_flavor(self, request, instance):
         flavor_id = instance["instance_type"]["flavorid"]
-        flavor_ref = self._flavor_builder._get_href_link(request, flavor_id)
-        flavor_bookmark = self._flavor_builder._get_bookmark_link(request,
-                                                                  flavor_id)
+        flavor_links = common.get_request_cache(request, "flavor_links")
+        if flavor_id not in flavor_links:
+            flavor_ref = self._flavor_builder._get_href_link(request,
+                                                             flavor_id)
+            flavor_bookmark = self._flavor_builder._get_bookmark_link(
+                    request, flavor_id)
+            flavor_links[flavor_id] = (
+                    str(common.get_id_from_href(flavor_ref)), flavor_bookmark)
+        flavor_ref_id, flavor_bookmark = flavor_links[flavor_id]
         return {
-            "id": str(common.get_id_from_href(flavor_ref)),
+            "id": flavor_ref_id,
             "links": [{
                 "rel": "bookmark",
                 "href": flavor_bookmark,
@@ -15,6 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import operator
 import os.path
 
 from lxml import etree
@@ -27,6 +28,15 @@ XMLNS_V11 = 'http://docs.openstack.org/compute/api/v1.1'
 XMLNS_COMMON_V10 = 'http://docs.openstack.org/common/api/v1.0'
 XMLNS_ATOM = 'http://www.w3.org/2005/Atom'
 
+# Bumped whenever a template element is modified, so that render plans
+# compiled from the previous structure are discarded.
+_template_generation = 0
+
+
+def _template_changed():
+    global _template_generation
+    _template_generation += 1
+
 
 def validate_schema(xml, schema_name):
     if isinstance(xml, str):
@@ -172,6 +182,7 @@ class TemplateElement(object):
         self._text = None
         self._children = []
         self._childmap = {}
+        self._render_plans = {}
 
         # Run the incoming attributes through set() so that they
         # become selectorized
@@ -219,6 +230,7 @@ class TemplateElement(object):
 
         self._children.append(elem)
         self._childmap[elem.tag] = elem
+        _template_changed()
 
     def extend(self, elems):
         """Append children to the element."""
@@ -240,6 +252,7 @@ class TemplateElement(object):
         # Update the children
         self._children.extend(elemlist)
         self._childmap.update(elemmap)
+        _template_changed()
 
     def insert(self, idx, elem):
         """Insert a child element at the given index."""
@@ -253,6 +266,7 @@ class TemplateElement(object):
 
         self._children.insert(idx, elem)
         self._childmap[elem.tag] = elem
+        _template_changed()
 
     def remove(self, elem):
         """Remove a child element."""
@@ -266,6 +280,7 @@ class TemplateElement(object):
 
         self._children.remove(elem)
         del self._childmap[elem.tag]
+        _template_changed()
 
     def get(self, key):
         """Get an attribute.
@@ -296,6 +311,7 @@ class TemplateElement(object):
             value = Selector(value)
 
         self.attrib[key] = value
+        _template_changed()
 
     def keys(self):
         """Return the attribute names."""
@@ -453,9 +469,11 @@ class TemplateElement(object):
             value = Selector(value)
 
         self._text = value
+        _template_changed()
 
     def _text_del(self):
         self._text = None
+        _template_changed()
 
     text = property(_text_get, _text_set, _text_del)
 
@@ -512,6 +530,175 @@ def SubTemplateElement(parent, tag, attrib=None, selector=None,
     return elem
 
 
+def _renders_generically(elem):
+    """Determine whether a template element customizes rendering.
+
+    Elements overriding render(), _render() or apply() cannot be
+    compiled, so their render plans defer to those methods.
+    """
+
+    for name in ('render', '_render', 'apply'):
+        method = getattr(elem.__class__, name).im_func
+        if method is not getattr(TemplateElement, name).im_func:
+            return True
+    return False
+
+
+def _attribute_getter(selector):
+    """Compile an attribute selector.
+
+    Returns a callable taking an object and returning the attribute
+    datum, or raising KeyError or IndexError if there is none.  Plain
+    single-key selectors are turned into an operator.itemgetter().
+    """
+
+    if (selector.__class__ is Selector and len(selector.chain) == 1 and
+        not callable(selector.chain[0])):
+        return operator.itemgetter(selector.chain[0])
+    return lambda obj: selector(obj, True)
+
+
+class RenderPlan(object):
+    """Represent a compiled template.
+
+    A render plan merges a template element with the like-named
+    elements of the slave templates ("patches") and resolves once the
+    attribute selectors, text selectors and child plans which
+    Template._serialize() otherwise recomputes for every element of
+    every object serialized.  Plans are cached on the root template
+    element by get_render_plan().
+    """
+
+    def __init__(self, siblings):
+        """Compile a render plan.
+
+        :param siblings: The TemplateElement instances to merge; the
+                         first is the element to render and the rest
+                         are patches applied to it.
+        """
+
+        elem = siblings[0]
+        self.generation = _template_generation
+        self.elem = elem
+        self.patches = siblings[1:]
+        self.generic = any(_renders_generically(sib) for sib in siblings)
+
+        self.tag = elem.tag
+        self.dyntag = callable(elem.tag)
+        self.selector = elem.selector
+        self.subselector = elem.subselector
+        self.will_render = elem.will_render
+
+        # Text and attribute selectors, in the order apply() uses them
+        self.text = []
+        self.attrib = []
+        for sib in siblings:
+            if sib.text is not None:
+                self.text.append(sib.text)
+            self.attrib.extend([(key, _attribute_getter(value))
+                                for key, value in sib.attrib.items()])
+
+        # Merge the children the same way _serialize() does
+        self.children = []
+        seen = set()
+        for idx, sibling in enumerate(siblings):
+            for child in sibling:
+                if child.tag in seen:
+                    continue
+                seen.add(child.tag)
+
+                nieces = [child]
+                for sib in siblings[idx + 1:]:
+                    if child.tag in sib:
+                        nieces.append(sib[child.tag])
+                self.children.append(RenderPlan(nieces))
+
+    def _make_element(self, parent, datum, nsmap):
+        """Create an etree.Element for one datum and append it."""
+
+        tagname = self.tag(datum) if self.dyntag else self.tag
+        if parent is not None:
+            elem = etree.SubElement(parent, tagname, nsmap=nsmap)
+        else:
+            elem = etree.Element(tagname, nsmap=nsmap)
+
+        if datum is None:
+            return elem
+
+        for text in self.text:
+            elem.text = unicode(text(datum))
+        for key, getter in self.attrib:
+            try:
+                elem.set(key, unicode(getter(datum)))
+            except (KeyError, IndexError):
+                # Attribute has no value, so don't include it
+                pass
+
+        return elem
+
+    def render(self, parent, obj, nsmap=None):
+        """Render an object.
+
+        Equivalent to TemplateElement.render() with the patches
+        applied; returns a list of (etree.Element, datum) tuples.
+        """
+
+        if self.generic:
+            return self.elem.render(parent, obj, self.patches, nsmap)
+
+        data = None if obj is None else self.selector(obj)
+
+        if not self.will_render(data):
+            return []
+        elif data is None:
+            return [(self._make_element(parent, None, nsmap), None)]
+
+        if not isinstance(data, list):
+            data = [data]
+        elif parent is None:
+            raise ValueError(_('root element selecting a list'))
+
+        elems = []
+        subselector = self.subselector
+        for datum in data:
+            if subselector is not None:
+                datum = subselector(datum)
+            elems.append((self._make_element(parent, datum, nsmap), datum))
+        return elems
+
+    def execute(self, parent, obj, nsmap=None):
+        """Execute the render plan.
+
+        Builds the tree of etree.Element instances for an object.
+        Returns the first etree.Element instance rendered, or None.
+        """
+
+        elems = self.render(parent, obj, nsmap)
+        for child in self.children:
+            for elem, datum in elems:
+                child.execute(elem, datum)
+
+        if elems:
+            return elems[0][0]
+
+
+def get_render_plan(siblings):
+    """Return the render plan for a list of sibling elements.
+
+    The plan is compiled on first use and cached on the first sibling,
+    keyed on the identity of the others, until any template element
+    is modified.
+    """
+
+    root = siblings[0]
+    key = tuple(siblings[1:])
+    plan = root._render_plans.get(key)
+    if plan is None or plan.generation != _template_generation:
+        plan = RenderPlan(siblings)
+        root._render_plans[key] = plan
+    return plan
+
+
 class Template(object):
     """Represent a template."""
 
@@ -610,7 +797,7 @@ class Template(object):
         nsmap = self._nsmap()
 
         # Form the element tree
-        return self._serialize(None, obj, siblings, nsmap)
+        return get_render_plan(siblings).execute(None, obj, nsmap)
 
     def _siblings(self):
         """Hook method for computing root siblings.
@@ -18,47 +18,159 @@
 
 """Super simple fake memcache client."""
 
+import heapq
+import threading
+
+from nova import flags
+from nova.openstack.common import cfg
 from nova import utils
 
 
+memorycache_opts = [
+    cfg.IntOpt('memorycache_max_size',
+               default=100000,
+               help='Maximum number of keys kept by the in process cache '
+                    'used when memcached_servers is not set; the least '
+                    'recently used are evicted'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(memorycache_opts)
+
+# Like memcached, expiry times longer than 30 days are taken to be
+# absolute unix timestamps rather than an offset from now
+MAX_RELATIVE_TIME = 60 * 60 * 24 * 30
+
+
 class Client(object):
     """Replicates a tiny subset of memcached client interface."""
 
     def __init__(self, *args, **kwargs):
         """Ignores the passed in args."""
-        self.cache = {}
+        # key -> (timeout, value), a timeout of 0 never expires
+        self.cache = utils.LRUCache(FLAGS.memorycache_max_size)
+        self.cas_ids = {}
+        # Heap of (timeout, key) for the keys set with an expiry; the
+        # entry for a key that was since reset or evicted is stale and
+        # skipped when it reaches the top.
+        self._expiries = []
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key, now):
+        """Returns the live (timeout, value) for a key or None."""
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] and now >= entry[0]:
+            del self.cache[key]
+            return None
+        return entry
+
+    def _set_entry(self, key, value, time, now):
+        timeout = 0
+        if time:
+            timeout = time if time > MAX_RELATIVE_TIME else now + time
+        entry = (timeout, value)
+        self.cache[key] = entry
+        if timeout:
+            heapq.heappush(self._expiries, (timeout, key))
+        self._expunge(now)
+        return entry
+
+    def _expunge(self, now):
+        """Drops the expired keys, amortized O(log n) per set."""
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            timeout, key = heapq.heappop(expiries)
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == timeout:
+                del self.cache[key]
+
+        # Keys reset or evicted before expiring leave stale heap
+        # entries behind, rebuild the heap once they dominate it.
+        if len(expiries) > 2 * len(self.cache) + 64:
+            self._expiries = [(entry[0], key)
+                              for key, entry in self._items()
+                              if entry[0]]
+            heapq.heapify(self._expiries)
+
+    def _items(self):
+        return [(key, self.cache.get(key)) for key in list(self.cache)]
 
     def get(self, key):
-        """Retrieves the value for a key or None.
+        """Retrieves the value for a key or None."""
+        with self._lock:
+            entry = self._get_entry(key, utils.utcnow_ts())
+        if entry is None:
+            return None
+        return entry[1]
 
-        this expunges expired keys during each get"""
+    def gets(self, key):
+        """Retrieves the value for a key, remembering it for cas()."""
+        with self._lock:
+            entry = self._get_entry(key, utils.utcnow_ts())
+            if entry is None:
+                self.cas_ids.pop(key, None)
+                return None
+            self.cas_ids[key] = entry
+            return entry[1]
 
-        for k in self.cache.keys():
-            (timeout, _value) = self.cache[k]
-            if timeout and utils.utcnow_ts() >= timeout:
-                del self.cache[k]
+    def cas(self, key, value, time=0, min_compress_len=0):
+        """Sets the value for a key if it is unchanged since gets().
 
-        return self.cache.get(key, (0, None))[1]
+        Like memcache.Client, this is a plain set() for a key that was
+        not fetched with gets().
+        """
+        with self._lock:
+            now = utils.utcnow_ts()
+            if key in self.cas_ids:
+                if self._get_entry(key, now) is not self.cas_ids.pop(key):
+                    return False
+            self._set_entry(key, value, time, now)
+            return True
 
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
-        timeout = 0
-        if time != 0:
-            timeout = utils.utcnow_ts() + time
-        self.cache[key] = (timeout, value)
-        return True
+        with self._lock:
+            self._set_entry(key, value, time, utils.utcnow_ts())
+            return True
 
     def add(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key if it doesn't exist."""
-        if not self.get(key) is None:
-            return False
-        return self.set(key, value, time, min_compress_len)
+        with self._lock:
+            now = utils.utcnow_ts()
+            if self._get_entry(key, now) is not None:
+                return False
+            self._set_entry(key, value, time, now)
+            return True
+
+    def delete(self, key, time=0):
+        """Deletes the value for a key."""
+        with self._lock:
+            self.cache.pop(key, None)
+            return 1
 
     def incr(self, key, delta=1):
-        """Increments the value for a key."""
-        value = self.get(key)
-        if value is None:
-            return None
-        new_value = int(value) + delta
-        self.cache[key] = (self.cache[key][0], str(new_value))
-        return new_value
+        """Increments the value for a key, keeping its expiry.
+
+        Returns the new value, or None if the key doesn't exist.
+        """
+        return self._change(key, lambda value: value + delta)
+
+    def decr(self, key, delta=1):
+        """Decrements the value for a key, not going below 0."""
+        return self._change(key, lambda value: max(value - delta, 0))
+
+    def _change(self, key, change):
+        with self._lock:
+            entry = self._get_entry(key, utils.utcnow_ts())
+            if entry is None:
+                return None
+            new_value = change(int(entry[1]))
+            self.cache[key] = (entry[0], str(new_value))
+            return new_value
+
+    def flush_all(self):
+        """Deletes every key."""
+        with self._lock:
+            self.cache.clear()
+            self.cas_ids.clear()
+            self._expiries = []
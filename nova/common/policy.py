@@ -18,6 +18,7 @@
 """Common Policy Engine Implementation"""
 
 import json
+import re
 import urllib
 import urllib2
 
@@ -45,6 +46,14 @@ def reset():
     _BRAIN = None
 
 
+def get_brain():
+    """Returns the brain used by enforce(), a Brain() if not set."""
+    global _BRAIN
+    if not _BRAIN:
+        _BRAIN = Brain()
+    return _BRAIN
+
+
 def enforce(match_list, target_dict, credentials_dict):
     """Enforces authorization of some rules against credentials.
 
@@ -109,13 +118,81 @@ def enforce(match_list, target_dict, credentials_dict):
     :raises NotAuthorized: if the check fails
 
     """
-    global _BRAIN
-    if not _BRAIN:
-        _BRAIN = Brain()
-    if not _BRAIN.check(match_list, target_dict, credentials_dict):
+    if not get_brain().check(match_list, target_dict, credentials_dict):
         raise NotAuthorized()
 
 
+class Check(object):
+    """A match list compiled by Brain.compile().
+
+    Called with a target dict and a credentials dict, returns True if
+    the check passes.  target_keys and cred_keys are the keys the
+    result depends on; when cacheable is False it depends on more
+    than those, for instance on a remote server.
+
+    """
+
+    def __init__(self, func, target_keys=(), cred_keys=(), cacheable=True):
+        self.func = func
+        self.target_keys = tuple(sorted(set(target_keys)))
+        self.cred_keys = tuple(sorted(set(cred_keys)))
+        self.cacheable = cacheable
+
+    def __call__(self, target_dict, cred_dict):
+        return self.func(target_dict, cred_dict)
+
+    @classmethod
+    def combine(cls, func, checks):
+        """Makes a Check calling func, which depends on checks."""
+        target_keys = []
+        cred_keys = []
+        for check in checks:
+            target_keys.extend(check.target_keys)
+            cred_keys.extend(check.cred_keys)
+        return cls(func, target_keys, cred_keys,
+                   all([check.cacheable for check in checks]))
+
+
+def _true_check(target_dict, cred_dict):
+    return True
+
+
+def _false_check(target_dict, cred_dict):
+    return False
+
+
+def _all_of(checks):
+    if len(checks) == 1:
+        return checks[0]
+    funcs = [check.func for check in checks]
+
+    def check_all(target_dict, cred_dict):
+        for func in funcs:
+            if not func(target_dict, cred_dict):
+                return False
+        return True
+    return Check.combine(check_all, checks)
+
+
+def _any_of(checks):
+    if len(checks) == 1:
+        return checks[0]
+    funcs = [check.func for check in checks]
+
+    def check_any(target_dict, cred_dict):
+        for func in funcs:
+            if func(target_dict, cred_dict):
+                return True
+        return False
+    return Check.combine(check_any, checks)
+
+
+# %(key)s references to the target dict in generic matches
+_TARGET_KEY_RE = re.compile(r'%\(([^)]*)\)')
+# Any other % conversion, which formats the target dict as a whole
+_OTHER_CONVERSION_RE = re.compile(r'%(?![(%])')
+
+
 class Brain(object):
     """Implements policy checking."""
     @classmethod
@@ -127,9 +204,105 @@ class Brain(object):
     def __init__(self, rules=None, default_rule=None):
         self.rules = rules or {}
         self.default_rule = default_rule
+        self._compiled_rules = {}
+        self._compiled_lists = {}
+        self._compiling = set()
 
     def add_rule(self, key, match):
         self.rules[key] = match
+        self._compiled_rules.clear()
+        self._compiled_lists.clear()
+
+    def compile(self, match_list):
+        """Compiles a match list into a Check.
+
+        Rules are compiled once, checks whose _check_* method is
+        overridden by a subclass are called through that method.
+
+        """
+        try:
+            return self._compiled_lists[match_list]
+        except TypeError:
+            # lists from json rules aren't hashable
+            return self._compile(match_list)
+        except KeyError:
+            check = self._compile(match_list)
+            self._compiled_lists[match_list] = check
+            return check
+
+    def _compile(self, match_list):
+        if not match_list:
+            return Check(_true_check)
+        checks = []
+        for and_list in match_list:
+            if isinstance(and_list, basestring):
+                and_list = (and_list,)
+            checks.append(_all_of([self._compile_match(item)
+                                   for item in and_list]))
+        return _any_of(checks)
+
+    def _compile_match(self, match):
+        match_kind, match_value = match.split(':', 1)
+        try:
+            f = getattr(self, '_check_%s' % match_kind)
+        except AttributeError:
+            return self._compile_generic(match)
+
+        base = getattr(Brain, '_check_%s' % match_kind, None)
+        if base is not None and f.im_func is base.im_func:
+            return getattr(self, '_compile_%s' % match_kind)(match_value)
+
+        def check_method(target_dict, cred_dict):
+            return f(match_value, target_dict, cred_dict)
+        return Check(check_method, cacheable=False)
+
+    def _compile_rule(self, match):
+        check = self._compiled_rules.get(match)
+        if check is not None:
+            return check
+
+        if match in self._compiling:
+            # A rule referring back to itself, only resolved when checked
+            def check_recursive(target_dict, cred_dict):
+                return self._compile_rule(match)(target_dict, cred_dict)
+            return Check(check_recursive, cacheable=False)
+
+        self._compiling.add(match)
+        try:
+            if match in self.rules:
+                check = self._compile(self.rules[match])
+            elif self.default_rule and match != self.default_rule:
+                check = self._compile_rule(self.default_rule)
+            else:
+                check = Check(_false_check)
+        finally:
+            self._compiling.discard(match)
+        self._compiled_rules[match] = check
+        return check
+
+    def _compile_role(self, match):
+        role = match.lower()
+
+        def check_role(target_dict, cred_dict):
+            return role in [x.lower() for x in cred_dict['roles']]
+        return Check(check_role, cred_keys=('roles',))
+
+    def _compile_generic(self, match):
+        if '%' not in match:
+            key, value = match.split(':', 1)
+
+            def check_constant(target_dict, cred_dict):
+                return key in cred_dict and value == cred_dict[key]
+            return Check(check_constant, cred_keys=(key,))
+
+        cred_key = match.split(':', 1)[0]
+        cacheable = ('%' not in cred_key and
+                     not _OTHER_CONVERSION_RE.search(match.replace('%%', '')))
+
+        def check_template(target_dict, cred_dict):
+            return self._check_generic(match, target_dict, cred_dict)
+        return Check(check_template, _TARGET_KEY_RE.findall(match),
+                     (cred_key,), cacheable)
 
     def _check(self, match, target_dict, cred_dict):
         match_kind, match_value = match.split(':', 1)
@@ -155,27 +328,11 @@ class Brain(object):
         :returns: True if the check passes
 
         """
-        if not match_list:
-            return True
-        for and_list in match_list:
-            if isinstance(and_list, basestring):
-                and_list = (and_list,)
-            if all([self._check(item, target_dict, cred_dict)
-                    for item in and_list]):
-                return True
-        return False
+        return self.compile(match_list)(target_dict, cred_dict)
 
     def _check_rule(self, match, target_dict, cred_dict):
         """Recursively checks credentials based on the brains rules."""
-        try:
-            new_match_list = self.rules[match]
-        except KeyError:
-            if self.default_rule and match != self.default_rule:
-                new_match_list = ('rule:%s' % self.default_rule,)
-            else:
-                return False
-
-        return self.check(new_match_list, target_dict, cred_dict)
+        return self._compile_rule(match)(target_dict, cred_dict)
 
     def _check_role(self, match, target_dict, cred_dict):
         """Check that there is a matching role in the cred dict."""
@@ -20,6 +20,7 @@
 """Handles all requests relating to compute resources (e.g. guest vms,
 networking and storage of vms, and compute hosts on which they run)."""
 
+import datetime
 import functools
 import re
 import time
@@ -205,6 +206,22 @@ class API(base.Base):
                 LOG.warn(msg)
                 raise exception.QuotaError(code="MetadataLimitExceeded")
 
+    def _reserve_instances(self, context, num_instances, instance_type):
+        """Reserve quota for instances until they are created.
+
+        Raises a QuotaError if a concurrent request used up the quota.
+        """
+        try:
+            return quota.reserve(context,
+                    instances=num_instances,
+                    cores=num_instances * instance_type['vcpus'],
+                    ram=num_instances * instance_type['memory_mb'])
+        except exception.OverQuota:
+            pid = context.project_id
+            LOG.warn(_("Quota exceeded for %(pid)s, tried to run "
+                       "%(num_instances)s instances") % locals())
+            raise exception.QuotaError(code="InstanceLimitExceeded")
+
     def _check_requested_networks(self, context, requested_networks):
         """ Check if the networks requested belongs to the project
             and the fixed IP address for each network provided is within
@@ -382,33 +399,40 @@ class API(base.Base):
 
         LOG.debug(_("Going to run %s instances...") % num_instances)
 
-        if create_instance_here:
-            instance = self.create_db_entry_for_new_instance(
-                    context, instance_type, image, base_options,
-                    security_group, block_device_mapping)
-            # Tells scheduler we created the instance already.
-            base_options['uuid'] = instance['uuid']
-            rpc_method = rpc.cast
-        else:
-            # We need to wait for the scheduler to create the instance
-            # DB entries, because the instance *could* be # created in
-            # a child zone.
-            rpc_method = rpc.call
-
-        # TODO(comstud): We should use rpc.multicall when we can
-        # retrieve the full instance dictionary from the scheduler.
-        # Otherwise, we could exceed the AMQP max message size limit.
-        # This would require the schedulers' schedule_run_instances
-        # methods to return an iterator vs a list.
-        instances = self._schedule_run_instance(
-                rpc_method,
-                context, base_options,
-                instance_type,
-                availability_zone, injected_files,
-                admin_password, image,
-                num_instances, requested_networks,
-                block_device_mapping, security_group,
-                filter_properties)
+        reservations = self._reserve_instances(context, num_instances,
+                                               instance_type)
+        try:
+            if create_instance_here:
+                instance = self.create_db_entry_for_new_instance(
+                        context, instance_type, image, base_options,
+                        security_group, block_device_mapping)
+                # Tells scheduler we created the instance already.
+                base_options['uuid'] = instance['uuid']
+                rpc_method = rpc.cast
+            else:
+                # We need to wait for the scheduler to create the instance
+                # DB entries, because the instance *could* be # created in
+                # a child zone.
+                rpc_method = rpc.call
+
+            # TODO(comstud): We should use rpc.multicall when we can
+            # retrieve the full instance dictionary from the scheduler.
+            # Otherwise, we could exceed the AMQP max message size limit.
+            # This would require the schedulers' schedule_run_instances
+            # methods to return an iterator vs a list.
+            instances = self._schedule_run_instance(
+                    rpc_method,
+                    context, base_options,
+                    instance_type,
+                    availability_zone, injected_files,
+                    admin_password, image,
+                    num_instances, requested_networks,
+                    block_device_mapping, security_group,
+                    filter_properties)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                quota.rollback(context, reservations)
+        quota.commit(context, reservations)
 
         if create_instance_here:
             return ([instance], reservation_id)
@@ -1008,6 +1032,45 @@ class API(base.Base):
         return self.db.instance_get_active_by_window(context, begin, end,
                                                      project_id)
 
+    def get_usage_totals_by_window(self, context, begin, end,
+                                   project_id=None):
+        """Get per-project usage totals of instances active over a window.
+
+        Whole hours that have been rolled up are read from the hourly
+        rollups, the rest of the window is aggregated from the instances.
+        """
+        segments = [(begin, end, False)]
+        first, last = self.db.instance_usage_rollup_get_range(context)
+        if first is not None:
+            rolled_start = begin.replace(minute=0, second=0, microsecond=0)
+            if rolled_start < begin:
+                rolled_start += datetime.timedelta(hours=1)
+            rolled_start = max(rolled_start, first)
+            rolled_stop = min(end.replace(minute=0, second=0, microsecond=0),
+                              last + datetime.timedelta(hours=1))
+            if rolled_start < rolled_stop:
+                segments = [(begin, rolled_start, False),
+                            (rolled_start, rolled_stop, True),
+                            (rolled_stop, end, False)]
+
+        totals = {}
+        for segment_begin, segment_end, rolled_up in segments:
+            if segment_begin >= segment_end:
+                continue
+            if rolled_up:
+                get_totals = self.db.instance_usage_rollup_totals
+            else:
+                get_totals = self.db.instance_usage_totals_by_window
+            for values in get_totals(context, segment_begin, segment_end,
+                                     project_id):
+                project_totals = totals.setdefault(values['project_id'],
+                                                   dict.fromkeys(values, 0))
+                for key, value in values.iteritems():
+                    if key != 'project_id':
+                        project_totals[key] += value
+                project_totals['project_id'] = values['project_id']
+        return totals.values()
+
     #NOTE(bcwaldon): this doesn't really belong in this class
     def get_instance_type(self, context, instance_type_id):
         """Get an instance type by instance type id."""
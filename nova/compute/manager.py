@@ -118,7 +118,21 @@ compute_opts = [
     cfg.IntOpt("heal_instance_info_cache_interval",
                default=60,
                help="Number of seconds between instance info_cache self "
-                        "healing updates")
+                        "healing updates"),
+    cfg.IntOpt("heal_instance_info_cache_batch_size",
+               default=10,
+               help="Number of instances whose info_cache is refreshed on "
+                    "each healing update, those healed longest ago first. "
+                    "1 refreshes a single instance at a time."),
+    cfg.BoolOpt('hypervisor_events',
+                default=False,
+                help='Track instance power states from the lifecycle events '
+                     'reported by the hypervisor, if the virt driver '
+                     'supports them'),
+    cfg.IntOpt('hypervisor_events_sync_interval',
+               default=600,
+               help='Number of seconds between full power state syncs with '
+                    'the hypervisor when lifecycle events are received'),
     ]
 
 FLAGS = flags.FLAGS
@@ -207,6 +221,11 @@ class ComputeManager(manager.SchedulerDependentManager):
         self._last_host_check = 0
         self._last_bw_usage_poll = 0
         self._last_info_cache_heal = 0
+        self._info_cache_heal_times = {}
+        self._last_power_state_sync = 0
+        self._events_active = False
+        self._vm_power_states = {}
+        self._pending_power_states = set()
 
         super(ComputeManager, self).__init__(service_name="compute",
                                              *args, **kwargs)
@@ -227,6 +246,9 @@ class ComputeManager(manager.SchedulerDependentManager):
     def init_host(self):
         """Initialization for a standalone compute service."""
         self.driver.init_host(host=self.host)
+        if FLAGS.hypervisor_events:
+            self.driver.register_event_listener(self.handle_lifecycle_event)
+            self._events_active = self.driver.start_event_monitor()
         context = nova.context.get_admin_context()
         instances = self.db.instance_get_all_by_host(context, self.host)
         for instance in instances:
@@ -255,6 +277,44 @@ class ComputeManager(manager.SchedulerDependentManager):
                     LOG.warning(_('Hypervisor driver does not support '
                                   'firewall rules'))
 
+    def handle_lifecycle_event(self, event):
+        """Record a power state change reported by the hypervisor.
+
+        The changes are written to the database from a separate
+        greenthread, so events arriving together are applied at once.
+        """
+        if self._vm_power_states.get(event.name) == event.state:
+            return
+        LOG.debug(_("Lifecycle event: %s"), event)
+        self._vm_power_states[event.name] = event.state
+        if not self._pending_power_states:
+            greenthread.spawn_n(self._sync_power_states_from_events)
+        self._pending_power_states.add(event.name)
+
+    def _sync_power_states_from_events(self):
+        """Apply the power states of the instances with pending events.
+
+        Instances with a task in progress are left alone, their state
+        is expected to change; the next full sync catches up with them.
+        """
+        names = self._pending_power_states
+        self._pending_power_states = set()
+        context = nova.context.get_admin_context()
+        try:
+            db_instances = [
+                    instance for instance in
+                    self.db.instance_get_all_by_host(context, self.host)
+                    if instance['name'] in names and
+                       instance['task_state'] is None]
+            vm_infos = {}
+            for name in names:
+                state = self._vm_power_states.get(name, power_state.NOSTATE)
+                if state != power_state.NOSTATE:
+                    vm_infos[name] = {'state': state}
+            self._update_power_states(context, db_instances, vm_infos)
+        except Exception:
+            LOG.exception(_("Error applying lifecycle events"))
+
     def _get_power_state(self, context, instance):
         """Retrieve the power state for the given instance."""
         LOG.debug(_('Checking state'), instance=instance)
@@ -2195,6 +2255,11 @@ class ComputeManager(manager.SchedulerDependentManager):
             return
         self._last_info_cache_heal = curr_time
 
+        batch_size = FLAGS.heal_instance_info_cache_batch_size
+        if batch_size > 1:
+            self._heal_instance_info_cache_batch(context, batch_size)
+            return
+
         instance_uuids = getattr(self, '_instance_uuids_to_heal', None)
         instance = None
 
@@ -2228,6 +2293,51 @@ class ComputeManager(manager.SchedulerDependentManager):
             # We don't care about any failures
             pass
 
+    def _heal_instance_info_cache_batch(self, context, batch_size):
+        """Update the info_cache of batch_size instances with one call to
+        the network manager.
+
+        The instances on this host are listed once per cycle through
+        them, ordered by when their cache was last healed, never healed
+        first. The other runs of the cycle only load the instances of
+        their batch.
+        """
+        heal_times = self._info_cache_heal_times
+        instance_uuids = getattr(self, '_instance_uuids_to_heal', None)
+
+        if instance_uuids:
+            batch = instance_uuids[:batch_size]
+            del instance_uuids[:batch_size]
+            instances = [instance for instance in
+                         self.db.instance_get_all_by_filters(context,
+                                {'uuid': batch, 'deleted': False})
+                         if instance['host'] == self.host]
+        else:
+            db_instances = self.db.instance_get_all_by_host(context,
+                                                            self.host)
+            instance_uuids = [instance['uuid'] for instance in db_instances]
+            for instance_uuid in set(heal_times) - set(instance_uuids):
+                del heal_times[instance_uuid]
+            instances = sorted(db_instances, key=lambda instance:
+                               heal_times.get(instance['uuid'], 0))
+            self._instance_uuids_to_heal = [instance['uuid'] for instance in
+                                            instances[batch_size:]]
+            instances = instances[:batch_size]
+
+        if not instances:
+            return
+        try:
+            nw_infos = self.network_api.get_instances_nw_info(context,
+                                                              instances)
+        except Exception:
+            # We don't care about any failures
+            return
+        curr_time = time.time()
+        for instance_uuid in nw_infos:
+            heal_times[instance_uuid] = curr_time
+        LOG.debug(_("Updated the info_cache for %d instances"),
+                  len(nw_infos))
+
     @manager.periodic_task
     def _poll_rebooting_instances(self, context):
         if FLAGS.reboot_timeout > 0:
@@ -2283,18 +2393,25 @@ class ComputeManager(manager.SchedulerDependentManager):
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
 
-        The hypervisor is authoritative for the power_state data, but we don't
-        want to do an expensive call to the virt driver's list_instances_detail
-        method. Instead, we do a less-expensive call to get the number of
-        virtual machines known by the hypervisor and if the number matches the
-        number of virtual machines known by the database, we proceed in a lazy
-        loop, one database record at a time, checking if the hypervisor has the
-        same power state as is in the database. We call eventlet.sleep(0) after
-        each loop to allow the periodic task eventlet to do other work.
+        The hypervisor is authoritative for the power_state data. A single
+        snapshot of the state of all the instances on this host is taken
+        with the virt driver's get_info_bulk method and compared in memory
+        with the database records; the instances whose power state changed
+        are then updated together in one transaction.
 
         If the instance is not found on the hypervisor, but is in the database,
         then it will be set to power_state.NOSTATE.
+
+        When the driver reports lifecycle events this is only a safety net,
+        run every hypervisor_events_sync_interval seconds.
         """
+        if self._events_active:
+            curr_time = time.time()
+            if (curr_time - self._last_power_state_sync <
+                FLAGS.hypervisor_events_sync_interval):
+                return
+            self._last_power_state_sync = curr_time
+
         db_instances = self.db.instance_get_all_by_host(context, self.host)
 
         num_vm_instances = self.driver.get_num_instances()
@@ -2304,15 +2421,27 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        vm_infos = self.driver.get_info_bulk(db_instances)
+        self._vm_power_states = dict((name, vm_info['state'])
+                                     for name, vm_info in vm_infos.iteritems())
+        self._update_power_states(context, db_instances, vm_infos)
+
+    def _update_power_states(self, context, db_instances, vm_infos):
+        """Write the power states in vm_infos that differ from the DB.
+
+        vm_infos maps instance names to get_info() dicts; instances
+        missing from it are not known by the hypervisor.
+        """
+        updates = {}
         for db_instance in db_instances:
-            # Allow other periodic tasks to do some work...
-            greenthread.sleep(0)
             db_power_state = db_instance['power_state']
-            try:
-                vm_instance = self.driver.get_info(db_instance)
+            vm_instance = vm_infos.get(db_instance['name'])
+            if vm_instance is not None:
                 vm_power_state = vm_instance['state']
-            except exception.InstanceNotFound:
-                # This exception might have been caused by a race condition
+            else:
+                # Allow other periodic tasks to do some work...
+                greenthread.sleep(0)
+                # This might have been caused by a race condition
                 # between _sync_power_states and live migrations. Two cases
                 # are possible as documented below. To this aim, refresh the
                 # DB instance state.
@@ -2333,6 +2462,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                                    {'uuid': db_instance['uuid'],
                                     'src': self.host,
                                     'dst': u['host']})
+                        continue
                     elif (u['host'] == self.host and
                           u['vm_state'] == vm_states.MIGRATING):
                         # on the receiving end of nova-compute, it could happen
@@ -2345,6 +2475,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                                    "sync_power cycle before setting "
                                    "power state to NOSTATE")
                                    % db_instance['uuid'])
+                        continue
                     else:
                         LOG.warn(_("Instance found in database but not "
                                    "known by hypervisor. Setting power "
@@ -2363,14 +2494,13 @@ class ComputeManager(manager.SchedulerDependentManager):
                                    power_state.SHUTDOWN,
                                    power_state.CRASHED)
                 and db_instance['vm_state'] == vm_states.ACTIVE):
-                self._instance_update(context,
-                                      db_instance["id"],
-                                      power_state=vm_power_state,
-                                      vm_state=vm_states.SHUTOFF)
+                updates[db_instance['id']] = {'power_state': vm_power_state,
+                                              'vm_state': vm_states.SHUTOFF}
             else:
-                self._instance_update(context,
-                                      db_instance["id"],
-                                      power_state=vm_power_state)
+                updates[db_instance['id']] = {'power_state': vm_power_state}
+
+        if updates:
+            self.db.instance_update_power_states(context, updates)
 
     @manager.periodic_task
     def _reclaim_queued_deletes(self, context):
@@ -22,6 +22,7 @@ from nova import context
 from nova import db
 from nova import exception
 from nova import flags
+from nova import log as logging
 from nova import network
 from nova.network import model as network_model
 from nova.notifier import api as notifier_api
@@ -29,6 +30,7 @@ from nova import utils
 
 
 FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
 
 
 def notify_usage_exists(instance_ref, current_period=False):
@@ -39,7 +41,6 @@ def notify_usage_exists(instance_ref, current_period=False):
         is True."""
     admin_context = context.get_admin_context(read_deleted='yes')
     begin, end = utils.current_audit_period()
-    bw = {}
     if current_period:
         audit_start = end
         audit_end = utils.utcnow()
@@ -57,24 +58,73 @@ def notify_usage_exists(instance_ref, current_period=False):
                                                          instance_ref)
 
     macs = [vif['address'] for vif in nw_info]
-    for b in db.bw_usage_get_by_macs(admin_context,
-                                     macs,
-                                     audit_start):
+    bw_usages = db.bw_usage_get_by_macs(admin_context, macs, audit_start)
+    usage_info = _usage_exists_info(instance_ref, nw_info, bw_usages,
+                                    audit_start, audit_end)
+    notifier_api.notify('compute.%s' % FLAGS.host,
+                        'compute.instance.exists',
+                        notifier_api.INFO,
+                        usage_info)
+
+
+def notify_usage_exists_bulk(instances, audit_start, audit_end):
+    """ Generates 'exists' notifications for a batch of instances for usage
+        auditing purposes.
+
+        Unlike notify_usage_exists(), network info is only taken from the
+        instances' info caches, never fetched from the network service, and
+        bandwidth usage of the whole batch is read with a single query.
+        The notifications are published together as one batch.
+
+        Returns True if the batch was published."""
+    admin_context = context.get_admin_context(read_deleted='yes')
+    nw_infos = []
+    macs = []
+    for instance_ref in instances:
+        cached_info = (instance_ref.get('info_cache') or {}).get(
+                'network_info')
+        if cached_info:
+            nw_info = network_model.NetworkInfo.hydrate(cached_info)
+        else:
+            LOG.debug(_('No cached network info for instance %s, '
+                        'reporting no bandwidth usage'), instance_ref['uuid'])
+            nw_info = network_model.NetworkInfo()
+        nw_infos.append(nw_info)
+        macs.extend(vif['address'] for vif in nw_info)
+
+    bw_usages_by_mac = {}
+    if macs:
+        for b in db.bw_usage_get_by_macs(admin_context, macs, audit_start):
+            bw_usages_by_mac[b['mac']] = b
+
+    usage_infos = []
+    for instance_ref, nw_info in zip(instances, nw_infos):
+        bw_usages = [bw_usages_by_mac[vif['address']] for vif in nw_info
+                     if vif['address'] in bw_usages_by_mac]
+        usage_infos.append(_usage_exists_info(instance_ref, nw_info,
+                                              bw_usages, audit_start,
+                                              audit_end))
+    return notifier_api.notify_many('compute.%s' % FLAGS.host,
+                                    'compute.instance.exists',
+                                    notifier_api.INFO,
+                                    usage_infos)
+
+
+def _usage_exists_info(instance_ref, nw_info, bw_usages, audit_start,
+                       audit_end):
+    bw = {}
+    for b in bw_usages:
         label = 'net-name-not-found-%s' % b['mac']
         for vif in nw_info:
             if vif['address'] == b['mac']:
                 label = vif['network']['label']
                 break
 
-        bw[label] = dict(bw_in=b.bw_in, bw_out=b.bw_out)
-    usage_info = utils.usage_from_instance(instance_ref,
+        bw[label] = dict(bw_in=b['bw_in'], bw_out=b['bw_out'])
+    return utils.usage_from_instance(instance_ref,
                           audit_period_beginning=str(audit_start),
                           audit_period_ending=str(audit_end),
                           bandwidth=bw)
-    notifier_api.notify('compute.%s' % FLAGS.host,
-                        'compute.instance.exists',
-                        notifier_api.INFO,
-                        usage_info)
 
 
 def legacy_network_info(network_model):
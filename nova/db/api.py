@@ -65,6 +65,11 @@ db_opts = [
     cfg.StrOpt('snapshot_name_template',
                default='snapshot-%08x',
                help='Template string to be used to generate snapshot names'),
+    cfg.IntOpt('quota_usage_max_age',
+               default=86400,
+               help='number of seconds after which the usage of a project '
+                    'is recounted, 0 to only recount it when it goes '
+                    'negative'),
     ]
 
 FLAGS = flags.FLAGS
@@ -159,6 +164,18 @@ def service_update(context, service_id, values):
     return IMPL.service_update(context, service_id, values)
 
 
+def service_heartbeat(context, service_id, values=None):
+    """Atomically bump the report_count and updated_at of a service.
+
+    Any additional values are set in the same statement.  Unlike
+    service_update this does not read the service first.
+
+    Raises NotFound if service does not exist.
+
+    """
+    return IMPL.service_heartbeat(context, service_id, values)
+
+
 ###################
 
 
@@ -574,12 +591,42 @@ def instance_get_active_by_window(context, begin, end=None, project_id=None):
 
 
 def instance_get_active_by_window_joined(context, begin, end=None,
-                                         project_id=None):
+                                         project_id=None, marker=None,
+                                         limit=None):
     """Get instances and joins active during a certain time window.
 
-    Specifying a project_id will filter for a certain project."""
+    Specifying a project_id will filter for a certain project.  With a
+    limit, returns at most that many instances ordered by id, starting
+    after the instance id given as marker."""
     return IMPL.instance_get_active_by_window_joined(context, begin, end,
-                                              project_id)
+                                              project_id, marker, limit)
+
+
+def instance_usage_totals_by_window(context, begin, end, project_id=None):
+    """Get per-project usage totals of instances active during a window.
+
+    Returns a list of dicts with project_id, hours, vcpus_hours,
+    memory_mb_hours and local_gb_hours, computed by the database with
+    each instance's uptime clipped to the window."""
+    return IMPL.instance_usage_totals_by_window(context, begin, end,
+                                                project_id)
+
+
+def instance_usage_rollup_hour(context, period_start):
+    """Recompute the hourly usage rollup for the hour at period_start."""
+    return IMPL.instance_usage_rollup_hour(context, period_start)
+
+
+def instance_usage_rollup_get_range(context):
+    """Get the (first, last) hours rolled up, or (None, None)."""
+    return IMPL.instance_usage_rollup_get_range(context)
+
+
+def instance_usage_rollup_totals(context, begin, end, project_id=None):
+    """Get per-project usage totals of the rolled up hours starting
+    within [begin, end)."""
+    return IMPL.instance_usage_rollup_totals(context, begin, end,
+                                             project_id)
 
 
 def instance_get_all_by_project(context, project_id):
@@ -625,6 +672,16 @@ def instance_update(context, instance_id, values):
     return IMPL.instance_update(context, instance_id, values)
 
 
+def instance_update_power_states(context, updates):
+    """Set the power state of several instances in one transaction.
+
+    :param updates: dict mapping instance ids to dicts holding the new
+                    power_state and, optionally, vm_state
+
+    """
+    return IMPL.instance_update_power_states(context, updates)
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance."""
     return IMPL.instance_add_security_group(context, instance_id,
@@ -927,6 +984,31 @@ def quota_destroy_all_by_project(context, project_id):
 ###################
 
 
+def quota_usage_get_all_by_project(context, project_id):
+    """Retrieve the in use and reserved amounts of a project's resources."""
+    return IMPL.quota_usage_get_all_by_project(context, project_id)
+
+
+def quota_reserve(context, project_id, deltas, quotas, expire):
+    """Reserve resources for a project or raise OverQuota.
+
+    :param deltas: dict of the amount of each resource to reserve
+    :param quotas: dict of the quota of each resource, None if unlimited
+    :param expire: datetime after which the reservations are released
+
+    :returns: list of the reservation uuids
+    """
+    return IMPL.quota_reserve(context, project_id, deltas, quotas, expire)
+
+
+def reservation_release(context, reservations):
+    """Release the resources set aside by reservations."""
+    return IMPL.reservation_release(context, reservations)
+
+
+###################
+
+
 def volume_allocate_iscsi_target(context, volume_id, host):
     """Atomically allocate a free iscsi_target from the pool."""
     return IMPL.volume_allocate_iscsi_target(context, volume_id, host)
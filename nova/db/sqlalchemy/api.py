@@ -41,7 +41,9 @@ from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import asc
+from sqlalchemy.sql.expression import case
 from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import extract
 from sqlalchemy.sql.expression import literal_column
 
 FLAGS = flags.FLAGS
@@ -399,6 +401,21 @@ def service_update(context, service_id, values):
         service_ref.save(session=session)
 
 
+@require_admin_context
+def service_heartbeat(context, service_id, values=None):
+    # NOTE: This is issued as a single UPDATE ... SET report_count =
+    #       report_count + 1 so that reporting state never has to read
+    #       the row back first.
+    values = dict(values or {})
+    values['report_count'] = models.Service.report_count + 1
+    values['updated_at'] = utils.utcnow()
+    result = model_query(context, models.Service, read_deleted="no").\
+                     filter_by(id=service_id).\
+                     update(values, synchronize_session=False)
+    if not result:
+        raise exception.ServiceNotFound(service_id=service_id)
+
+
 ###################
 
 
@@ -662,6 +679,8 @@ def floating_ip_allocate_address(context, project_id, pool):
         #             then this has concurrency issues
         if not floating_ip_ref:
             raise exception.NoMoreFloatingIps()
+        _floating_ip_quota_adjust(context, {'project_id': project_id}, 1,
+                                  session)
         floating_ip_ref['project_id'] = project_id
         session.add(floating_ip_ref)
     return floating_ip_ref['address']
@@ -671,20 +690,42 @@ def floating_ip_allocate_address(context, project_id, pool):
 def floating_ip_create(context, values):
     floating_ip_ref = models.FloatingIp()
     floating_ip_ref.update(values)
-    floating_ip_ref.save()
+    session = get_session()
+    with session.begin():
+        _floating_ip_quota_adjust(context, values, 1, session)
+        floating_ip_ref.save(session=session)
     return floating_ip_ref['address']
 
 
-@require_context
-def floating_ip_count_by_project(context, project_id):
-    authorize_project_context(context, project_id)
+def _floating_ip_count_by_project(context, project_id, session=None):
     # TODO(tr3buchet): why leave auto_assigned floating IPs out?
-    return model_query(context, models.FloatingIp, read_deleted="no").\
+    return model_query(context, models.FloatingIp, session=session,
+                       read_deleted="no").\
                    filter_by(project_id=project_id).\
                    filter_by(auto_assigned=False).\
                    count()
 
 
+@require_context
+def floating_ip_count_by_project(context, project_id):
+    authorize_project_context(context, project_id)
+    return _floating_ip_count_by_project(context, project_id)
+
+
+def _floating_ip_quota_adjust(context, values, delta, session):
+    """Counts a floating ip in or out of the usage of its project.
+
+    Called before changing the project, auto_assigned flag or deleted
+    flag of a floating ip, with -1 and its current values and with 1
+    and the new ones.  Like _floating_ip_count_by_project(), only
+    counts allocated floating ips that weren't auto assigned.
+    """
+    if values.get('auto_assigned') or values.get('deleted'):
+        return
+    _quota_usage_adjust(context, values.get('project_id'),
+                        {'floating_ips': delta}, session)
+
+
 @require_context
 def floating_ip_fixed_ip_associate(context, floating_address,
                                    fixed_address, host):
@@ -708,6 +749,7 @@ def floating_ip_deallocate(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        _floating_ip_quota_adjust(context, floating_ip_ref, -1, session)
         floating_ip_ref['project_id'] = None
         floating_ip_ref['host'] = None
         floating_ip_ref['auto_assigned'] = False
@@ -721,6 +763,7 @@ def floating_ip_destroy(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        _floating_ip_quota_adjust(context, floating_ip_ref, -1, session)
         floating_ip_ref.delete(session=session)
 
 
@@ -750,6 +793,7 @@ def floating_ip_set_auto_assigned(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        _floating_ip_quota_adjust(context, floating_ip_ref, -1, session)
         floating_ip_ref.auto_assigned = True
         floating_ip_ref.save(session=session)
 
@@ -833,6 +877,11 @@ def floating_ip_update(context, address, values):
     session = get_session()
     with session.begin():
         floating_ip_ref = floating_ip_get_by_address(context, address, session)
+        new_values = dict((key, values.get(key, floating_ip_ref[key]))
+                          for key in ('project_id', 'auto_assigned',
+                                      'deleted'))
+        _floating_ip_quota_adjust(context, floating_ip_ref, -1, session)
+        _floating_ip_quota_adjust(context, new_values, 1, session)
         for (key, value) in values.iteritems():
             floating_ip_ref[key] = value
         floating_ip_ref.save(session=session)
@@ -1277,6 +1326,8 @@ def instance_create(context, values):
 
     session = get_session()
     with session.begin():
+        _quota_usage_adjust(context, values.get('project_id'),
+                            _instance_quota_deltas(values, 1), session)
         instance_ref.save(session=session)
 
     # and creat the info_cache table entry for instance
@@ -1285,12 +1336,12 @@ def instance_create(context, values):
     return instance_ref
 
 
-@require_admin_context
-def instance_data_get_for_project(context, project_id):
+def _instance_data_get_for_project(context, project_id, session=None):
     result = model_query(context,
                          func.count(models.Instance.id),
                          func.sum(models.Instance.vcpus),
                          func.sum(models.Instance.memory_mb),
+                         session=session,
                          read_deleted="no").\
                      filter_by(project_id=project_id).\
                      first()
@@ -1298,6 +1349,18 @@ def instance_data_get_for_project(context, project_id):
     return (result[0] or 0, result[1] or 0, result[2] or 0)
 
 
+@require_admin_context
+def instance_data_get_for_project(context, project_id):
+    return _instance_data_get_for_project(context, project_id)
+
+
+def _instance_quota_deltas(values, sign):
+    """Returns the usage deltas for adding or removing an instance."""
+    return {'instances': sign,
+            'cores': sign * int(values.get('vcpus') or 0),
+            'ram': sign * int(values.get('memory_mb') or 0)}
+
+
 @require_context
 def instance_destroy(context, instance_id):
     session = get_session()
@@ -1309,6 +1372,10 @@ def instance_destroy(context, instance_id):
         else:
             instance_ref = instance_get(context, instance_id,
                     session=session)
+        if not instance_ref['deleted']:
+            _quota_usage_adjust(context, instance_ref['project_id'],
+                                _instance_quota_deltas(instance_ref, -1),
+                                session)
         session.query(models.Instance).\
                 filter_by(id=instance_id).\
                 update({'deleted': True,
@@ -1500,7 +1567,8 @@ def instance_get_active_by_window(context, begin, end=None, project_id=None):
 
 @require_admin_context
 def instance_get_active_by_window_joined(context, begin, end=None,
-                                         project_id=None):
+                                         project_id=None, marker=None,
+                                         limit=None):
     """Return instances and joins that were active during window."""
     session = get_session()
     query = session.query(models.Instance)
@@ -1515,10 +1583,132 @@ def instance_get_active_by_window_joined(context, begin, end=None,
         query = query.filter(models.Instance.launched_at < end)
     if project_id:
         query = query.filter_by(project_id=project_id)
+    if marker is not None:
+        query = query.filter(models.Instance.id > marker)
+    if limit is not None:
+        query = query.order_by(models.Instance.id).limit(limit)
 
     return query.all()
 
 
+def _seconds_between(session, later, earlier):
+    """Returns a SQL expression for the seconds from earlier to later."""
+    dialect = session.bind.dialect.name
+    if dialect == 'mysql':
+        return func.timestampdiff(literal_column('SECOND'), earlier, later)
+    if dialect == 'postgresql':
+        return extract('epoch', later - earlier)
+    return (func.julianday(later) - func.julianday(earlier)) * 86400.0
+
+
+_USAGE_TOTAL_KEYS = ('hours', 'vcpus_hours', 'memory_mb_hours',
+                     'local_gb_hours')
+
+
+@require_context
+def instance_usage_totals_by_window(context, begin, end, project_id=None,
+                                    session=None):
+    """Return per-project usage totals of the instances active during
+    the window, with each instance's uptime clipped to the window."""
+    if not session:
+        session = get_session()
+
+    instance = models.Instance
+    instance_type = models.InstanceTypes
+    start = case([(instance.launched_at > begin, instance.launched_at)],
+                 else_=begin)
+    stop = case([(and_(instance.terminated_at != None,
+                       instance.terminated_at < end),
+                  instance.terminated_at)],
+                else_=end)
+    hours = _seconds_between(session, stop, start) / 3600.0
+    local_gb = instance_type.root_gb + instance_type.ephemeral_gb
+
+    query = session.query(instance.project_id,
+                          func.sum(hours),
+                          func.sum(hours * instance_type.vcpus),
+                          func.sum(hours * instance_type.memory_mb),
+                          func.sum(hours * local_gb)).\
+                    join((instance_type,
+                          instance.instance_type_id == instance_type.id)).\
+                    filter(instance_type.deleted == False).\
+                    filter(or_(instance.terminated_at == None,
+                               instance.terminated_at > begin)).\
+                    filter(instance.launched_at < end)
+    if project_id:
+        query = query.filter(instance.project_id == project_id)
+
+    totals = []
+    for row in query.group_by(instance.project_id).all():
+        values = {'project_id': row[0]}
+        for key, value in zip(_USAGE_TOTAL_KEYS, row[1:]):
+            # NOTE: MySQL returns Decimals
+            values[key] = float(value or 0)
+        totals.append(values)
+    return totals
+
+
+@require_admin_context
+def instance_usage_rollup_hour(context, period_start):
+    session = get_session()
+    period_stop = period_start + datetime.timedelta(hours=1)
+    with session.begin():
+        totals = instance_usage_totals_by_window(context, period_start,
+                                                 period_stop,
+                                                 session=session)
+        session.query(models.InstanceUsageRollup).\
+                filter_by(period_start=period_start).\
+                delete(synchronize_session=False)
+
+        overall = dict.fromkeys(_USAGE_TOTAL_KEYS, 0.0)
+        overall['project_id'] = None
+        for values in totals:
+            for key in _USAGE_TOTAL_KEYS:
+                overall[key] += values[key]
+
+        for values in totals + [overall]:
+            rollup_ref = models.InstanceUsageRollup()
+            rollup_ref.update(values)
+            rollup_ref.period_start = period_start
+            rollup_ref.save(session=session)
+
+
+@require_context
+def instance_usage_rollup_get_range(context):
+    result = model_query(context,
+                         func.min(models.InstanceUsageRollup.period_start),
+                         func.max(models.InstanceUsageRollup.period_start),
+                         read_deleted="yes").\
+                     filter(models.InstanceUsageRollup.project_id == None).\
+                     first()
+    return (result[0], result[1])
+
+
+@require_context
+def instance_usage_rollup_totals(context, begin, end, project_id=None):
+    rollup = models.InstanceUsageRollup
+    query = model_query(context,
+                        rollup.project_id,
+                        func.sum(rollup.hours),
+                        func.sum(rollup.vcpus_hours),
+                        func.sum(rollup.memory_mb_hours),
+                        func.sum(rollup.local_gb_hours),
+                        read_deleted="yes").\
+                    filter(rollup.period_start >= begin).\
+                    filter(rollup.period_start < end).\
+                    filter(rollup.project_id != None)
+    if project_id:
+        query = query.filter(rollup.project_id == project_id)
+
+    totals = []
+    for row in query.group_by(rollup.project_id).all():
+        values = {'project_id': row[0]}
+        for key, value in zip(_USAGE_TOTAL_KEYS, row[1:]):
+            values[key] = float(value or 0)
+        totals.append(values)
+    return totals
+
+
 @require_admin_context
 def _instance_get_all_query(context, project_only=False):
     return model_query(context, models.Instance, project_only=project_only).\
@@ -1634,12 +1824,48 @@ def instance_update(context, instance_id, values):
                                  values.pop('metadata'),
                                  delete=True)
     with session.begin():
+        if (('vcpus' in values or 'memory_mb' in values) and
+            not instance_ref['deleted']):
+            old_deltas = _instance_quota_deltas(instance_ref, -1)
+            new_deltas = _instance_quota_deltas(
+                    {'vcpus': values.get('vcpus', instance_ref['vcpus']),
+                     'memory_mb': values.get('memory_mb',
+                                             instance_ref['memory_mb'])},
+                    1)
+            _quota_usage_adjust(context, instance_ref['project_id'],
+                                {'cores': old_deltas['cores'] +
+                                          new_deltas['cores'],
+                                 'ram': old_deltas['ram'] +
+                                        new_deltas['ram']},
+                                session)
         instance_ref.update(values)
         instance_ref.save(session=session)
 
     return instance_ref
 
 
+@require_admin_context
+def instance_update_power_states(context, updates):
+    # NOTE: Instances getting the same values are updated together by a
+    #       single UPDATE ... WHERE id IN (...) inside one transaction.
+    #       Only meant for the power_state/vm_state columns, so the quota
+    #       usages need no adjusting.
+    by_values = {}
+    for instance_id, values in updates.iteritems():
+        key = tuple(sorted(values.iteritems()))
+        by_values.setdefault(key, []).append(instance_id)
+
+    session = get_session()
+    with session.begin():
+        for key, instance_ids in by_values.iteritems():
+            values = dict(key)
+            values['updated_at'] = utils.utcnow()
+            model_query(context, models.Instance, session=session,
+                        read_deleted="no").\
+                    filter(models.Instance.id.in_(instance_ids)).\
+                    update(values, synchronize_session=False)
+
+
 def instance_add_security_group(context, instance_uuid, security_group_id):
     """Associate the given security group with the given instance"""
     session = get_session()
@@ -2291,6 +2517,257 @@ def quota_destroy_all_by_project(context, project_id):
 ###################
 
 
+def _quota_usage_sync_instances(context, project_id, session):
+    instances, cores, ram = _instance_data_get_for_project(
+            context, project_id, session=session)
+    return {'instances': instances, 'cores': cores, 'ram': ram}
+
+
+def _quota_usage_sync_volumes(context, project_id, session):
+    volumes, gigabytes = _volume_data_get_for_project(
+            context, project_id, session=session)
+    return {'volumes': volumes, 'gigabytes': gigabytes}
+
+
+def _quota_usage_sync_floating_ips(context, project_id, session):
+    return {'floating_ips': _floating_ip_count_by_project(
+            context, project_id, session=session)}
+
+
+# Counts the resources in use by a project when its usage is recounted
+_QUOTA_USAGE_SYNCS = {
+    'instances': _quota_usage_sync_instances,
+    'cores': _quota_usage_sync_instances,
+    'ram': _quota_usage_sync_instances,
+    'volumes': _quota_usage_sync_volumes,
+    'gigabytes': _quota_usage_sync_volumes,
+    'floating_ips': _quota_usage_sync_floating_ips,
+}
+
+
+def _quota_usage_count(context, project_id, resources, session):
+    """Returns a dict of the resources a project has in use."""
+    counts = {}
+    for sync in set(_QUOTA_USAGE_SYNCS[resource] for resource in resources):
+        counts.update(sync(context, project_id, session))
+    return dict((resource, counts[resource]) for resource in resources)
+
+
+def _quota_usage_create(context, project_id, resources):
+    """Creates the missing usage rows of a project from a count.
+
+    Each row is inserted in its own transaction.  The usage rows are
+    unique, so when another transaction creates one of them first the
+    insert fails and the row it created is used instead.
+    """
+    session = get_session()
+    existing = model_query(context, models.QuotaUsage.resource,
+                           session=session, read_deleted="no").\
+                       filter_by(project_id=project_id).\
+                       filter(models.QuotaUsage.resource.in_(resources)).\
+                       all()
+    missing = set(resources) - set(row.resource for row in existing)
+    if not missing:
+        return
+
+    counts = _quota_usage_count(context, project_id, missing, session)
+    now = utils.utcnow()
+    for resource in sorted(missing):
+        row = models.QuotaUsage()
+        row.project_id = project_id
+        row.resource = resource
+        row.in_use = counts[resource]
+        row.reserved = 0
+        row.synced_at = now
+        try:
+            row.save()
+        except exception.DBError, e:
+            if not isinstance(e.inner_exception, IntegrityError):
+                raise
+            LOG.debug(_("Usage of %(resource)s by project %(project_id)s "
+                        "was created concurrently") % locals())
+
+
+def _quota_usage_resync(context, project_id, rows, session):
+    """Recounts the resources in use behind the given usage rows."""
+    counts = _quota_usage_count(context, project_id,
+                                [row.resource for row in rows], session)
+    now = utils.utcnow()
+    for row in rows:
+        resource = row.resource
+        in_use = row.in_use
+        count = counts[resource]
+        if in_use != count:
+            LOG.warn(_("Usage of %(resource)s by project %(project_id)s "
+                       "drifted to %(in_use)d, resyncing it to %(count)d")
+                     % locals())
+        row.in_use = count
+        row.synced_at = now
+        row.save(session=session)
+
+
+def _quota_usage_is_stale(row):
+    if not FLAGS.quota_usage_max_age:
+        return False
+    return (row.synced_at is None or
+            utils.is_older_than(row.synced_at, FLAGS.quota_usage_max_age))
+
+
+def _quota_usage_get_rows(context, project_id, resources, session):
+    """Returns a dict of the locked usage rows of a project by resource.
+
+    Missing rows are created and rows older than quota_usage_max_age are
+    recounted first.
+    """
+    _quota_usage_create(context, project_id, resources)
+
+    # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
+    #             then this has concurrency issues
+    rows = model_query(context, models.QuotaUsage, session=session,
+                       read_deleted="no").\
+                   filter_by(project_id=project_id).\
+                   filter(models.QuotaUsage.resource.in_(resources)).\
+                   order_by(models.QuotaUsage.id).\
+                   with_lockmode('update').\
+                   all()
+    stale = [row for row in rows if _quota_usage_is_stale(row)]
+    if stale:
+        _quota_usage_resync(context, project_id, stale, session)
+    return dict((row.resource, row) for row in rows)
+
+
+def _quota_usage_adjust(context, project_id, deltas, session):
+    """Adds deltas to the resources a project has in use.
+
+    Called in the transaction creating or deleting the resources,
+    before they are written.  Usage that would go negative has drifted
+    and is recounted first.
+    """
+    deltas = dict((resource, delta)
+                  for resource, delta in deltas.iteritems() if delta)
+    if not project_id or not deltas:
+        return
+    rows = _quota_usage_get_rows(context, project_id, deltas.keys(),
+                                 session)
+    negative = [rows[resource] for resource, delta in deltas.iteritems()
+                if rows[resource].in_use + delta < 0]
+    if negative:
+        _quota_usage_resync(context, project_id, negative, session)
+
+    for resource, delta in deltas.iteritems():
+        row = rows[resource]
+        in_use = row.in_use + delta
+        if in_use < 0:
+            LOG.warn(_("Usage of %(resource)s by project %(project_id)s "
+                       "would drop to %(in_use)d, clamping it to 0")
+                     % locals())
+            in_use = 0
+        row.in_use = in_use
+        row.save(session=session)
+
+
+@require_context
+def quota_usage_get_all_by_project(context, project_id):
+    authorize_project_context(context, project_id)
+    session = get_session()
+    rows = model_query(context, models.QuotaUsage, session=session,
+                       read_deleted="no").\
+                   filter_by(project_id=project_id).\
+                   all()
+
+    result = {'project_id': project_id}
+    for row in rows:
+        result[row.resource] = {'in_use': row.in_use,
+                                'reserved': row.reserved}
+
+    # Rows are only created once the usage changes, count it until then
+    missing = [resource for resource in _QUOTA_USAGE_SYNCS
+               if resource not in result]
+    if missing:
+        counts = _quota_usage_count(context, project_id, missing, session)
+        for resource in missing:
+            result[resource] = {'in_use': counts[resource], 'reserved': 0}
+    return result
+
+
+def _reservations_release(context, query, session):
+    reservations = query.with_lockmode('update').all()
+    if not reservations:
+        return
+    usages = model_query(context, models.QuotaUsage, session=session,
+                         read_deleted="no").\
+                     filter(models.QuotaUsage.id.in_(
+                            [r.usage_id for r in reservations])).\
+                     with_lockmode('update').\
+                     all()
+    usages = dict((usage.id, usage) for usage in usages)
+
+    for reservation in reservations:
+        usage = usages.get(reservation.usage_id)
+        if usage:
+            usage.reserved = max(usage.reserved - reservation.delta, 0)
+            usage.save(session=session)
+        reservation.delete(session=session)
+
+
+@require_context
+def quota_reserve(context, project_id, deltas, quotas, expire):
+    authorize_project_context(context, project_id)
+    deltas = dict((resource, delta)
+                  for resource, delta in deltas.iteritems() if delta > 0)
+    session = get_session()
+    with session.begin():
+        expired = model_query(context, models.Reservation, session=session,
+                              read_deleted="no").\
+                          filter_by(project_id=project_id).\
+                          filter(models.Reservation.expire < utils.utcnow())
+        _reservations_release(context, expired, session)
+
+        rows = _quota_usage_get_rows(context, project_id, deltas.keys(),
+                                     session)
+        overs = []
+        for resource, delta in deltas.iteritems():
+            quota = quotas.get(resource)
+            row = rows[resource]
+            if quota is not None and row.in_use + row.reserved + delta > quota:
+                overs.append(resource)
+        if overs:
+            raise exception.OverQuota(overs=', '.join(sorted(overs)))
+
+        reservations = []
+        for resource, delta in deltas.iteritems():
+            row = rows[resource]
+            row.reserved += delta
+            row.save(session=session)
+
+            reservation_ref = models.Reservation()
+            reservation_ref.uuid = str(utils.gen_uuid())
+            reservation_ref.usage_id = row.id
+            reservation_ref.project_id = project_id
+            reservation_ref.resource = resource
+            reservation_ref.delta = delta
+            reservation_ref.expire = expire
+            reservation_ref.save(session=session)
+            reservations.append(reservation_ref.uuid)
+
+    return reservations
+
+
+@require_context
+def reservation_release(context, reservations):
+    if not reservations:
+        return
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Reservation, session=session,
+                            read_deleted="no").\
+                        filter(models.Reservation.uuid.in_(reservations))
+        _reservations_release(context, query, session)
+
+
+###################
+
+
 @require_admin_context
 def volume_allocate_iscsi_target(context, volume_id, host):
     session = get_session()
@@ -2335,15 +2812,17 @@ def volume_create(context, values):
 
     session = get_session()
     with session.begin():
+        _quota_usage_adjust(context, values.get('project_id'),
+                            _volume_quota_deltas(values, 1), session)
         volume_ref.save(session=session)
     return volume_ref
 
 
-@require_admin_context
-def volume_data_get_for_project(context, project_id):
+def _volume_data_get_for_project(context, project_id, session=None):
     result = model_query(context,
                          func.count(models.Volume.id),
                          func.sum(models.Volume.size),
+                         session=session,
                          read_deleted="no").\
                      filter_by(project_id=project_id).\
                      first()
@@ -2352,10 +2831,29 @@ def volume_data_get_for_project(context, project_id):
     return (result[0] or 0, result[1] or 0)
 
 
+@require_admin_context
+def volume_data_get_for_project(context, project_id):
+    return _volume_data_get_for_project(context, project_id)
+
+
+def _volume_quota_deltas(values, sign):
+    """Returns the usage deltas for adding or removing a volume."""
+    return {'volumes': sign,
+            'gigabytes': sign * int(values.get('size') or 0)}
+
+
 @require_admin_context
 def volume_destroy(context, volume_id):
     session = get_session()
     with session.begin():
+        volume_ref = model_query(context, models.Volume, session=session,
+                                 read_deleted="no").\
+                             filter_by(id=volume_id).\
+                             first()
+        if volume_ref:
+            _quota_usage_adjust(context, volume_ref['project_id'],
+                                _volume_quota_deltas(volume_ref, -1),
+                                session)
         session.query(models.Volume).\
                 filter_by(id=volume_id).\
                 update({'deleted': True,
@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, Integer
+from sqlalchemy import MetaData, String, Table
+from nova import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    instance_usage_rollups = Table('instance_usage_rollups', meta,
+            Column('created_at', DateTime(timezone=False)),
+            Column('updated_at', DateTime(timezone=False)),
+            Column('deleted_at', DateTime(timezone=False)),
+            Column('deleted', Boolean(create_constraint=True, name=None),
+                    default=False),
+            Column('id', Integer(), primary_key=True, nullable=False),
+            Column('project_id',
+                   String(length=255, convert_unicode=False,
+                          assert_unicode=None,
+                          unicode_error=None, _warn_on_bytestring=False)),
+            Column('period_start', DateTime(timezone=False), nullable=False),
+            Column('hours', Float()),
+            Column('vcpus_hours', Float()),
+            Column('memory_mb_hours', Float()),
+            Column('local_gb_hours', Float()),
+            )
+    try:
+        instance_usage_rollups.create()
+    except Exception:
+        LOG.error(_("Table |%s| not created!"), repr(instance_usage_rollups))
+        raise
+
+    Index('instance_usage_rollups_period_start_project_id_idx',
+          instance_usage_rollups.c.period_start,
+          instance_usage_rollups.c.project_id).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    instance_usage_rollups = Table('instance_usage_rollups', meta,
+                                   autoload=True)
+    instance_usage_rollups.drop()
@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer
+from sqlalchemy import MetaData, String, Table, UniqueConstraint
+from nova import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    quota_usages = Table('quota_usages', meta,
+            Column('created_at', DateTime(timezone=False)),
+            Column('updated_at', DateTime(timezone=False)),
+            Column('deleted_at', DateTime(timezone=False)),
+            Column('deleted', Boolean(create_constraint=True, name=None),
+                    default=False),
+            Column('id', Integer(), primary_key=True, nullable=False),
+            Column('project_id',
+                   String(length=255, convert_unicode=False,
+                          assert_unicode=None,
+                          unicode_error=None, _warn_on_bytestring=False)),
+            Column('resource',
+                   String(length=255, convert_unicode=False,
+                          assert_unicode=None,
+                          unicode_error=None, _warn_on_bytestring=False)),
+            Column('in_use', Integer(), nullable=False),
+            Column('reserved', Integer(), nullable=False),
+            Column('synced_at', DateTime(timezone=False)),
+            UniqueConstraint('project_id', 'resource', 'deleted',
+                             name='uniq_quota_usages0project_id0resource0'
+                                  'deleted'),
+            )
+
+    reservations = Table('reservations', meta,
+            Column('created_at', DateTime(timezone=False)),
+            Column('updated_at', DateTime(timezone=False)),
+            Column('deleted_at', DateTime(timezone=False)),
+            Column('deleted', Boolean(create_constraint=True, name=None),
+                    default=False),
+            Column('id', Integer(), primary_key=True, nullable=False),
+            Column('uuid',
+                   String(length=36, convert_unicode=False,
+                          assert_unicode=None,
+                          unicode_error=None, _warn_on_bytestring=False),
+                   nullable=False),
+            Column('usage_id', Integer(), ForeignKey('quota_usages.id'),
+                   nullable=False),
+            Column('project_id',
+                   String(length=255, convert_unicode=False,
+                          assert_unicode=None,
+                          unicode_error=None, _warn_on_bytestring=False)),
+            Column('resource',
+                   String(length=255, convert_unicode=False,
+                          assert_unicode=None,
+                          unicode_error=None, _warn_on_bytestring=False)),
+            Column('delta', Integer(), nullable=False),
+            Column('expire', DateTime(timezone=False), nullable=False),
+            )
+
+    for table in (quota_usages, reservations):
+        try:
+            table.create()
+        except Exception:
+            LOG.error(_("Table |%s| not created!"), repr(table))
+            raise
+
+    Index('reservations_uuid_idx',
+          reservations.c.uuid).create(migrate_engine)
+    Index('reservations_project_id_expire_idx',
+          reservations.c.project_id,
+          reservations.c.expire).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    reservations = Table('reservations', meta, autoload=True)
+    reservations.drop()
+    quota_usages = Table('quota_usages', meta, autoload=True)
+    quota_usages.drop()
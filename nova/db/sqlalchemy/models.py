@@ -433,6 +433,43 @@ class Quota(BASE, NovaBase):
     hard_limit = Column(Integer, nullable=True)
 
 
+class QuotaUsage(BASE, NovaBase):
+    """Represents the current usage of a resource by a project.
+
+    in_use follows the resources as they are created and deleted,
+    reserved holds the outstanding reservations against the quota and
+    synced_at is when in_use was last recounted.
+    """
+
+    __tablename__ = 'quota_usages'
+    __table_args__ = (schema.UniqueConstraint("project_id", "resource",
+                                              "deleted"),
+                      {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, primary_key=True)
+
+    project_id = Column(String(255))
+    resource = Column(String(255))
+
+    in_use = Column(Integer, nullable=False, default=0)
+    reserved = Column(Integer, nullable=False, default=0)
+    synced_at = Column(DateTime)
+
+
+class Reservation(BASE, NovaBase):
+    """Represents a resource set aside until it is created or released."""
+
+    __tablename__ = 'reservations'
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(36), nullable=False)
+
+    usage_id = Column(Integer, ForeignKey('quota_usages.id'), nullable=False)
+    project_id = Column(String(255))
+    resource = Column(String(255))
+
+    delta = Column(Integer, nullable=False)
+    expire = Column(DateTime, nullable=False)
+
+
 class Snapshot(BASE, NovaBase):
     """Represents a block storage device that can be attached to a vm."""
     __tablename__ = 'snapshots'
@@ -933,6 +970,22 @@ class BandwidthUsage(BASE, NovaBase):
     bw_out = Column(BigInteger)
 
 
+class InstanceUsageRollup(BASE, NovaBase):
+    """Hourly per-project totals of instance usage.
+
+    A row with a project_id of None holds the totals of all projects for
+    the hour, and marks the hour as rolled up even when nothing ran.
+    """
+    __tablename__ = 'instance_usage_rollups'
+    id = Column(Integer, primary_key=True, nullable=False)
+    project_id = Column(String(255))
+    period_start = Column(DateTime, nullable=False)
+    hours = Column(Float)
+    vcpus_hours = Column(Float)
+    memory_mb_hours = Column(Float)
+    local_gb_hours = Column(Float)
+
+
 class S3Image(BASE, NovaBase):
     """Compatibility layer for the S3 image service talking to Glance"""
     __tablename__ = 's3_images'
@@ -1002,10 +1055,13 @@ def register_models():
               InstanceMetadata,
               InstanceTypeExtraSpecs,
               InstanceTypes,
+              InstanceUsageRollup,
               IscsiTarget,
               Migration,
               Network,
               Project,
+              QuotaUsage,
+              Reservation,
               SecurityGroup,
               SecurityGroupIngressRule,
               SecurityGroupInstanceAssociation,
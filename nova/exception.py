@@ -950,6 +950,10 @@ class QuotaError(NovaException):
     message = _("Quota exceeded") + ": code=%(code)s"
 
 
+class OverQuota(QuotaError):
+    message = _("Quota exceeded for resources: %(overs)s")
+
+
 class AggregateError(NovaException):
     message = _("Aggregate %(aggregate_id)s: action '%(action)s' "
                 "caused an error: %(reason)s.")
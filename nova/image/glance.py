@@ -19,26 +19,52 @@
 
 from __future__ import absolute_import
 
+import contextlib
 import copy
 import datetime
+import functools
+import httplib
 import json
 import random
+import socket
 import sys
 import time
 import urlparse
 
+from eventlet import semaphore
 from glance.common import exception as glance_exception
 
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova.openstack.common import cfg
 from nova import utils
 
 
 LOG = logging.getLogger(__name__)
 
+glance_opts = [
+    cfg.IntOpt('glance_metadata_cache_ttl',
+               default=0,
+               help='Seconds to cache image metadata fetched from glance, '
+                    'including lookups of missing images. 0 disables the '
+                    'cache'),
+    cfg.IntOpt('glance_metadata_cache_size',
+               default=1024,
+               help='Maximum number of image metadata entries to cache'),
+    cfg.IntOpt('glance_server_eject_time',
+               default=30,
+               help='Seconds to stop sending requests to a glance api server '
+                    'after a connection error or timeout'),
+    cfg.IntOpt('glance_max_requests_per_server',
+               default=16,
+               help='Maximum number of concurrent requests to each glance api '
+                    'server; also the number of idle clients and of idle '
+                    'keep-alive connections kept for reuse per server'),
+    ]
 
 FLAGS = flags.FLAGS
+FLAGS.register_opts(glance_opts)
 
 
 GlanceClient = utils.import_class('glance.client.Client')
@@ -73,19 +99,269 @@ def _create_glance_client(context, host, port):
     return glance_client
 
 
+_keepalive_classes = {}
+
+
+def _keepalive_connection_class(connection_class):
+    """Return a subclass of an httplib connection class whose connections
+    can be kept open and reused for several requests.
+
+    A reused connection may have been closed by the server while it was
+    idle.  Requests without a body, or with a string body, are then sent
+    again on a new connection.  Other bodies can not be sent twice, so
+    their requests always open a new connection.
+
+    """
+    if connection_class in _keepalive_classes:
+        return _keepalive_classes[connection_class]
+
+    class KeepAliveConnection(connection_class):
+        reused = False
+        response = None
+        _replay = None
+
+        def reusable(self):
+            """Whether the connection is open and its last response was
+            read completely."""
+            return (self.sock is not None and
+                    (self.response is None or self.response.isclosed()))
+
+        def request(self, method, url, body=None, headers={}):
+            if body is None or isinstance(body, basestring):
+                self._replay = (method, url, body, headers)
+            try:
+                connection_class.request(self, method, url, body, headers)
+            except socket.error:
+                if not (self.reused and self._replay):
+                    raise
+                self.close()
+                self.reused = False
+                connection_class.request(self, method, url, body, headers)
+
+        def putrequest(self, *args, **kwargs):
+            if self.reused and self._replay is None:
+                self.close()
+                self.reused = False
+            connection_class.putrequest(self, *args, **kwargs)
+
+        def getresponse(self, *args, **kwargs):
+            replay, self._replay = self._replay, None
+            reused, self.reused = self.reused, False
+            try:
+                self.response = connection_class.getresponse(self, *args,
+                                                             **kwargs)
+            except (httplib.BadStatusLine, socket.error):
+                if not (reused and replay):
+                    raise
+                # The server closed the connection while it was idle
+                self.close()
+                connection_class.request(self, *replay)
+                self.response = connection_class.getresponse(self, *args,
+                                                             **kwargs)
+            return self.response
+
+    _keepalive_classes[connection_class] = KeepAliveConnection
+    return KeepAliveConnection
+
+
+class GlanceClientPool(object):
+    """Process-local pool of glance clients and of keep-alive connections,
+    kept per glance api server.
+
+    Clients are handed back to the pool after each request and reused by
+    later requests made with the same credentials.  The HTTP connections
+    the clients open are kept open once their response was read, handed
+    back to the pool with the client, and reused by any client talking to
+    the same server, so requests do not pay for a new TCP connection.  The
+    number of requests in flight to each server is bounded by
+    glance_max_requests_per_server.  A server that fails with a connection
+    error is ejected from selection for glance_server_eject_time seconds,
+    unless every server is ejected, and its idle connections are closed.
+
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._idle_connections = {}
+        self._semaphores = {}
+        self._ejected = {}
+        self.clients_created = 0
+        self.clients_reused = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.ejections = 0
+
+    @staticmethod
+    def _servers():
+        servers = []
+        for host_port in FLAGS.glance_api_servers:
+            host, port_str = host_port.split(':')
+            servers.append((host, int(port_str)))
+        return servers
+
+    @staticmethod
+    def _credentials(context):
+        if FLAGS.auth_strategy == 'keystone':
+            return (context.user_id, context.project_id, context.auth_token)
+        return None
+
+    def pick_server(self):
+        """Returns (host, port) of a server that is not ejected."""
+        servers = self._servers()
+        now = time.time()
+        healthy = [s for s in servers if self._ejected.get(s, 0) <= now]
+        return random.choice(healthy or servers)
+
+    def eject(self, host, port):
+        LOG.warn(_('Connection error talking to glance server '
+                   '%(host)s:%(port)s, not using it for %(secs)d seconds'),
+                 {'host': host, 'port': port,
+                  'secs': FLAGS.glance_server_eject_time})
+        self._ejected[(host, port)] = (time.time() +
+                                       FLAGS.glance_server_eject_time)
+        self._idle.pop((host, port), None)
+        for key in self._idle_connections.keys():
+            if key[:2] == (host, port):
+                for conn in self._idle_connections.pop(key):
+                    conn.close()
+        self.ejections += 1
+
+    def get(self, context, host, port):
+        """Takes an idle client for the context's credentials from the pool,
+        or creates a new one."""
+        creds = self._credentials(context)
+        idle = self._idle.get((host, port), [])
+        for i, (client_creds, client) in enumerate(idle):
+            if client_creds == creds:
+                del idle[i]
+                self.clients_reused += 1
+                return client
+        self.clients_created += 1
+        client = _create_glance_client(context, host, port)
+        get_connection_type = getattr(client, 'get_connection_type', None)
+        if get_connection_type is not None:
+            # NOTE: the glance client builds a new connection of this type
+            # for every request, hand it a pooled one instead
+            connection_class = _keepalive_connection_class(
+                    get_connection_type())
+            connect = functools.partial(self._get_connection, client,
+                                        connection_class)
+            client.keepalive_connection = None
+            client.get_connection_type = lambda: connect
+        return client
+
+    def put(self, context, host, port, client):
+        """Returns a client to the pool, dropping the oldest idle one if
+        the server already has too many."""
+        self._release_connection(client)
+        idle = self._idle.setdefault((host, port), [])
+        idle.append((self._credentials(context), client))
+        if len(idle) > FLAGS.glance_max_requests_per_server:
+            del idle[0]
+
+    def _get_connection(self, client, connection_class, host, port,
+                        **kwargs):
+        """Returns the connection a client should send its next request
+        on: its own one if it can be reused, otherwise an idle one kept
+        for the server, otherwise a new one."""
+        conn = client.keepalive_connection
+        if (conn is not None and (conn.host, conn.port) == (host, port) and
+            conn.reusable()):
+            self.connections_reused += 1
+            conn.reused = True
+            return conn
+        self._release_connection(client)
+
+        idle = self._idle_connections.get((host, port, connection_class), [])
+        while idle:
+            conn = idle.pop()
+            if conn.reusable():
+                self.connections_reused += 1
+                conn.reused = True
+                break
+        else:
+            self.connections_created += 1
+            conn = connection_class(host, port, **kwargs)
+        client.keepalive_connection = conn
+        return conn
+
+    def _release_connection(self, client, reuse=True):
+        """Takes the connection of a client back.  It is kept for the
+        server if its response was read, and dropped otherwise: a
+        response that is still being read keeps the socket open."""
+        conn = getattr(client, 'keepalive_connection', None)
+        if conn is None:
+            return
+        client.keepalive_connection = None
+        if not (reuse and conn.reusable()):
+            return
+        idle = self._idle_connections.setdefault(
+                (conn.host, conn.port, conn.__class__), [])
+        idle.append(conn)
+        if len(idle) > FLAGS.glance_max_requests_per_server:
+            idle.pop(0).close()
+
+    def _semaphore(self, host, port):
+        sem = self._semaphores.get((host, port))
+        if sem is None:
+            sem = semaphore.Semaphore(FLAGS.glance_max_requests_per_server)
+            self._semaphores[(host, port)] = sem
+        return sem
+
+    @contextlib.contextmanager
+    def client(self, context):
+        """Checks out a client for the duration of a with block."""
+        host, port = self.pick_server()
+        with self._semaphore(host, port):
+            client = self.get(context, host, port)
+            try:
+                yield client
+            except glance_exception.ClientConnectionError:
+                self._release_connection(client, reuse=False)
+                self.eject(host, port)
+                raise
+            except Exception:
+                self.put(context, host, port, client)
+                raise
+            self.put(context, host, port, client)
+
+    def clear(self):
+        for idle in self._idle_connections.itervalues():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+        self._idle_connections.clear()
+        self._semaphores.clear()
+        self._ejected.clear()
+        self.clients_created = self.clients_reused = 0
+        self.connections_created = self.connections_reused = 0
+        self.ejections = 0
+
+    def stats(self):
+        return {'clients_created': self.clients_created,
+                'clients_reused': self.clients_reused,
+                'connections_created': self.connections_created,
+                'connections_reused': self.connections_reused,
+                'ejections': self.ejections,
+                'idle': sum(len(v) for v in self._idle.itervalues()),
+                'idle_connections': sum(
+                        len(v) for v in self._idle_connections.itervalues())}
+
+
+client_pool = GlanceClientPool()
+
+
 def pick_glance_api_server():
     """Return which Glance API server to use for the request
 
     This method provides a very primitive form of load-balancing suitable for
     testing and sandbox environments. In production, it would be better to use
-    one IP and route that to a real load-balancer.
+    one IP and route that to a real load-balancer.  Servers that recently
+    failed with a connection error are skipped.
 
         Returns (host, port)
     """
-    host_port = random.choice(FLAGS.glance_api_servers)
-    host, port_str = host_port.split(':')
-    port = int(port_str)
-    return host, port
+    return client_pool.pick_server()
 
 
 def get_glance_client(context, image_href):
@@ -104,21 +380,95 @@ def get_glance_client(context, image_href):
 
     # check if this is an id
     if '/' not in str(image_href):
-        glance_client = _create_glance_client(context,
-                                              glance_host,
-                                              glance_port)
-        return (glance_client, image_href)
-
+        image_id = image_href
     else:
         try:
             (image_id, host, port) = _parse_image_ref(image_href)
         except ValueError:
             raise exception.InvalidImageRef(image_href=image_href)
 
-        glance_client = _create_glance_client(context,
-                                              glance_host,
-                                              glance_port)
-        return (glance_client, image_id)
+    # NOTE: the caller keeps this client, so it is taken from the pool but
+    # never handed back.
+    glance_client = client_pool.get(context, glance_host, glance_port)
+    return (glance_client, image_id)
+
+
+class ImageMetaCache(object):
+    """Process-local LRU cache of image metadata with a TTL.
+
+    Entries are keyed by image id and by the parts of the request context
+    that decide whether the image is visible, so a cached lookup never
+    exposes an image to a context that could not have seen it.  Missing
+    images are cached too, as None.
+
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _visibility(context):
+        return (getattr(context, 'project_id', None),
+                getattr(context, 'user_id', None),
+                getattr(context, 'is_admin', False),
+                bool(getattr(context, 'auth_token', None)))
+
+    def get(self, context, image_id):
+        """Returns (found, image_meta); image_meta is None for a cached
+        missing image."""
+        key = (image_id, self._visibility(context))
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+        self._tick += 1
+        entry[2] = self._tick
+        self.hits += 1
+        return True, copy.deepcopy(entry[1])
+
+    def set(self, context, image_id, image_meta):
+        if FLAGS.glance_metadata_cache_ttl <= 0:
+            return
+        if len(self._entries) >= FLAGS.glance_metadata_cache_size:
+            self._evict()
+        self._tick += 1
+        expires = time.time() + FLAGS.glance_metadata_cache_ttl
+        key = (image_id, self._visibility(context))
+        self._entries[key] = [expires, copy.deepcopy(image_meta), self._tick]
+
+    def _evict(self):
+        now = time.time()
+        expired = [k for k, v in self._entries.iteritems() if v[0] < now]
+        if not expired:
+            expired = [min(self._entries,
+                           key=lambda k: self._entries[k][2])]
+        for key in expired:
+            del self._entries[key]
+        self.evictions += len(expired)
+
+    def invalidate(self, image_id):
+        """Drops every cached entry for an image."""
+        for key in [k for k in self._entries if k[0] == image_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries)}
+
+
+image_meta_cache = ImageMetaCache()
 
 
 class GlanceImageService(object):
@@ -127,22 +477,25 @@ class GlanceImageService(object):
     def __init__(self, client=None):
         self._client = client
 
-    def _get_client(self, context):
+    @contextlib.contextmanager
+    def _checkout_client(self, context):
         # NOTE(sirp): we want to load balance each request across glance
-        # servers. Since GlanceImageService is a long-lived object, `client`
-        # is made to choose a new server each time via this property.
+        # servers. Since GlanceImageService is a long-lived object, a client
+        # is checked out of the pool, from a freshly picked server, for each
+        # request.
         if self._client is not None:
-            return self._client
-        glance_host, glance_port = pick_glance_api_server()
-        return _create_glance_client(context, glance_host, glance_port)
+            yield self._client
+        else:
+            with client_pool.client(context) as client:
+                yield client
 
     def _call_retry(self, context, name, *args, **kwargs):
         """Retry call to glance server if there is a connection error.
         Suitable only for idempotent calls."""
         for i in xrange(FLAGS.glance_num_retries + 1):
-            client = self._get_client(context)
             try:
-                return getattr(client, name)(*args, **kwargs)
+                with self._checkout_client(context) as client:
+                    return getattr(client, name)(*args, **kwargs)
             except glance_exception.ClientConnectionError as e:
                 LOG.exception(_('Connection error contacting glance'
                                 ' server, retrying'))
@@ -197,8 +550,11 @@ class GlanceImageService(object):
         # NOTE(vish): don't filter out private images
         kwargs['filters'].setdefault('is_public', 'none')
 
-        client = self._get_client(context)
-        return self._fetch_images(client.get_images_detailed, **kwargs)
+        # NOTE: every page is fetched with the same pooled client
+        with self._checkout_client(context) as client:
+            for image in self._fetch_images(client.get_images_detailed,
+                                            **kwargs):
+                yield image
 
     def _fetch_images(self, fetch_func, **kwargs):
         """Paginate through results from glance server"""
@@ -234,16 +590,28 @@ class GlanceImageService(object):
 
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
+        if FLAGS.glance_metadata_cache_ttl > 0:
+            found, base_image_meta = image_meta_cache.get(context, image_id)
+            if found:
+                if base_image_meta is None:
+                    raise exception.ImageNotFound(image_id=image_id)
+                return base_image_meta
+
         try:
             image_meta = self._call_retry(context, 'get_image_meta',
                                           image_id)
+        except glance_exception.NotFound:
+            image_meta_cache.set(context, image_id, None)
+            _reraise_translated_image_exception(image_id)
         except Exception:
             _reraise_translated_image_exception(image_id)
 
         if not self._is_image_available(context, image_meta):
+            image_meta_cache.set(context, image_id, None)
             raise exception.ImageNotFound(image_id=image_id)
 
         base_image_meta = self._translate_from_glance(image_meta)
+        image_meta_cache.set(context, image_id, base_image_meta)
         return base_image_meta
 
     def show_by_name(self, context, name):
@@ -281,11 +649,13 @@ class GlanceImageService(object):
         LOG.debug(_('Metadata after formatting for Glance %s'),
                   sent_service_image_meta)
 
-        recv_service_image_meta = self._get_client(context).add_image(
-            sent_service_image_meta, data)
+        with self._checkout_client(context) as client:
+            recv_service_image_meta = client.add_image(
+                sent_service_image_meta, data)
 
         # Translate Service -> Base
         base_image_meta = self._translate_from_glance(recv_service_image_meta)
+        image_meta_cache.invalidate(base_image_meta['id'])
         LOG.debug(_('Metadata returned from Glance formatted for Base %s'),
                   base_image_meta)
         return base_image_meta
@@ -299,11 +669,13 @@ class GlanceImageService(object):
         # NOTE(vish): show is to check if image is available
         self.show(context, image_id)
         image_meta = self._translate_to_glance(image_meta)
-        client = self._get_client(context)
         try:
-            image_meta = client.update_image(image_id, image_meta, data)
+            with self._checkout_client(context) as client:
+                image_meta = client.update_image(image_id, image_meta, data)
         except Exception:
             _reraise_translated_image_exception(image_id)
+        finally:
+            image_meta_cache.invalidate(image_id)
 
         base_image_meta = self._translate_from_glance(image_meta)
         return base_image_meta
@@ -335,9 +707,12 @@ class GlanceImageService(object):
                 raise exception.NotAuthorized(_("Not the image owner"))
 
         try:
-            result = self._get_client(context).delete_image(image_id)
+            with self._checkout_client(context) as client:
+                result = client.delete_image(image_id)
         except glance_exception.NotFound:
             raise exception.ImageNotFound(image_id=image_id)
+        finally:
+            image_meta_cache.invalidate(image_id)
         return result
 
     def delete_all(self):
@@ -20,14 +20,14 @@
 
 import base64
 import binascii
+import collections
 import os
-import shutil
 import tarfile
-import tempfile
 from xml.etree import ElementTree
 
 import boto.s3.connection
 import eventlet
+from eventlet.green import subprocess
 
 from nova import rpc
 from nova import exception
@@ -35,7 +35,6 @@ from nova import flags
 from nova import image
 from nova import log as logging
 from nova.openstack.common import cfg
-from nova import utils
 from nova.api.ec2 import ec2utils
 
 
@@ -58,11 +57,26 @@ s3_opts = [
                default=False,
                help='whether to affix the tenant id to the access key '
                     'when downloading from s3'),
+    cfg.IntOpt('s3_image_part_concurrency',
+               default=4,
+               help='number of image parts to download from s3 at once '
+                    'while registering an image'),
     ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(s3_opts)
 
+# NOTE: size of the reads used to drain the decryption pipe
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageRegistrationFailed(Exception):
+    """Registration failed, image_state is the state to record."""
+
+    def __init__(self, image_state):
+        self.image_state = image_state
+        super(ImageRegistrationFailed, self).__init__(image_state)
+
 
 class S3ImageService(object):
     """Wraps an existing image service to support s3 based register."""
@@ -173,11 +187,27 @@ class S3ImageService(object):
                                                host=FLAGS.s3_host)
 
     @staticmethod
-    def _download_file(bucket, filename, local_dir):
-        key = bucket.get_key(filename)
-        local_filename = os.path.join(local_dir, os.path.basename(filename))
-        key.get_contents_to_filename(local_filename)
-        return local_filename
+    def _download_parts(bucket, filenames):
+        """Yields the contents of the image parts in manifest order.
+
+        Up to s3_image_part_concurrency parts are fetched at once, and no
+        more than that many are held in memory waiting to be consumed.
+        """
+        def _fetch(filename):
+            return bucket.get_key(filename).get_contents_as_string()
+
+        window = max(1, FLAGS.s3_image_part_concurrency)
+        pending = collections.deque()
+        try:
+            for filename in filenames:
+                if len(pending) >= window:
+                    yield pending.popleft().wait()
+                pending.append(eventlet.spawn(_fetch, filename))
+            while pending:
+                yield pending.popleft().wait()
+        finally:
+            for fetch in pending:
+                fetch.kill()
 
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = ElementTree.fromstring(manifest)
@@ -268,8 +298,6 @@ class S3ImageService(object):
     def _s3_create(self, context, metadata):
         """Gets a manifest from s3 and makes an image."""
 
-        image_path = tempfile.mkdtemp(dir=FLAGS.image_decryption_dir)
-
         image_location = metadata['properties']['image_location']
         bucket_name = image_location.split('/')[0]
         manifest_path = image_location[len(bucket_name) + 1:]
@@ -282,77 +310,35 @@ class S3ImageService(object):
                                                               manifest)
 
         def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
+            """This streams the part files through decryption to glance."""
             context.update_store()
-            log_vars = {'image_location': image_location,
-                        'image_path': image_path}
+            log_vars = {'image_location': image_location}
             metadata['properties']['image_state'] = 'downloading'
             self.service.update(context, image_uuid, metadata)
 
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_download'
-                self.service.update(context, image_uuid, metadata)
-                return
-
-            metadata['properties']['image_state'] = 'decrypting'
-            self.service.update(context, image_uuid, metadata)
-
             try:
                 hex_key = manifest.find('image/ec2_encrypted_key').text
                 encrypted_key = binascii.a2b_hex(hex_key)
                 hex_iv = manifest.find('image/ec2_encrypted_iv').text
                 encrypted_iv = binascii.a2b_hex(hex_iv)
-
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(context, enc_filename, encrypted_key,
-                                    encrypted_iv, dec_filename)
+                key, iv = self._decrypt_key_and_iv(context, encrypted_key,
+                                                   encrypted_iv)
             except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
+                LOG.exception(_("Failed to decrypt %(image_location)s"),
+                              log_vars)
                 metadata['properties']['image_state'] = 'failed_decrypt'
                 self.service.update(context, image_uuid, metadata)
                 return
 
-            metadata['properties']['image_state'] = 'untarring'
-            self.service.update(context, image_uuid, metadata)
-
+            elements = manifest.find('image').getiterator('filename')
+            filenames = [fn_element.text for fn_element in elements]
             try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
-            except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_untar'
-                self.service.update(context, image_uuid, metadata)
-                return
-
-            metadata['properties']['image_state'] = 'uploading'
-            self.service.update(context, image_uuid, metadata)
-            try:
-                with open(unz_filename) as image_file:
-                    self.service.update(context, image_uuid,
-                                        metadata, image_file)
-            except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_upload'
+                self._stream_image(context, bucket, filenames, key, iv,
+                                   image_uuid, metadata)
+            except ImageRegistrationFailed, exc:
+                LOG.exception(_("Failed to register %(image_location)s"),
+                              log_vars)
+                metadata['properties']['image_state'] = exc.image_state
                 self.service.update(context, image_uuid, metadata)
                 return
 
@@ -360,15 +346,123 @@ class S3ImageService(object):
             metadata['status'] = 'active'
             self.service.update(context, image_uuid, metadata)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
+    def _stream_image(self, context, bucket, filenames, key, iv,
+                      image_uuid, metadata):
+        """Download, decrypt, untar and upload an image in a single pass.
+
+        The parts are piped through openssl and the decrypted tarball is
+        read as a stream, so nothing is staged on local disk.
+
+        :raises: ImageRegistrationFailed with the image_state to record
+        """
+        proc = subprocess.Popen(['openssl', 'enc', '-d', '-aes-128-cbc',
+                                 '-K', key, '-iv', iv],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                close_fds=True)
+
+        def _feed():
+            try:
+                for part in self._download_parts(bucket, filenames):
+                    try:
+                        proc.stdin.write(part)
+                    except IOError:
+                        # NOTE: openssl went away, its exit status
+                        #       tells us why.
+                        return
+            finally:
+                try:
+                    proc.stdin.close()
+                except IOError:
+                    # NOTE: flushing failed for the same reason.
+                    pass
+
+        feeder = eventlet.spawn(_feed)
+        try:
+            self._upload_tarball_stream(context, image_uuid, metadata,
+                                        proc.stdout)
+        except ImageRegistrationFailed:
+            # NOTE: stop openssl outright, its stdin may be left open
+            #       by the feeder being killed mid write.
+            feeder.kill()
+            proc.kill()
+            proc.wait()
+            raise
+        except Exception:
+            LOG.exception(_("Failed to untar image %s"), image_uuid)
+            # NOTE: drain the pipe so the exit status of openssl reflects
+            #       the data rather than a broken pipe.
+            while proc.stdout.read(CHUNK_SIZE):
+                pass
+            image_state = 'failed_untar'
+            try:
+                feeder.wait()
+            except Exception:
+                image_state = 'failed_download'
+            if proc.wait() and image_state == 'failed_untar':
+                image_state = 'failed_decrypt'
+            raise ImageRegistrationFailed(image_state)
+
+        try:
+            feeder.wait()
+        except Exception:
+            LOG.exception(_("Failed to download image %s"), image_uuid)
+            proc.wait()
+            raise ImageRegistrationFailed('failed_download')
+        if proc.wait():
+            LOG.error(_("Failed to decrypt image %(image_uuid)s: %(err)s"),
+                      {'image_uuid': image_uuid, 'err': proc.stderr.read()})
+            raise ImageRegistrationFailed('failed_decrypt')
+
+    def _upload_tarball_stream(self, context, image_uuid, metadata,
+                               stream):
+        """Upload the first file of a gzipped tar stream as the image.
+
+        Member names are checked as they go by and the remainder of the
+        stream is consumed so the decryption process can finish.
+        """
+        tar_file = tarfile.open(fileobj=stream, mode='r|gz')
+        try:
+            uploaded = False
+            for tarinfo in tar_file:
+                try:
+                    self._check_tarball_member(FLAGS.image_decryption_dir,
+                                               tarinfo.name)
+                except exception.Error:
+                    LOG.exception(_("Unsafe tarball for image %s"),
+                                  image_uuid)
+                    raise ImageRegistrationFailed('failed_untar')
+                if uploaded:
+                    continue
+                if not tarinfo.isfile():
+                    LOG.error(_("Image %s is not a regular file"),
+                              image_uuid)
+                    raise ImageRegistrationFailed('failed_untar')
+
+                metadata['properties']['image_state'] = 'uploading'
+                self.service.update(context, image_uuid, metadata)
+                try:
+                    image_file = tar_file.extractfile(tarinfo)
+                    self.service.update(context, image_uuid,
+                                        metadata, image_file)
+                except Exception:
+                    LOG.exception(_("Failed to upload image %s"), image_uuid)
+                    raise ImageRegistrationFailed('failed_upload')
+                uploaded = True
+        finally:
+            tar_file.close()
+
+        if not uploaded:
+            LOG.error(_("No image found in tarball for %s"), image_uuid)
+            raise ImageRegistrationFailed('failed_untar')
+
     @staticmethod
-    def _decrypt_image(context, encrypted_filename, encrypted_key,
-                       encrypted_iv, decrypted_filename):
+    def _decrypt_key_and_iv(context, encrypted_key, encrypted_iv):
         elevated = context.elevated()
         try:
             key = rpc.call(elevated, FLAGS.cert_topic,
@@ -386,35 +480,10 @@ class S3ImageService(object):
         except Exception, exc:
             raise exception.Error(_('Failed to decrypt initialization '
                                     'vector: %s') % exc)
-
-        try:
-            utils.execute('openssl', 'enc',
-                          '-d', '-aes-128-cbc',
-                          '-in', '%s' % (encrypted_filename,),
-                          '-K', '%s' % (key,),
-                          '-iv', '%s' % (iv,),
-                          '-out', '%s' % (decrypted_filename,))
-        except exception.ProcessExecutionError, exc:
-            raise exception.Error(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': exc.stdout})
-
-    @staticmethod
-    def _test_for_malicious_tarball(path, filename):
-        """Raises exception if extracting tarball would escape extract path"""
-        tar_file = tarfile.open(filename, 'r|gz')
-        for n in tar_file.getnames():
-            if not os.path.abspath(os.path.join(path, n)).startswith(path):
-                tar_file.close()
-                raise exception.Error(_('Unsafe filenames in image'))
-        tar_file.close()
+        return key, iv
 
     @staticmethod
-    def _untarzip_image(path, filename):
-        S3ImageService._test_for_malicious_tarball(path, filename)
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+    def _check_tarball_member(path, name):
+        """Raises exception if extracting name would escape extract path"""
+        if not os.path.abspath(os.path.join(path, name)).startswith(path):
+            raise exception.Error(_('Unsafe filenames in image'))
@@ -53,10 +53,15 @@ This module provides Manager, a base class for managers.
 
 """
 
+import random
+import time
+
+from nova import context as nova_context
 from nova.db import base
 from nova import flags
 from nova import log as logging
 from nova.scheduler import api
+from nova import utils
 from nova import version
 
 
@@ -65,6 +70,9 @@ FLAGS = flags.FLAGS
 
 LOG = logging.getLogger(__name__)
 
+# Upper bounds in seconds of the periodic task run time histogram buckets
+PERIODIC_TASK_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
 
 def periodic_task(*args, **kwargs):
     """Decorator to indicate that a method is a periodic task.
@@ -76,10 +84,15 @@ def periodic_task(*args, **kwargs):
 
         2. With arguments, @periodic_task(ticks_between_runs=N), this will be
            run on every N ticks of the periodic scheduler.
+
+    When periodic tasks run on their own greenthreads, a tick lasts
+    periodic_interval seconds; @periodic_task(spacing=S) runs the task
+    every S seconds instead.
     """
     def decorator(f):
         f._periodic_task = True
         f._ticks_between_runs = kwargs.pop('ticks_between_runs', 0)
+        f._periodic_spacing = kwargs.pop('spacing', 0)
         return f
 
     # NOTE(sirp): The `if` is necessary to allow the decorator to be used with
@@ -134,6 +147,7 @@ class Manager(base.Base):
         if not host:
             host = FLAGS.host
         self.host = host
+        self._periodic_task_stats = {}
         super(Manager, self).__init__(db_driver)
 
     def periodic_tasks(self, context, raise_on_error=False):
@@ -149,15 +163,96 @@ class Manager(base.Base):
                 continue
 
             self._ticks_to_skip[task_name] = task._ticks_between_runs
-            LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
-
-            try:
-                task(self, context)
-            except Exception as e:
-                if raise_on_error:
-                    raise
-                LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
-                              locals())
+            self._run_periodic_task(context, task_name, task,
+                                    raise_on_error=raise_on_error)
+
+    def start_periodic_tasks(self, interval, fuzzy_delay=0):
+        """Run each periodic task on its own greenthread.
+
+        Tasks run every (ticks_between_runs + 1) * interval seconds, or
+        every spacing seconds, at fixed wall-clock times, so that a slow
+        task neither delays the others nor shifts its own schedule. A run
+        still going when the next is due makes that one be skipped rather
+        than overlap it. As with the ticks of periodic_tasks(), a task
+        first runs once its interval has passed, brought forward by a
+        random number of seconds up to fuzzy_delay so that services
+        started together do not run their tasks at the same moment.
+
+        Returns the timers running the tasks.
+        """
+        timers = []
+        for task_name, task in self._periodic_tasks:
+            spacing = (task._periodic_spacing or
+                       interval * (task._ticks_between_runs + 1))
+            initial_delay = spacing - random.uniform(0, min(fuzzy_delay,
+                                                            spacing))
+            timer = utils.FixedIntervalLoopingCall(
+                    self._run_periodic_task, None, task_name, task,
+                    spacing=spacing)
+            timer.start(interval=spacing, initial_delay=initial_delay)
+            timers.append(timer)
+        return timers
+
+    def _run_periodic_task(self, context, task_name, task, spacing=None,
+                           raise_on_error=False):
+        full_task_name = '.'.join([self.__class__.__name__, task_name])
+        LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
+        if context is None:
+            context = nova_context.get_admin_context()
+
+        start = time.time()
+        failed = False
+        try:
+            task(self, context)
+        except Exception as e:
+            failed = True
+            if raise_on_error:
+                raise
+            LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
+                          locals())
+        finally:
+            duration = time.time() - start
+            self._record_periodic_task(task_name, duration, failed, spacing)
+            if spacing and duration > spacing:
+                LOG.warn(_("%(full_task_name)s took %(duration).1f seconds, "
+                           "longer than its %(spacing)s second interval"),
+                         locals())
+
+    def _record_periodic_task(self, task_name, duration, failed, spacing):
+        stats = self._periodic_task_stats.get(task_name)
+        if stats is None:
+            histogram = dict(('<=%s' % bound, 0)
+                             for bound in PERIODIC_TASK_BUCKETS)
+            histogram['>%s' % PERIODIC_TASK_BUCKETS[-1]] = 0
+            stats = self._periodic_task_stats[task_name] = dict(
+                    runs=0, failures=0, overruns=0, total_time=0.0,
+                    max_time=0.0, histogram=histogram)
+        stats['runs'] += 1
+        if failed:
+            stats['failures'] += 1
+        if spacing and duration > spacing:
+            stats['overruns'] += 1
+        stats['spacing'] = spacing
+        stats['last_run'] = utils.isotime()
+        stats['last_time'] = duration
+        stats['total_time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+        for bound in PERIODIC_TASK_BUCKETS:
+            if duration <= bound:
+                stats['histogram']['<=%s' % bound] += 1
+                break
+        else:
+            stats['histogram']['>%s' % PERIODIC_TASK_BUCKETS[-1]] += 1
+
+    def periodic_task_stats(self, context):
+        """Return, per periodic task, its number of runs, failures and
+        overruns of its interval, when it last ran and a histogram of
+        the seconds its runs took."""
+        stats = {}
+        for task_name, task_stats in self._periodic_task_stats.iteritems():
+            stats[task_name] = dict(task_stats,
+                                    histogram=task_stats['histogram'].copy())
+        return stats
 
     def init_host(self):
         """Handle initialization if this is a standalone service.
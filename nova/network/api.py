@@ -234,6 +234,24 @@ class API(base.Base):
                 raise exception.InstanceNotFound(instance_id=instance['id'])
             raise
 
+    def get_instances_nw_info(self, context, instances):
+        """Refreshes the network info of several instances in one call.
+
+        Returns the network info keyed by instance uuid, leaving out
+        instances which no longer exist.
+        """
+        args = [{'instance_id': instance['id'],
+                 'instance_uuid': instance['uuid'],
+                 'rxtx_factor': instance['instance_type']['rxtx_factor'],
+                 'host': instance['host'],
+                 'project_id': instance['project_id']}
+                for instance in instances]
+        nw_infos = rpc.call(context, FLAGS.network_topic,
+                            {'method': 'get_instances_nw_info',
+                             'args': {'instances': args}})
+        return dict((uuid, network_model.NetworkInfo.hydrate(nw_info))
+                    for uuid, nw_info in nw_infos.iteritems())
+
     def validate_networks(self, context, requested_networks):
         """validate the networks passed at the time of creating
         the server
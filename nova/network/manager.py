@@ -389,15 +389,29 @@ class FloatingIP(object):
     def allocate_floating_ip(self, context, project_id, pool=None):
         """Gets a floating ip from the pool."""
         # NOTE(tr3buchet): all network hosts in zone now use the same pool
-        LOG.debug("QUOTA: %s" % quota.allowed_floating_ips(context, 1))
-        if quota.allowed_floating_ips(context, 1) < 1:
+        allowed = quota.allowed_floating_ips(context, 1)
+        LOG.debug("QUOTA: %s" % allowed)
+        if allowed < 1:
             LOG.warn(_('Quota exceeded for %s, tried to allocate address'),
                      context.project_id)
             raise exception.QuotaError(code='AddressLimitExceeded')
+        try:
+            reservations = quota.reserve(context, floating_ips=1)
+        except exception.OverQuota:
+            LOG.warn(_('Quota exceeded for %s, tried to allocate address'),
+                     context.project_id)
+            raise exception.QuotaError(code='AddressLimitExceeded')
+
         pool = pool or FLAGS.default_floating_pool
-        return self.db.floating_ip_allocate_address(context,
-                                                    project_id,
-                                                    pool)
+        try:
+            address = self.db.floating_ip_allocate_address(context,
+                                                           project_id,
+                                                           pool)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                quota.rollback(context, reservations)
+        quota.commit(context, reservations)
+        return address
 
     @wrap_check_policy
     def deallocate_floating_ip(self, context, address,
@@ -956,6 +970,27 @@ class NetworkManager(manager.SchedulerDependentManager):
                                           {'network_info': nw_info.as_cache()})
         return nw_info
 
+    @wrap_check_policy
+    def get_instances_nw_info(self, context, instances):
+        """Creates network info lists for several instances.
+
+        instances is a list of get_instance_nw_info() arguments. Returns
+        the network info keyed by instance uuid; instances which no
+        longer exist or fail are left out.
+        """
+        nw_infos = {}
+        for kwargs in instances:
+            instance_uuid = kwargs['instance_uuid']
+            try:
+                nw_infos[instance_uuid] = self.get_instance_nw_info(context,
+                                                                    **kwargs)
+            except exception.InstanceNotFound:
+                pass
+            except Exception:
+                LOG.exception(_("Unable to get network info for instance "
+                                "%s"), instance_uuid)
+        return nw_infos
+
     def build_network_info_model(self, context, vifs, networks,
                                  rxtx_factor, instance_host):
         """Builds a NetworkInfo object containing all network information
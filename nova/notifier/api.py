@@ -15,6 +15,9 @@
 
 import uuid
 
+import eventlet
+from eventlet import queue
+
 from nova import flags
 from nova import utils
 from nova import log as logging
@@ -30,6 +33,22 @@ notifier_opts = [
     cfg.StrOpt('default_publisher_id',
                default='$host',
                help='Default publisher_id for outgoing notifications'),
+    cfg.BoolOpt('notification_async',
+                default=False,
+                help='Queue notifications and publish them from a background '
+                     'green thread instead of in the caller'),
+    cfg.IntOpt('notification_queue_size',
+               default=1000,
+               help='Maximum number of notifications waiting to be '
+                    'published when notification_async is set'),
+    cfg.StrOpt('notification_queue_full',
+               default='block',
+               help='What to do with a notification when the queue is full: '
+                    '"block" the caller until there is room, or "drop" it'),
+    cfg.IntOpt('notification_batch_size',
+               default=100,
+               help='Maximum number of queued notifications to publish at '
+                    'once'),
     ]
 
 FLAGS = flags.FLAGS
@@ -114,19 +133,150 @@ def notify(publisher_id, event_type, priority, payload):
         raise BadPriorityException(
                  _('%s not in valid priorities') % priority)
 
+    msg = _build_message(publisher_id, event_type, priority, payload)
+    if FLAGS.notification_async:
+        _publisher.put(msg)
+    else:
+        _send([msg])
+
+
+def notify_many(publisher_id, event_type, priority, payloads):
+    """Sends a notification for each payload as a single batch
+
+    Takes the same parameters as notify(), with a list of payloads.  The
+    batch is handed to the driver at once, bypassing the queue used when
+    notification_async is set, so a driver implementing notify_many()
+    publishes it in one go.
+
+    Returns True if the driver accepted the batch.
+    """
+    if priority not in log_levels:
+        raise BadPriorityException(
+                 _('%s not in valid priorities') % priority)
+
+    messages = [_build_message(publisher_id, event_type, priority, payload)
+                for payload in payloads]
+    if not messages:
+        return True
+    return _send(messages)
+
+
+def _build_message(publisher_id, event_type, priority, payload):
     # Ensure everything is JSON serializable.
     payload = utils.to_primitive(payload, convert_instances=True)
 
-    driver = utils.import_object(FLAGS.notification_driver)
-    msg = dict(message_id=str(uuid.uuid4()),
-                   publisher_id=publisher_id,
-                   event_type=event_type,
-                   priority=priority,
-                   payload=payload,
-                   timestamp=str(utils.utcnow()))
+    return dict(message_id=str(uuid.uuid4()),
+                publisher_id=publisher_id,
+                event_type=event_type,
+                priority=priority,
+                payload=payload,
+                timestamp=str(utils.utcnow()))
+
+
+_drivers = {}
+
+
+def _get_driver():
+    """Returns the notification driver, importing it only once."""
+    name = FLAGS.notification_driver
+    driver = _drivers.get(name)
+    if driver is None:
+        driver = utils.import_object(name)
+        _drivers[name] = driver
+    return driver
+
+
+def _send(messages):
+    """Passes messages to the driver, as one batch if it supports it.
+
+    Returns True if the driver accepted them."""
     try:
-        driver.notify(msg)
+        driver = _get_driver()
+        if len(messages) > 1 and hasattr(driver, 'notify_many'):
+            driver.notify_many(messages)
+        else:
+            for msg in messages:
+                driver.notify(msg)
     except Exception, e:
+        payload = [msg['payload'] for msg in messages]
         LOG.exception(_("Problem '%(e)s' attempting to "
                         "send to notification system. Payload=%(payload)s") %
                         locals())
+        return False
+    return True
+
+
+class AsyncPublisher(object):
+    """Publishes notifications from a bounded queue in a green thread."""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self.queued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+
+    def put(self, msg):
+        if self._queue is None:
+            self._queue = queue.Queue(FLAGS.notification_queue_size)
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+        if FLAGS.notification_queue_full == 'drop':
+            try:
+                self._queue.put_nowait(msg)
+            except queue.Full:
+                self.dropped += 1
+                LOG.debug(_('Notification queue full, dropping %s'),
+                          msg['event_type'])
+                return
+        else:
+            self._queue.put(msg)
+        self.queued += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < FLAGS.notification_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _send(batch):
+                self.sent += len(batch)
+            else:
+                self.failed += len(batch)
+            for msg in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Waits until every queued notification has been handed to the
+        driver."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def reset(self):
+        if self._thread is not None:
+            self._thread.kill()
+        self.__init__()
+
+    def stats(self):
+        return {'queued': self.queued,
+                'dropped': self.dropped,
+                'sent': self.sent,
+                'failed': self.failed,
+                'pending': self._queue.qsize() if self._queue else 0}
+
+
+_publisher = AsyncPublisher()
+
+
+def flush():
+    """Waits for queued notifications to be published."""
+    _publisher.flush()
+
+
+def stats():
+    """Returns counters of notifications published asynchronously."""
+    return _publisher.stats()
@@ -39,8 +39,19 @@ def notify(message):
     priority = priority.lower()
     for topic in FLAGS.notification_topics:
         topic = '%s.%s' % (topic, priority)
-        try:
-            rpc.notify(context, topic, message)
-        except Exception, e:
-            LOG.exception(_("Could not send notification to %(topic)s. "
-                            "Payload=%(message)s" % locals()))
+        rpc.notify(context, topic, message)
+
+
+def notify_many(messages):
+    """Sends several notifications to the RabbitMQ, a connection per topic"""
+    context = nova.context.get_admin_context()
+    by_priority = {}
+    for message in messages:
+        priority = message.get('priority',
+                               FLAGS.default_notification_level)
+        by_priority.setdefault(priority.lower(), []).append(message)
+
+    for priority, priority_messages in by_priority.iteritems():
+        for topic in FLAGS.notification_topics:
+            topic = '%s.%s' % (topic, priority)
+            rpc.notify_many(context, topic, priority_messages)
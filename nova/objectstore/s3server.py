@@ -34,11 +34,12 @@ S3 client with this module::
 
 """
 
-import bisect
 import datetime
 import hashlib
 import os
 import os.path
+import sqlite3
+import tempfile
 import urllib
 
 import routes
@@ -57,6 +58,9 @@ buckets_path_opt = cfg.StrOpt('buckets_path', default='$state_path/buckets',
 FLAGS = flags.FLAGS
 FLAGS.register_opt(buckets_path_opt)
 
+# NOTE: size of the reads and writes used to stream objects
+CHUNK_SIZE = 64 * 1024
+
 
 def get_wsgi_server():
     return wsgi.Server("S3 Objectstore",
@@ -87,9 +91,160 @@ class S3Application(wsgi.Router):
         self.directory = os.path.abspath(root_directory)
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
+        # NOTE: bucket names may not start with a '.', so the key indexes
+        #       and in-flight uploads live in hidden directories of the root.
+        self.index_directory = os.path.join(self.directory, '.index')
+        self.incoming_directory = os.path.join(self.directory, '.incoming')
+        for directory in (self.index_directory, self.incoming_directory):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
         self.bucket_depth = bucket_depth
         super(S3Application, self).__init__(mapper)
 
+    def bucket_index(self, bucket_name):
+        """Returns the key index of a bucket."""
+        return BucketIndex(self, bucket_name)
+
+
+class BucketIndex(object):
+    """Sorted on-disk index of the keys in a bucket.
+
+    The index is a small sqlite database keyed on the object name, so
+    listing a page of keys after a marker or under a prefix only reads
+    that page instead of walking the whole bucket.  It is built from the
+    bucket directory the first time it is needed and kept up to date by
+    object puts and deletes.
+
+    """
+
+    def __init__(self, application, bucket_name):
+        self.application = application
+        self.bucket_path = os.path.join(application.directory, bucket_name)
+        self.path = os.path.join(application.index_directory,
+                                 '%s.sqlite' % bucket_name)
+
+    def _connect(self):
+        exists = os.path.exists(self.path)
+        conn = sqlite3.connect(self.path)
+        if not exists:
+            try:
+                conn.execute('CREATE TABLE objects (name TEXT PRIMARY KEY, '
+                             'size INTEGER, mtime REAL)')
+                self._rebuild(conn)
+            except Exception:
+                conn.close()
+                os.unlink(self.path)
+                raise
+        return conn
+
+    def _rebuild(self, conn):
+        skip = len(self.bucket_path) + 1
+        for i in range(self.application.bucket_depth):
+            skip += 2 * (i + 1) + 1
+        rows = []
+        for root, dirs, files in os.walk(self.bucket_path):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                info = os.stat(path)
+                rows.append((self._name(path[skip:]), info.st_size,
+                             info.st_mtime))
+        conn.executemany('INSERT INTO objects VALUES (?, ?, ?)', rows)
+        conn.commit()
+
+    @staticmethod
+    def _name(name):
+        if isinstance(name, str):
+            name = name.decode('utf-8')
+        return name
+
+    def add(self, object_name, path):
+        info = os.stat(path)
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?)',
+                         (self._name(object_name), info.st_size,
+                          info.st_mtime))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def remove(self, object_name):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM objects WHERE name = ?',
+                         (self._name(object_name),))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def destroy(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def list(self, prefix, marker, max_keys):
+        """Returns up to max_keys (name, size, mtime) tuples and whether
+        the listing was truncated."""
+        prefix = self._name(prefix)
+        marker = self._name(marker)
+        conn = self._connect()
+        try:
+            cursor = conn.execute('SELECT name, size, mtime FROM objects '
+                                  'WHERE name > ? AND name >= ? '
+                                  'ORDER BY name LIMIT ?',
+                                  (marker, prefix, max_keys + 1))
+            objects = []
+            truncated = False
+            for row in cursor:
+                if not row[0].startswith(prefix):
+                    break
+                if len(objects) >= max_keys:
+                    truncated = True
+                    break
+                objects.append(row)
+            return objects, truncated
+        finally:
+            conn.close()
+
+
+class FileIter(object):
+    """Iterates over a file in chunks, optionally over a byte range.
+
+    WebOb uses app_iter_range to answer Range requests when the response
+    is conditional, so objects never have to be read into memory.
+
+    """
+
+    def __init__(self, path, start=0, stop=None):
+        self.file = open(path, 'rb')
+        self.start = start
+        self.stop = stop
+
+    def __iter__(self):
+        self.file.seek(self.start)
+        remaining = None
+        if self.stop is not None:
+            remaining = self.stop - self.start
+        try:
+            while remaining is None or remaining > 0:
+                size = CHUNK_SIZE
+                if remaining is not None:
+                    size = min(size, remaining)
+                    remaining -= size
+                chunk = self.file.read(size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def app_iter_range(self, start, stop):
+        self.start = start
+        self.stop = stop
+        return self
+
+    def close(self):
+        self.file.close()
+
 
 class BaseRequestHandler(object):
     """Base class emulating Tornado's web framework pattern in WSGI.
@@ -171,6 +326,8 @@ class BaseRequestHandler(object):
 
         if isinstance(value, basestring):
             parts.append(utils.xhtml_escape(value))
+        elif isinstance(value, bool):
+            parts.append(str(value).lower())
         elif isinstance(value, int) or isinstance(value, long):
             parts.append(str(value))
         elif isinstance(value, datetime.datetime):
@@ -203,6 +360,8 @@ class RootHandler(BaseRequestHandler):
         names = os.listdir(self.application.directory)
         buckets = []
         for name in names:
+            if name.startswith('.'):
+                continue
             path = os.path.join(self.application.directory, name)
             info = os.stat(path)
             buckets.append({
@@ -227,38 +386,16 @@ class BucketHandler(BaseRequestHandler):
             not os.path.isdir(path)):
             self.set_status(404)
             return
-        object_names = []
-        for root, dirs, files in os.walk(path):
-            for file_name in files:
-                object_names.append(os.path.join(root, file_name))
-        skip = len(path) + 1
-        for i in range(self.application.bucket_depth):
-            skip += 2 * (i + 1) + 1
-        object_names = [n[skip:] for n in object_names]
-        object_names.sort()
+        index = self.application.bucket_index(bucket_name)
+        objects, truncated = index.list(prefix, marker, max_keys)
         contents = []
-
-        start_pos = 0
-        if marker:
-            start_pos = bisect.bisect_right(object_names, marker, start_pos)
-        if prefix:
-            start_pos = bisect.bisect_left(object_names, prefix, start_pos)
-
-        truncated = False
-        for object_name in object_names[start_pos:]:
-            if not object_name.startswith(prefix):
-                break
-            if len(contents) >= max_keys:
-                truncated = True
-                break
-            object_path = self._object_path(bucket_name, object_name)
+        for object_name, size, mtime in objects:
             c = {"Key": object_name}
             if not terse:
-                info = os.stat(object_path)
                 c.update({
                     "LastModified": datetime.datetime.utcfromtimestamp(
-                        info.st_mtime),
-                    "Size": info.st_size,
+                        mtime),
+                    "Size": size,
                 })
             contents.append(c)
             marker = object_name
@@ -275,7 +412,7 @@ class BucketHandler(BaseRequestHandler):
         path = os.path.abspath(os.path.join(
             self.application.directory, bucket_name))
         if (not path.startswith(self.application.directory) or
-            os.path.exists(path)):
+            bucket_name.startswith('.') or os.path.exists(path)):
             self.set_status(403)
             return
         os.makedirs(path)
@@ -292,6 +429,7 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         os.rmdir(path)
+        self.application.bucket_index(bucket_name).destroy()
         self.set_status(204)
         self.finish()
 
@@ -308,11 +446,9 @@ class ObjectHandler(BaseRequestHandler):
         self.set_header("Content-Type", "application/unknown")
         self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
             info.st_mtime))
-        object_file = open(path, "r")
-        try:
-            self.finish(object_file.read())
-        finally:
-            object_file.close()
+        self.response.conditional_response = True
+        self.response.app_iter = FileIter(path)
+        self.response.content_length = info.st_size
 
     def put(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
@@ -329,13 +465,37 @@ class ObjectHandler(BaseRequestHandler):
         directory = os.path.dirname(path)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        object_file = open(path, "w")
-        object_file.write(self.request.body)
-        object_file.close()
-        self.set_header('ETag',
-                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+        md5 = hashlib.md5()
+        fd, tmp_path = tempfile.mkstemp(
+                dir=self.application.incoming_directory)
+        try:
+            with os.fdopen(fd, 'wb') as object_file:
+                for chunk in self._read_body():
+                    md5.update(chunk)
+                    object_file.write(chunk)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.application.bucket_index(bucket).add(object_name, path)
+        self.set_header('ETag', '"%s"' % md5.hexdigest())
         self.finish()
 
+    def _read_body(self):
+        """Yields the request body in chunks."""
+        body_file = self.request.body_file
+        remaining = self.request.content_length
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE
+            if remaining is not None:
+                size = min(size, remaining)
+            chunk = body_file.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
     def delete(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
         path = self._object_path(bucket, object_name)
@@ -344,5 +504,6 @@ class ObjectHandler(BaseRequestHandler):
             self.set_status(404)
             return
         os.unlink(path)
+        self.application.bucket_index(bucket).remove(object_name)
         self.set_status(204)
         self.finish()
@@ -17,6 +17,8 @@
 
 """Policy Engine For Nova"""
 
+import time
+
 from nova.common import policy
 from nova import exception
 from nova import flags
@@ -31,6 +33,10 @@ policy_opts = [
     cfg.StrOpt('policy_default_rule',
                default='default',
                help=_('Rule checked when requested rule is not found')),
+    cfg.IntOpt('policy_file_check_interval',
+               default=1,
+               help=_('Seconds between checks of policy_file for '
+                      'changes, 0 to check on every policy check')),
     ]
 
 FLAGS = flags.FLAGS
@@ -53,8 +59,14 @@ def init():
     global _POLICY_CACHE
     if not _POLICY_PATH:
         _POLICY_PATH = utils.find_config(FLAGS.policy_file)
+    now = time.time()
+    checked = _POLICY_CACHE.get('checked')
+    if (checked is not None and
+        0 <= now - checked < FLAGS.policy_file_check_interval):
+        return
     utils.read_cached_file(_POLICY_PATH, _POLICY_CACHE,
                            reload_func=_set_brain)
+    _POLICY_CACHE['checked'] = now
 
 
 def _set_brain(data):
@@ -81,10 +93,54 @@ def enforce(context, action, target):
     """
     init()
 
-    match_list = ('rule:%s' % action,)
-    credentials = context.to_dict()
+    check = policy.get_brain().compile(('rule:%s' % action,))
+    results, key = _get_results(context, check, target)
+    if key is None:
+        allowed = check(target, context.to_dict())
+    else:
+        allowed = results.get(key)
+        if allowed is None:
+            allowed = results[key] = check(target, context.to_dict())
 
-    try:
-        policy.enforce(match_list, target, credentials)
-    except policy.NotAuthorized:
+    if not allowed:
         raise exception.PolicyNotAuthorized(action=action)
+
+
+# Credentials a check result may depend on and still be remembered
+# for the context, they're all context attributes.
+_CACHEABLE_CRED_KEYS = frozenset(['user_id', 'project_id', 'is_admin',
+                                  'read_deleted', 'roles'])
+
+
+def _get_results(context, check, target):
+    """Returns the results remembered for context and a key for check.
+
+    The key is None if the result of the check can't be remembered.
+    Keys start with the check, which is compiled anew when the rules
+    change.
+
+    """
+    if (not check.cacheable or
+        not _CACHEABLE_CRED_KEYS.issuperset(check.cred_keys)):
+        return None, None
+
+    key = [check]
+    for cred_key in check.cred_keys:
+        value = getattr(context, cred_key)
+        if cred_key == 'roles':
+            value = tuple(value)
+        key.append(value)
+    try:
+        for target_key in check.target_keys:
+            key.append(target[target_key])
+        key = tuple(key)
+        hash(key)
+    except (AttributeError, KeyError, TypeError):
+        return None, None
+
+    # NOTE: elevated() copies share the results, the roles and admin
+    # flag are part of every key that depends on them.
+    results = getattr(context, '_policy_results', None)
+    if results is None:
+        results = context._policy_results = {}
+    return results, key
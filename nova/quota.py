@@ -18,9 +18,12 @@
 
 """Quotas for instances, volumes, and floating ips."""
 
+import datetime
+
 from nova import db
 from nova.openstack.common import cfg
 from nova import flags
+from nova import utils
 
 
 quota_opts = [
@@ -54,6 +57,9 @@ quota_opts = [
     cfg.IntOpt('quota_max_injected_file_path_bytes',
                default=255,
                help='number of bytes allowed per injected file path'),
+    cfg.IntOpt('reservation_expire',
+               default=86400,
+               help='number of seconds until a reservation expires'),
     ]
 
 FLAGS = flags.FLAGS
@@ -89,6 +95,14 @@ def get_project_quotas(context, project_id):
     return rval
 
 
+def get_project_usages(context, project_id):
+    """Returns the amount of each resource in use or reserved."""
+    usages = db.quota_usage_get_all_by_project(context, project_id)
+    return dict((resource, usage['in_use'] + usage['reserved'])
+                for resource, usage in usages.iteritems()
+                if resource != 'project_id')
+
+
 def _get_request_allotment(requested, used, quota):
     if quota is None:
         return requested
@@ -101,8 +115,10 @@ def allowed_instances(context, requested_instances, instance_type):
     context = context.elevated()
     requested_cores = requested_instances * instance_type['vcpus']
     requested_ram = requested_instances * instance_type['memory_mb']
-    usage = db.instance_data_get_for_project(context, project_id)
-    used_instances, used_cores, used_ram = usage
+    usages = get_project_usages(context, project_id)
+    used_instances = usages['instances']
+    used_cores = usages['cores']
+    used_ram = usages['ram']
     quota = get_project_quotas(context, project_id)
     allowed_instances = _get_request_allotment(requested_instances,
                                                used_instances,
@@ -126,8 +142,9 @@ def allowed_volumes(context, requested_volumes, size):
     context = context.elevated()
     size = int(size)
     requested_gigabytes = requested_volumes * size
-    used_volumes, used_gigabytes = db.volume_data_get_for_project(context,
-                                                                  project_id)
+    usages = get_project_usages(context, project_id)
+    used_volumes = usages['volumes']
+    used_gigabytes = usages['gigabytes']
     quota = get_project_quotas(context, project_id)
     allowed_volumes = _get_request_allotment(requested_volumes, used_volumes,
                                              quota['volumes'])
@@ -144,7 +161,8 @@ def allowed_floating_ips(context, requested_floating_ips):
     """Check quota and return min(requested, allowed) floating ips."""
     project_id = context.project_id
     context = context.elevated()
-    used_floating_ips = db.floating_ip_count_by_project(context, project_id)
+    used_floating_ips = get_project_usages(context,
+                                           project_id)['floating_ips']
     quota = get_project_quotas(context, project_id)
     allowed_floating_ips = _get_request_allotment(requested_floating_ips,
                                                   used_floating_ips,
@@ -180,3 +198,37 @@ def allowed_injected_file_content_bytes(context, requested_bytes):
 def allowed_injected_file_path_bytes(context):
     """Return the number of bytes allowed in an injected file path."""
     return FLAGS.quota_max_injected_file_path_bytes
+
+
+def reserve(context, **deltas):
+    """Sets resources aside for the project of the context.
+
+    Keeps the quota checked by the allowed_* functions from being
+    handed out twice by concurrent requests until the resources are
+    created.  Raises OverQuota if the project doesn't have enough
+    quota left.
+
+    :returns: the reservations to commit() or rollback()
+
+    """
+    project_id = context.project_id
+    context = context.elevated()
+    quotas = get_project_quotas(context, project_id)
+    expire = utils.utcnow() + datetime.timedelta(
+            seconds=FLAGS.reservation_expire)
+    return db.quota_reserve(context, project_id, deltas, quotas, expire)
+
+
+def commit(context, reservations):
+    """Releases reservations once their resources have been created.
+
+    The usage counters follow the resources as they are created, so
+    this only stops holding the reserved amounts.
+
+    """
+    db.reservation_release(context.elevated(), reservations)
+
+
+def rollback(context, reservations):
+    """Releases reservations whose resources won't be created."""
+    db.reservation_release(context.elevated(), reservations)
@@ -382,5 +382,15 @@ def notify(context, topic, msg, connection_pool):
         conn.notify_send(topic, msg)
 
 
+def notify_many(context, topic, msgs, connection_pool):
+    """Sends several notification events on a topic over one connection."""
+    LOG.debug(_('Sending %(count)d notifications on %(topic)s...'),
+              {'count': len(msgs), 'topic': topic})
+    with ConnectionContext(connection_pool) as conn:
+        for msg in msgs:
+            pack_context(msg, context)
+            conn.notify_send(topic, msg)
+
+
 def cleanup(connection_pool):
     connection_pool.empty()
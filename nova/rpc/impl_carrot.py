@@ -637,6 +637,19 @@ def notify(context, topic, msg):
         publisher.close()
 
 
+def notify_many(context, topic, msgs):
+    """Sends several notification events on a topic."""
+    LOG.debug(_('Sending %(count)d notifications on %(topic)s...'),
+              {'count': len(msgs), 'topic': topic})
+    with ConnectionPool.item() as conn:
+        publisher = TopicPublisher(connection=conn, topic=topic,
+                                   durable=True)
+        for msg in msgs:
+            _pack_context(msg, context)
+            publisher.send(msg)
+        publisher.close()
+
+
 def cleanup():
     pass
 
@@ -169,6 +169,11 @@ def notify(context, topic, msg):
     check_serialize(msg)
 
 
+def notify_many(context, topic, msgs):
+    for msg in msgs:
+        check_serialize(msg)
+
+
 def cleanup():
     pass
 
@@ -701,5 +701,10 @@ def notify(context, topic, msg):
     return rpc_amqp.notify(context, topic, msg, Connection.pool)
 
 
+def notify_many(context, topic, msgs):
+    """Sends several notification events on a topic."""
+    return rpc_amqp.notify_many(context, topic, msgs, Connection.pool)
+
+
 def cleanup():
     return rpc_amqp.cleanup(Connection.pool)
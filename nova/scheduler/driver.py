@@ -148,13 +148,17 @@ class Scheduler(object):
         self.host_manager.update_service_capabilities(service_name,
                 host, capabilities)
 
+    def service_is_up(self, service):
+        """Check whether a service is up using the HostManager."""
+        return self.host_manager.service_is_up(service)
+
     def hosts_up(self, context, topic):
         """Return the list of hosts that have a running service for topic."""
 
         services = db.service_get_all_by_topic(context, topic)
         return [service['host']
                 for service in services
-                if utils.service_is_up(service)]
+                if self.service_is_up(service)]
 
     def create_instance_db_entry(self, context, request_spec):
         """Create instance DB entry based on request_spec"""
@@ -255,7 +259,7 @@ class Scheduler(object):
         # to the instance.
         if len(instance_ref['volumes']) != 0:
             services = db.service_get_all_by_topic(context, 'volume')
-            if len(services) < 1 or not utils.service_is_up(services[0]):
+            if len(services) < 1 or not self.service_is_up(services[0]):
                 raise exception.VolumeServiceUnavailable()
 
         # Checking src host exists and compute node
@@ -263,7 +267,7 @@ class Scheduler(object):
         services = db.service_get_all_compute_by_host(context, src)
 
         # Checking src host is alive.
-        if not utils.service_is_up(services[0]):
+        if not self.service_is_up(services[0]):
             raise exception.ComputeServiceUnavailable(host=src)
 
     def _live_migration_dest_check(self, context, instance_ref, dest,
@@ -283,7 +287,7 @@ class Scheduler(object):
         dservice_ref = dservice_refs[0]
 
         # Checking dest host is alive.
-        if not utils.service_is_up(dservice_ref):
+        if not self.service_is_up(dservice_ref):
             raise exception.ComputeServiceUnavailable(host=dest)
 
         # Checking whether The host where instance is running
@@ -15,7 +15,6 @@
 
 from nova import log as logging
 from nova.scheduler import filters
-from nova import utils
 
 
 LOG = logging.getLogger(__name__)
@@ -46,7 +45,7 @@ class ComputeFilter(filters.BaseHostFilter):
         capabilities = host_state.capabilities
         service = host_state.service
 
-        if not utils.service_is_up(service) or service['disabled']:
+        if not host_state.service_is_up() or service['disabled']:
             return False
         if not capabilities.get("enabled", True):
             return False
@@ -50,6 +50,12 @@ host_manager_opts = [
                   ],
                 help='Which filter class names to use for filtering hosts '
                       'when not specified in the request.'),
+    cfg.BoolOpt('scheduler_capability_liveness',
+                default=False,
+                help='Treat a capability update received within '
+                     'service_down_time as a heartbeat so liveness checks '
+                     'only fall back to the services table for quiet hosts. '
+                     'Requires periodic_interval < service_down_time.'),
     ]
 
 FLAGS = flags.FLAGS
@@ -58,6 +64,17 @@ FLAGS.register_opts(host_manager_opts)
 LOG = logging.getLogger(__name__)
 
 
+def _capabilities_are_fresh(capabilities):
+    """Check whether a capability update counts as a recent heartbeat."""
+    if not FLAGS.scheduler_capability_liveness or not capabilities:
+        return False
+    timestamp = capabilities.get('timestamp')
+    if not timestamp:
+        return False
+    elapsed = utils.total_seconds(utils.utcnow() - timestamp)
+    return abs(elapsed) <= FLAGS.service_down_time
+
+
 class ReadOnlyDict(UserDict.IterableUserDict):
     """A read-only dict."""
     def __init__(self, source=None):
@@ -128,6 +145,16 @@ class HostState(object):
         self.free_disk_mb = all_disk_mb
         self.vcpus_total = vcpus_total
 
+    def service_is_up(self):
+        """Check whether the service on this host is up.
+
+        A fresh capability update is trusted without looking at the
+        heartbeat stored in the service record.
+        """
+        if _capabilities_are_fresh(self.capabilities):
+            return True
+        return utils.service_is_up(self.service)
+
     def consume_from_instance(self, instance):
         """Update information about a host from instance info."""
         disk_mb = (instance['root_gb'] + instance['ephemeral_gb']) * 1024
@@ -278,6 +305,18 @@ class HostManager(object):
         service_caps[service_name] = capab_copy
         self.service_states[host] = service_caps
 
+    def service_is_up(self, service):
+        """Check whether a service is up, preferring the capability map.
+
+        Only fresh capability updates are trusted, anything else falls back
+        to the heartbeat in the service record.
+        """
+        if FLAGS.scheduler_capability_liveness:
+            host_caps = self.service_states.get(service['host'], {})
+            if _capabilities_are_fresh(host_caps.get(service['topic'])):
+                return True
+        return utils.service_is_up(service)
+
     def host_service_caps_stale(self, host, service):
         """Check if host service capabilites are not recent enough."""
         allowed_time_diff = FLAGS.periodic_interval * 3
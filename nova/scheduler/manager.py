@@ -21,6 +21,7 @@
 Scheduler Service
 """
 
+import datetime
 import functools
 
 from nova.compute import vm_states
@@ -36,12 +37,21 @@ from nova import utils
 
 LOG = logging.getLogger(__name__)
 
-scheduler_driver_opt = cfg.StrOpt('scheduler_driver',
-        default='nova.scheduler.multi.MultiScheduler',
-        help='Default driver to use for the scheduler')
+scheduler_manager_opts = [
+    cfg.StrOpt('scheduler_driver',
+               default='nova.scheduler.multi.MultiScheduler',
+               help='Default driver to use for the scheduler'),
+    cfg.BoolOpt('instance_usage_rollup',
+                default=False,
+                help='Maintain hourly per-project rollups of instance usage '
+                     'for the simple tenant usage extension'),
+    cfg.IntOpt('instance_usage_rollup_max_hours',
+               default=24,
+               help='Maximum number of hours to roll up per periodic run'),
+    ]
 
 FLAGS = flags.FLAGS
-FLAGS.register_opt(scheduler_driver_opt)
+FLAGS.register_opts(scheduler_manager_opts)
 
 
 class SchedulerManager(manager.Manager):
@@ -73,6 +83,34 @@ class SchedulerManager(manager.Manager):
         self.driver.update_service_capabilities(service_name, host,
                 capabilities)
 
+    @manager.periodic_task
+    def _rollup_instance_usage(self, context):
+        """Roll up instance usage for the hours that have ended.
+
+        Each hour is rolled up by replacing its rows, so schedulers running
+        this concurrently only repeat each other's work.
+        """
+        if not FLAGS.instance_usage_rollup:
+            return
+
+        # NOTE: leave a few minutes for lifecycle timestamps of the
+        # previous hour to be written before rolling it up
+        now = utils.utcnow() - datetime.timedelta(minutes=5)
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        first, last = db.instance_usage_rollup_get_range(context)
+        if last is not None:
+            hour = last + datetime.timedelta(hours=1)
+        else:
+            hour = current_hour - datetime.timedelta(
+                    hours=FLAGS.instance_usage_rollup_max_hours)
+
+        for i in xrange(FLAGS.instance_usage_rollup_max_hours):
+            if hour >= current_hour:
+                break
+            LOG.debug(_("Rolling up instance usage for %s"), hour)
+            db.instance_usage_rollup_hour(context, hour)
+            hour += datetime.timedelta(hours=1)
+
     def _schedule(self, method, context, topic, *args, **kwargs):
         """Tries to call schedule_* method on the driver to retrieve host.
         Falls back to schedule(context, topic) if method doesn't exist.
@@ -27,7 +27,6 @@ from nova import exception
 from nova.openstack.common import cfg
 from nova.scheduler import driver
 from nova.scheduler import chance
-from nova import utils
 
 
 simple_scheduler_opts = [
@@ -64,7 +63,7 @@ class SimpleScheduler(chance.ChanceScheduler):
 
         if host and context.is_admin:
             service = db.service_get_by_args(elevated, host, 'nova-compute')
-            if not utils.service_is_up(service):
+            if not self.service_is_up(service):
                 raise exception.WillNotSchedule(host=host)
             return host
 
@@ -86,7 +85,7 @@ class SimpleScheduler(chance.ChanceScheduler):
                 instance_cores + instance_opts['vcpus'] > FLAGS.max_cores):
                 msg = _("Not enough allocatable CPU cores remaining")
                 raise exception.NoValidHost(reason=msg)
-            if utils.service_is_up(service) and not service['disabled']:
+            if self.service_is_up(service) and not service['disabled']:
                 return service['host']
         msg = _("Is the appropriate service running?")
         raise exception.NoValidHost(reason=msg)
@@ -121,7 +120,7 @@ class SimpleScheduler(chance.ChanceScheduler):
             zone, _x, host = availability_zone.partition(':')
         if host and context.is_admin:
             service = db.service_get_by_args(elevated, host, 'nova-volume')
-            if not utils.service_is_up(service):
+            if not self.service_is_up(service):
                 raise exception.WillNotSchedule(host=host)
             driver.cast_to_volume_host(context, host, 'create_volume',
                     volume_id=volume_id, **_kwargs)
@@ -136,7 +135,7 @@ class SimpleScheduler(chance.ChanceScheduler):
             if volume_gigabytes + volume_ref['size'] > FLAGS.max_gigabytes:
                 msg = _("Not enough allocatable volume gigabytes remaining")
                 raise exception.NoValidHost(reason=msg)
-            if utils.service_is_up(service) and not service['disabled']:
+            if self.service_is_up(service) and not service['disabled']:
                 driver.cast_to_volume_host(context, service['host'],
                         'create_volume', volume_id=volume_id, **_kwargs)
                 return None
@@ -30,6 +30,7 @@ from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova.notifier import api as notifier_api
 from nova.openstack.common import cfg
 from nova import rpc
 from nova import utils
@@ -43,9 +44,23 @@ service_opts = [
     cfg.IntOpt('report_interval',
                default=10,
                help='seconds between nodes reporting state to datastore'),
+    cfg.BoolOpt('report_state_atomic',
+                default=False,
+                help='report service state with a single atomic UPDATE '
+                     'instead of reading the service record first'),
     cfg.IntOpt('periodic_interval',
                default=60,
                help='seconds between running periodic tasks'),
+    cfg.BoolOpt('periodic_tasks_concurrent',
+                default=True,
+                help='run each periodic task on its own greenthread at fixed '
+                     'intervals, instead of all of them in turn every '
+                     'periodic_interval'),
+    cfg.IntOpt('periodic_fuzzy_delay',
+               default=60,
+               help='maximum number of seconds to randomly delay the first '
+                    'run of each periodic task by, to keep services started '
+                    'together from running them at the same time'),
     cfg.StrOpt('ec2_listen',
                default="0.0.0.0",
                help='IP address for EC2 API to listen'),
@@ -194,9 +209,13 @@ class Service(object):
             self.timers.append(pulse)
 
         if self.periodic_interval:
-            periodic = utils.LoopingCall(self.periodic_tasks)
-            periodic.start(interval=self.periodic_interval, now=False)
-            self.timers.append(periodic)
+            if FLAGS.periodic_tasks_concurrent:
+                self.timers.extend(self.manager.start_periodic_tasks(
+                        self.periodic_interval, FLAGS.periodic_fuzzy_delay))
+            else:
+                periodic = utils.LoopingCall(self.periodic_tasks)
+                periodic.start(interval=self.periodic_interval, now=False)
+                self.timers.append(periodic)
 
     def _create_service_ref(self, context):
         zone = FLAGS.node_availability_zone
@@ -263,6 +282,8 @@ class Service(object):
             except Exception:
                 pass
         self.timers = []
+        # Publish what is still queued when notification_async is set
+        notifier_api.flush()
 
     def wait(self):
         for x in self.timers:
@@ -280,22 +301,11 @@ class Service(object):
         """Update the state of this service in the datastore."""
         ctxt = context.get_admin_context()
         zone = FLAGS.node_availability_zone
-        state_catalog = {}
         try:
-            try:
-                service_ref = db.service_get(ctxt, self.service_id)
-            except exception.NotFound:
-                LOG.debug(_('The service database object disappeared, '
-                            'Recreating it.'))
-                self._create_service_ref(ctxt)
-                service_ref = db.service_get(ctxt, self.service_id)
-
-            state_catalog['report_count'] = service_ref['report_count'] + 1
-            if zone != service_ref['availability_zone']:
-                state_catalog['availability_zone'] = zone
-
-            db.service_update(ctxt,
-                             self.service_id, state_catalog)
+            if FLAGS.report_state_atomic:
+                self._report_state_atomic(ctxt, zone)
+            else:
+                self._report_state_read_modify_write(ctxt, zone)
 
             # TODO(termie): make this pattern be more elegant.
             if getattr(self, 'model_disconnected', False):
@@ -308,6 +318,35 @@ class Service(object):
                 self.model_disconnected = True
                 LOG.exception(_('model server went away'))
 
+    def _report_state_atomic(self, ctxt, zone):
+        """Heartbeat without reading the service record first."""
+        state_catalog = {'availability_zone': zone}
+        try:
+            db.service_heartbeat(ctxt, self.service_id, state_catalog)
+        except exception.NotFound:
+            LOG.debug(_('The service database object disappeared, '
+                        'Recreating it.'))
+            self._create_service_ref(ctxt)
+            db.service_heartbeat(ctxt, self.service_id, state_catalog)
+
+    def _report_state_read_modify_write(self, ctxt, zone):
+        """Heartbeat by reading and then updating the service record."""
+        state_catalog = {}
+        try:
+            service_ref = db.service_get(ctxt, self.service_id)
+        except exception.NotFound:
+            LOG.debug(_('The service database object disappeared, '
+                        'Recreating it.'))
+            self._create_service_ref(ctxt)
+            service_ref = db.service_get(ctxt, self.service_id)
+
+        state_catalog['report_count'] = service_ref['report_count'] + 1
+        if zone != service_ref['availability_zone']:
+            state_catalog['availability_zone'] = zone
+
+        db.service_update(ctxt,
+                         self.service_id, state_catalog)
+
 
 class WSGIService(object):
     """Provides ability to launch API from a 'paste' configuration."""
@@ -374,6 +413,7 @@ class WSGIService(object):
 
         """
         self.server.stop()
+        notifier_api.flush()
 
     def wait(self):
         """Wait for the service to stop serving this API.
@@ -26,6 +26,7 @@ from nova import policy
 from nova.common import policy as common_policy
 from nova.compute import api
 from nova import context
+from nova import db
 from nova import flags
 from nova import test
 from nova.tests.api.openstack import fakes
@@ -74,6 +75,17 @@ def fake_instance_get_active_by_window(self, context, begin, end, project_id):
                                          for x in xrange(TENANTS * SERVERS)]
 
 
+def fake_get_usage_totals_by_window(self, context, begin, end,
+                                    project_id):
+    hours = (end - begin).days * 24 + (end - begin).seconds / 3600.0
+    return [{'project_id': "faketenant_%s" % x,
+             'hours': SERVERS * hours,
+             'vcpus_hours': SERVERS * VCPUS * hours,
+             'memory_mb_hours': SERVERS * MEMORY_MB * hours,
+             'local_gb_hours': SERVERS * (ROOT_GB + EPHEMERAL_GB) * hours}
+            for x in xrange(TENANTS)]
+
+
 class SimpleTenantUsageTest(test.TestCase):
     def setUp(self):
         super(SimpleTenantUsageTest, self).setUp()
@@ -81,6 +93,8 @@ class SimpleTenantUsageTest(test.TestCase):
                        fake_instance_type_get)
         self.stubs.Set(api.API, "get_active_by_window",
                        fake_instance_get_active_by_window)
+        self.stubs.Set(api.API, "get_usage_totals_by_window",
+                       fake_get_usage_totals_by_window)
         self.admin_context = context.RequestContext('fakeadmin_0',
                                                     'faketenant_0',
                                                     is_admin=True)
@@ -177,6 +191,74 @@ class SimpleTenantUsageTest(test.TestCase):
             policy.reset()
 
 
+class SimpleTenantUsageTotalsTest(test.TestCase):
+    def setUp(self):
+        super(SimpleTenantUsageTotalsTest, self).setUp()
+        self.context = context.get_admin_context()
+        self.compute_api = api.API()
+        instance_type = db.instance_type_create(self.context,
+                {'name': 'usage.test', 'flavorid': 'usage.test',
+                 'memory_mb': MEMORY_MB, 'vcpus': VCPUS, 'root_gb': ROOT_GB,
+                 'ephemeral_gb': EPHEMERAL_GB, 'swap': 0})
+        self.start = datetime.datetime(2012, 5, 1, 10, 20, 0)
+        for x in xrange(TENANTS * SERVERS):
+            launched_at = self.start + datetime.timedelta(hours=x)
+            terminated_at = None
+            if x % 2:
+                terminated_at = launched_at + datetime.timedelta(minutes=90)
+            db.instance_create(self.context,
+                               {'project_id': "faketenant_%s" % (x % TENANTS),
+                                'instance_type_id': instance_type['id'],
+                                'launched_at': launched_at,
+                                'terminated_at': terminated_at})
+
+    def _get_totals(self, begin, end):
+        totals = self.compute_api.get_usage_totals_by_window(self.context,
+                                                             begin, end)
+        return dict((t['project_id'], t) for t in totals)
+
+    def test_rollups_match_instance_totals(self):
+        begin = self.start - datetime.timedelta(minutes=50)
+        end = self.start + datetime.timedelta(hours=HOURS, minutes=5)
+        expected = self._get_totals(begin, end)
+        self.assertEqual(len(expected), TENANTS)
+
+        hour = datetime.datetime(2012, 5, 1, 12, 0, 0)
+        for i in xrange(6):
+            db.instance_usage_rollup_hour(self.context, hour)
+            hour += datetime.timedelta(hours=1)
+
+        totals = self._get_totals(begin, end)
+        self.assertEqual(sorted(totals), sorted(expected))
+        for project_id, values in totals.iteritems():
+            for key, value in values.iteritems():
+                if key != 'project_id':
+                    self.assertAlmostEqual(value, expected[project_id][key],
+                                           places=2)
+
+    def test_index_uses_totals(self):
+        end = self.start + datetime.timedelta(hours=HOURS)
+        req = webob.Request.blank(
+                    '/v2/faketenant_0/os-simple-tenant-usage?start=%s&end=%s' %
+                    (self.start.isoformat(), end.isoformat()))
+        req.method = "GET"
+        req.headers["content-type"] = "application/json"
+
+        admin_context = context.RequestContext('fakeadmin_0',
+                                               'faketenant_0',
+                                               is_admin=True)
+        res = req.get_response(fakes.wsgi_app(
+                               fake_auth_context=admin_context))
+        self.assertEqual(res.status_int, 200)
+        usages = json.loads(res.body)['tenant_usages']
+        self.assertEqual(sorted(u['tenant_id'] for u in usages),
+                         ['faketenant_0', 'faketenant_1'])
+        # faketenant_0's five servers are still running
+        hours = dict((u['tenant_id'], u['total_hours']) for u in usages)
+        self.assertAlmostEqual(hours['faketenant_0'], 100.0, places=2)
+        self.assertAlmostEqual(hours['faketenant_1'], 7.5, places=2)
+
+
 class SimpleTenantUsageSerializerTest(test.TestCase):
     def _verify_server_usage(self, raw_usage, tree):
         self.assertEqual('server_usage', tree.tag)
@@ -590,6 +590,103 @@ class LimiterTest(BaseLimitTestSuite):
         results = list(self._check(5, "PUT", "/anything", "user2"))
         self.assertEqual(expected, results)
 
+    def test_verb_candidates(self):
+        """
+        Only the limits for a request's verb are considered.
+        """
+        candidates = self.limiter.levels.candidates(None, "POST")
+        self.assertEqual([limit.verb for index, limit in candidates],
+                         ["POST", "POST"])
+        self.assertEqual(self.limiter.levels.candidates(None, "HEAD"), [])
+        self.assertEqual(self.limiter.levels.candidates("user3", "PUT"), [])
+
+    def test_users_bounded(self):
+        """
+        Only the most recently seen users are remembered.
+        """
+        self.flags(rate_limit_max_users=2)
+        limiter = limits.Limiter(TEST_LIMITS, **{'user:user3': ''})
+
+        expected = [None] * 10 + [6.0]
+        results = [limiter.check_for_delay("PUT", "/anything", "user1")[0]
+                   for i in xrange(11)]
+        self.assertEqual(expected, results)
+
+        limiter.check_for_delay("PUT", "/anything", "user2")
+        limiter.check_for_delay("PUT", "/anything", "user3")
+        limiter.check_for_delay("PUT", "/anything", "user4")
+        self.assertEqual(sorted(limiter.levels.recent), ["user2", "user4"])
+        self.assertEqual(limiter.levels["user3"], [])
+
+        # user1 was forgotten, so starts over
+        delay = limiter.check_for_delay("PUT", "/anything", "user1")
+        self.assertEqual(delay, (None, None))
+
+
+class SharedLimiterTest(BaseLimitTestSuite):
+    """
+    Tests for `limits.Limiter` keeping its state in memcached.
+    """
+
+    def setUp(self):
+        super(SharedLimiterTest, self).setUp()
+        self.flags(rate_limit_use_memcached=True)
+        self.limiter1 = limits.Limiter(TEST_LIMITS)
+        self.limiter2 = limits.Limiter(TEST_LIMITS)
+        # Separate clients, like separate workers would have, sharing
+        # the same store
+        self.limiter2._cache.cache = self.limiter1._cache.cache
+
+    def test_limits_shared(self):
+        """
+        Two API workers enforce the limits together.
+        """
+        for i in xrange(5):
+            for limiter in (self.limiter1, self.limiter2):
+                delay = limiter.check_for_delay("PUT", "/anything", "user1")
+                self.assertEqual(delay, (None, None))
+
+        delay = self.limiter1.check_for_delay("PUT", "/anything", "user1")
+        self.assertEqual(delay[0], 6.0)
+
+        # Other users are unaffected
+        delay = self.limiter2.check_for_delay("PUT", "/anything", "user2")
+        self.assertEqual(delay, (None, None))
+
+        self.time += 6.0
+        delay = self.limiter2.check_for_delay("PUT", "/anything", "user1")
+        self.assertEqual(delay, (None, None))
+
+    def test_concurrent_update_retried(self):
+        """
+        A request racing with another worker's is counted on top of it.
+        """
+        cache = self.limiter1._cache
+        real_gets = cache.gets
+
+        def racing_gets(key):
+            value = real_gets(key)
+            cache.gets = real_gets
+            self.limiter2.check_for_delay("PUT", "/anything", "user1")
+            return value
+
+        for i in xrange(9):
+            self.limiter1.check_for_delay("PUT", "/anything", "user1")
+
+        cache.gets = racing_gets
+        delay = self.limiter1.check_for_delay("PUT", "/anything", "user1")
+        self.assertEqual(delay[0], 6.0)
+
+    def test_contention_rejects_request(self):
+        """
+        A request that can't be recorded isn't let through.
+        """
+        cache = self.limiter1._cache
+        self.stubs.Set(cache, 'add', lambda *args, **kwargs: False)
+        self.stubs.Set(cache, 'cas', lambda *args, **kwargs: False)
+        delay = self.limiter1.check_for_delay("PUT", "/anything", "user1")
+        self.assertEqual(delay[0], 6.0)
+
 
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
@@ -24,6 +24,7 @@ import iso8601
 from lxml import etree
 import webob
 
+from nova.api.openstack import common
 import nova.api.openstack.compute
 from nova.api.openstack.compute import ips
 from nova.api.openstack.compute import servers
@@ -119,6 +120,25 @@ class ServersControllerTest(test.TestCase):
         res_dict = self.controller.show(req, FAKE_UUID)
         self.assertEqual(res_dict['server']['id'], FAKE_UUID)
 
+    def test_add_instance_faults_only_for_errored(self):
+        uuids = [str(utils.gen_uuid()) for i in xrange(2)]
+        instances = [fakes.stub_instance(id=1, uuid=uuids[0],
+                                         vm_state=vm_states.ACTIVE),
+                     fakes.stub_instance(id=2, uuid=uuids[1],
+                                         vm_state=vm_states.ERROR)]
+
+        def fake_get_instance_faults(context, instances):
+            self.assertEqual([inst['uuid'] for inst in instances],
+                             [uuids[1]])
+            return {uuids[1]: [{'code': 500}]}
+
+        self.stubs.Set(self.controller.compute_api, 'get_instance_faults',
+                       fake_get_instance_faults)
+        ctxt = nova.context.RequestContext('fake', 'fake')
+        self.controller._add_instance_faults(ctxt, instances)
+        self.assertFalse('fault' in instances[0])
+        self.assertEqual(instances[1]['fault'], {'code': 500})
+
     def test_unique_host_id(self):
         """Create two servers with the same host and different
            project_ids and check that the hostId's are unique"""
@@ -3104,6 +3124,25 @@ class ServersViewBuilderTest(test.TestCase):
         output = self.view_builder.show(self.request, self.instance)
         self.assertDictMatch(output, expected_server)
 
+    def test_build_server_list_detail(self):
+        instances = [fakes.stub_instance(id=i, uuid=str(utils.gen_uuid()),
+                                         host='fake_host', image_ref="5")
+                     for i in xrange(3)]
+        expected = [self.view_builder.show(fakes.HTTPRequest.blank("/v2"),
+                                           instance)["server"]
+                    for instance in instances]
+
+        def fake_get_networks_for_instance(*args, **kwargs):
+            self.fail(_("networks should have been prefetched"))
+
+        self.stubs.Set(common, 'get_networks_for_instance',
+                       fake_get_networks_for_instance)
+        output = self.view_builder.detail(self.request, instances)
+        self.assertEqual(output["servers"], expected)
+
+        host_ids = common.get_request_cache(self.request, "host_ids")
+        self.assertEqual(len(host_ids), 1)
+
 
 class ServerXMLSerializationTest(test.TestCase):
 
@@ -329,6 +329,56 @@ class MiscFunctionsTest(test.TestCase):
             self.fail("webob.exc.HTTPConflict was not raised")
 
 
+class NetworksForInstancesTest(test.TestCase):
+
+    def _make_instance(self, uuid, label, address):
+        nw_info = [{'network': {'label': label,
+                                'subnets': [{'cidr': '10.0.0.0/24',
+                                             'ips': [{'address': address,
+                                                      'type': 'fixed'}]}]}}]
+        return {'uuid': uuid, 'info_cache': {'network_info': nw_info}}
+
+    def test_get_networks_for_instances(self):
+        instances = [self._make_instance('1', 'private', '10.0.0.2'),
+                     self._make_instance('2', 'public', '10.0.0.3'),
+                     {'uuid': '3', 'info_cache': None}]
+        networks = common.get_networks_for_instances(None, instances)
+        for instance in instances:
+            self.assertEqual(networks[instance['uuid']],
+                             common.get_networks_for_instance(None, instance))
+        self.assertEqual(networks['3'], {})
+        self.assertEqual(networks['1']['private']['ips'][0]['address'],
+                         '10.0.0.2')
+
+
+class LinkCacheTest(test.TestCase):
+
+    def test_link_base_per_request(self):
+        class FakeContext(object):
+            project_id = 'fake'
+
+        builder = common.ViewBuilder()
+        builder._collection_name = 'servers'
+        request = webob.Request.blank('/servers')
+        request.script_name = '/v2'
+        request.environ['nova.context'] = FakeContext()
+        self.assertEqual(builder._get_href_link(request, 1),
+                         'http://localhost/v2/fake/servers/1')
+        self.assertEqual(builder._get_bookmark_link(request, 2),
+                         'http://localhost/fake/servers/2')
+
+        cache = common.get_request_cache(request, 'link_bases')
+        self.assertEqual(cache[('servers', 'self')],
+                         'http://localhost/v2/fake/servers')
+
+        other = webob.Request.blank('/servers')
+        other.script_name = '/v2'
+        other.environ['nova.context'] = FakeContext()
+        self.flags(osapi_compute_link_prefix='http://example.com')
+        self.assertEqual(builder._get_href_link(other, 1),
+                         'http://example.com/v2/fake/servers/1')
+
+
 class MetadataXMLDeserializationTest(test.TestCase):
 
     deserializer = common.MetadataXMLDeserializer()
@@ -653,6 +653,78 @@ class TemplateTest(test.TestCase):
         self.assertEqual(result[idx].text, obj['test']['image']['name'])
 
 
+class RenderPlanTest(test.TestCase):
+    obj = {
+        'test': {
+            'name': 'foobar',
+            'values': [1, 2, 3, 4],
+            'attrs': {
+                'a': 1,
+                'b': 2,
+                },
+            'image': {
+                'name': 'image_foobar',
+                'id': 42,
+                },
+            },
+        }
+
+    def _make_master(self):
+        root = xmlutil.TemplateElement('test', selector='test',
+                                       name='name')
+        value = xmlutil.SubTemplateElement(root, 'value', selector='values')
+        value.text = xmlutil.Selector()
+        attrs = xmlutil.SubTemplateElement(root, 'attrs', selector='attrs')
+        xmlutil.SubTemplateElement(attrs, 'attr', selector=xmlutil.get_items,
+                                   key=0, value=1)
+        master = xmlutil.MasterTemplate(root, 1, nsmap=dict(f='foo'))
+
+        root_slave = xmlutil.TemplateElement('test', selector='test',
+                                             name='missing')
+        image = xmlutil.SubTemplateElement(root_slave, 'image',
+                                           selector='image', id='id')
+        image.text = xmlutil.Selector('name')
+        master.attach(xmlutil.SlaveTemplate(root_slave, 1,
+                                            nsmap=dict(b='bar')))
+        return master
+
+    def test_matches_serialize(self):
+        master = self._make_master()
+        expected = master._serialize(None, self.obj, master._siblings(),
+                                     master._nsmap())
+        self.assertEqual(etree.tostring(master.make_tree(self.obj)),
+                         etree.tostring(expected))
+
+    def test_plan_cached(self):
+        master = self._make_master()
+        plan = xmlutil.get_render_plan(master._siblings())
+        self.assertTrue(plan is
+                        xmlutil.get_render_plan(master.copy()._siblings()))
+
+        # Modifying the template invalidates the plan
+        master.root.set('extra', xmlutil.ConstantSelector('x'))
+        self.assertFalse(plan is
+                         xmlutil.get_render_plan(master._siblings()))
+        self.assertEqual(master.make_tree(self.obj).get('extra'), 'x')
+
+    def test_plan_per_slave_set(self):
+        master = self._make_master()
+        bare = xmlutil.MasterTemplate(master.root, 1)
+        self.assertEqual(len(bare.make_tree(self.obj)), 5)
+        self.assertEqual(len(master.make_tree(self.obj)), 6)
+
+    def test_custom_apply(self):
+        class UpperTemplateElement(xmlutil.TemplateElement):
+            def apply(self, elem, obj):
+                super(UpperTemplateElement, self).apply(elem, obj)
+                elem.text = elem.text.upper()
+
+        root = UpperTemplateElement('test', selector='test')
+        root.text = 'name'
+        master = xmlutil.MasterTemplate(root, 1)
+        self.assertEqual(master.make_tree(self.obj).text, 'FOOBAR')
+
+
 class MasterTemplateBuilder(xmlutil.TemplateBuilder):
     def construct(self):
         elem = xmlutil.TemplateElement('test')
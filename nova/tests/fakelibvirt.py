@@ -73,6 +73,16 @@ VIR_DOMAIN_SHUTDOWN = 4
 VIR_DOMAIN_SHUTOFF = 5
 VIR_DOMAIN_CRASHED = 6
 
+# virDomainEventType
+VIR_DOMAIN_EVENT_DEFINED = 0
+VIR_DOMAIN_EVENT_UNDEFINED = 1
+VIR_DOMAIN_EVENT_STARTED = 2
+VIR_DOMAIN_EVENT_SUSPENDED = 3
+VIR_DOMAIN_EVENT_RESUMED = 4
+VIR_DOMAIN_EVENT_STOPPED = 5
+
+VIR_DOMAIN_EVENT_ID_LIFECYCLE = 0
+
 VIR_CPU_COMPARE_ERROR = -1
 VIR_CPU_COMPARE_INCOMPATIBLE = 0
 VIR_CPU_COMPARE_IDENTICAL = 1
@@ -481,6 +491,10 @@ class Connection(object):
     def listDomainsID(self):
         return self._running_vms.keys()
 
+    def listDefinedDomains(self):
+        return [name for (name, dom) in self._vms.iteritems()
+                if dom not in self._running_vms.values()]
+
     def lookupByID(self, id):
         if id in self._running_vms:
             return self._running_vms[id]
@@ -16,7 +16,12 @@
 #    under the License.
 
 
+import BaseHTTPServer
 import datetime
+import httplib
+import SocketServer
+import threading
+import time
 
 import glance.common.exception as glance_exception
 
@@ -568,3 +573,310 @@ class TestGlanceImageService(test.TestCase):
         image_url = 'http://foo/%s' % image_id
         client, same_id = glance.get_glance_client(self.context, image_url)
         self.assertEquals(same_id, image_id)
+
+
+class TestGlanceImageMetaCache(test.TestCase):
+    def setUp(self):
+        super(TestGlanceImageMetaCache, self).setUp()
+        self.flags(glance_metadata_cache_ttl=60)
+        self.client = glance_stubs.StubGlanceClient()
+        self.service = glance.GlanceImageService(client=self.client)
+        self.context = context.RequestContext('fake', 'fake', auth_token=True)
+        glance.image_meta_cache.clear()
+        self.calls = []
+        orig_get_image_meta = self.client.get_image_meta
+
+        def fake_get_image_meta(image_id):
+            self.calls.append(image_id)
+            return orig_get_image_meta(image_id)
+
+        self.stubs.Set(self.client, 'get_image_meta', fake_get_image_meta)
+
+    def tearDown(self):
+        glance.image_meta_cache.clear()
+        super(TestGlanceImageMetaCache, self).tearDown()
+
+    def _create_image(self, name='image1'):
+        fixture = {'name': name, 'properties': {}, 'is_public': True}
+        return self.service.create(self.context, fixture)['id']
+
+    def test_show_is_cached(self):
+        image_id = self._create_image()
+        image1 = self.service.show(self.context, image_id)
+        image1['name'] = 'changed by caller'
+        image2 = self.service.show(self.context, image_id)
+        self.assertEqual(image2['name'], 'image1')
+        self.assertEqual(self.calls, [image_id])
+        stats = glance.image_meta_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_cache_is_keyed_by_visibility(self):
+        image_id = self._create_image()
+        self.service.show(self.context, image_id)
+        other = context.RequestContext('other', 'other', auth_token=True)
+        self.service.show(other, image_id)
+        self.assertEqual(self.calls, [image_id, image_id])
+
+    def test_missing_image_is_cached(self):
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, self.context, 'missing')
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, self.context, 'missing')
+        self.assertEqual(self.calls, ['missing'])
+
+    def test_update_invalidates(self):
+        image_id = self._create_image()
+        self.service.show(self.context, image_id)
+        self.service.update(self.context, image_id, {'name': 'new name'})
+        image = self.service.show(self.context, image_id)
+        self.assertEqual(image['name'], 'new name')
+
+    def test_delete_invalidates(self):
+        image_id = self._create_image()
+        self.service.show(self.context, image_id)
+        self.service.delete(self.context, image_id)
+        self.assertRaises(exception.ImageNotFound,
+                          self.service.show, self.context, image_id)
+
+    def test_expired_entries_are_refetched(self):
+        image_id = self._create_image()
+        self.service.show(self.context, image_id)
+        now = time.time()
+        self.stubs.Set(time, 'time', lambda: now + 61)
+        self.service.show(self.context, image_id)
+        self.assertEqual(self.calls, [image_id, image_id])
+
+    def test_lru_eviction(self):
+        self.flags(glance_metadata_cache_size=2)
+        ids = [self._create_image('image%d' % i) for i in xrange(3)]
+        self.service.show(self.context, ids[0])
+        self.service.show(self.context, ids[1])
+        self.service.show(self.context, ids[0])
+        self.service.show(self.context, ids[2])
+        self.assertEqual(glance.image_meta_cache.stats()['evictions'], 1)
+        self.service.show(self.context, ids[0])
+        self.assertEqual(self.calls, [ids[0], ids[1], ids[2]])
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers every GET over HTTP/1.1 keep-alive connections, recording
+    the client port each request came from.  Closes the connection after
+    answering paths ending in /close, without telling the client."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address[1]))
+        body = 'image %s' % self.path
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path.endswith('/close'):
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveServer(SocketServer.ThreadingMixIn,
+                      BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class HTTPGlanceClient(object):
+    """Sends requests like the glance client does, building a connection
+    of get_connection_type() for each one."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def get_connection_type(self):
+        return httplib.HTTPConnection
+
+    def get_image_meta(self, image_id, read=True):
+        conn = self.get_connection_type()(self.host, self.port)
+        conn.request('GET', '/images/%s' % image_id)
+        response = conn.getresponse()
+        if read:
+            return response.read()
+        return response
+
+
+class TestGlanceClientPool(test.TestCase):
+    def setUp(self):
+        super(TestGlanceClientPool, self).setUp()
+        self.flags(glance_api_servers=['host1:9292', 'host2:9292'])
+        self.pool = glance.GlanceClientPool()
+        self.context = context.RequestContext('fake', 'fake')
+        self.stubs.Set(glance, 'client_pool', self.pool)
+        self.created = []
+
+        def fake_create_glance_client(context, host, port):
+            client = glance_stubs.StubGlanceClient()
+            self.created.append((host, port))
+            return client
+
+        self.stubs.Set(glance, '_create_glance_client',
+                       fake_create_glance_client)
+
+    def test_clients_are_reused(self):
+        self.flags(glance_api_servers=['host1:9292'])
+        with self.pool.client(self.context) as client1:
+            pass
+        with self.pool.client(self.context) as client2:
+            pass
+        self.assertTrue(client1 is client2)
+        self.assertEqual(self.created, [('host1', 9292)])
+        stats = self.pool.stats()
+        self.assertEqual(stats['clients_created'], 1)
+        self.assertEqual(stats['clients_reused'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_concurrent_checkouts_use_separate_clients(self):
+        self.flags(glance_api_servers=['host1:9292'])
+        with self.pool.client(self.context) as client1:
+            with self.pool.client(self.context) as client2:
+                self.assertFalse(client1 is client2)
+        self.assertEqual(self.pool.stats()['idle'], 2)
+
+    def test_idle_clients_are_bounded(self):
+        self.flags(glance_api_servers=['host1:9292'],
+                   glance_max_requests_per_server=1)
+        client1 = self.pool.get(self.context, 'host1', 9292)
+        client2 = self.pool.get(self.context, 'host1', 9292)
+        self.pool.put(self.context, 'host1', 9292, client1)
+        self.pool.put(self.context, 'host1', 9292, client2)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_connection_error_ejects_server(self):
+        self.stubs.Set(glance.random, 'choice', lambda seq: seq[0])
+
+        def use_failing_client():
+            with self.pool.client(self.context):
+                raise glance_exception.ClientConnectionError()
+
+        self.assertRaises(glance_exception.ClientConnectionError,
+                          use_failing_client)
+        self.assertEqual(self.pool.stats()['ejections'], 1)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+        self.assertEqual(glance.pick_glance_api_server(), ('host2', 9292))
+
+        now = time.time()
+        self.stubs.Set(time, 'time', lambda: now + 31)
+        self.assertEqual(glance.pick_glance_api_server(), ('host1', 9292))
+
+    def _start_server(self):
+        server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        pool = self.pool
+
+        def stop_server():
+            pool.clear()
+            server.shutdown()
+            server.server_close()
+
+        self.addCleanup(stop_server)
+        self.flags(glance_api_servers=['127.0.0.1:%d' %
+                                       server.server_address[1]])
+        self.stubs.Set(glance, '_create_glance_client',
+                       lambda context, host, port: HTTPGlanceClient(host,
+                                                                    port))
+        return server
+
+    def test_connections_are_kept_alive(self):
+        server = self._start_server()
+        for image_id in ('1', '2', '3'):
+            with self.pool.client(self.context) as client:
+                self.assertEqual(client.get_image_meta(image_id),
+                                 'image /images/%s' % image_id)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(set(port for path, port in server.requests)), 1)
+        stats = self.pool.stats()
+        self.assertEqual(stats['connections_created'], 1)
+        self.assertEqual(stats['connections_reused'], 2)
+        self.assertEqual(stats['idle_connections'], 1)
+
+    def test_connections_are_shared_between_credentials(self):
+        self.flags(auth_strategy='keystone')
+        server = self._start_server()
+        for user_id in ('user1', 'user2'):
+            ctxt = context.RequestContext(user_id, 'fake')
+            with self.pool.client(ctxt) as client:
+                client.get_image_meta('1')
+        stats = self.pool.stats()
+        self.assertEqual(stats['clients_created'], 2)
+        self.assertEqual(stats['connections_created'], 1)
+        self.assertEqual(len(set(port for path, port in server.requests)), 1)
+
+    def test_connection_closed_by_server_is_replaced(self):
+        server = self._start_server()
+        with self.pool.client(self.context) as client:
+            client.get_image_meta('1/close')
+        # Give the server time to close its end of the connection
+        time.sleep(0.1)
+        with self.pool.client(self.context) as client:
+            self.assertEqual(client.get_image_meta('2'), 'image /images/2')
+        self.assertEqual([path for path, port in server.requests],
+                         ['/images/1/close', '/images/2'])
+        self.assertEqual(len(set(port for path, port in server.requests)), 2)
+
+    def test_unread_response_drops_connection(self):
+        server = self._start_server()
+        with self.pool.client(self.context) as client:
+            response = client.get_image_meta('1', read=False)
+        with self.pool.client(self.context) as client:
+            client.get_image_meta('2')
+        self.assertEqual(response.read(), 'image /images/1')
+        stats = self.pool.stats()
+        self.assertEqual(stats['connections_created'], 2)
+        self.assertEqual(stats['connections_reused'], 0)
+
+    def test_connection_error_closes_idle_connections(self):
+        self._start_server()
+        self.stubs.Set(glance.random, 'choice', lambda seq: seq[0])
+        with self.pool.client(self.context) as client:
+            client.get_image_meta('1')
+        self.assertEqual(self.pool.stats()['idle_connections'], 1)
+
+        def use_failing_client():
+            with self.pool.client(self.context):
+                raise glance_exception.ClientConnectionError()
+
+        self.assertRaises(glance_exception.ClientConnectionError,
+                          use_failing_client)
+        self.assertEqual(self.pool.stats()['idle_connections'], 0)
+
+    def test_all_servers_ejected_still_picks_one(self):
+        self.pool.eject('host1', 9292)
+        self.pool.eject('host2', 9292)
+        self.assertTrue(glance.pick_glance_api_server() in
+                        [('host1', 9292), ('host2', 9292)])
+
+    def test_service_retries_on_another_server(self):
+        self.stubs.Set(glance.time, 'sleep', lambda secs: None)
+        self.flags(glance_num_retries=1)
+        service = glance.GlanceImageService()
+        hosts = []
+        orig_get = self.pool.get
+
+        def fake_get(context, host, port):
+            hosts.append(host)
+            client = orig_get(context, host, port)
+            if len(hosts) == 1:
+                def fail(image_id):
+                    raise glance_exception.ClientConnectionError()
+                client.get_image_meta = fail
+            return client
+
+        self.stubs.Set(self.pool, 'get', fake_get)
+        self.assertRaises(exception.ImageNotFound,
+                          service.show, self.context, 'missing')
+        self.assertEqual(len(hosts), 2)
+        self.assertNotEqual(hosts[0], hosts[1])
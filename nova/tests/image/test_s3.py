@@ -16,6 +16,12 @@
 #    under the License.
 
 import os
+import random
+import StringIO
+import subprocess
+import tarfile
+
+import eventlet
 
 from nova import context
 import nova.db.api
@@ -58,6 +64,84 @@ ami_manifest_xml = """<?xml version="1.0" ?>
 </manifest>
 """
 
+# the ami manifest with the encrypted image parts appended
+image_manifest_xml = ami_manifest_xml.replace('</manifest>', """\
+        <image>
+                <ec2_encrypted_key>00</ec2_encrypted_key>
+                <ec2_encrypted_iv>00</ec2_encrypted_iv>
+                <parts count="2">
+                        <part index="0">
+                                <filename>image.part.0</filename>
+                        </part>
+                        <part index="1">
+                                <filename>image.part.1</filename>
+                        </part>
+                </parts>
+        </image>
+</manifest>
+""")
+
+AES_KEY = '00112233445566778899aabbccddeeff'
+AES_IV = 'ffeeddccbbaa99887766554433221100'
+
+
+def make_tarball(*members):
+    """Returns a gzipped tarball of (name, contents) members.
+
+    Members whose contents are None are added as directories.
+    """
+    output = StringIO.StringIO()
+    tar_file = tarfile.open(fileobj=output, mode='w:gz')
+    for name, contents in members:
+        tarinfo = tarfile.TarInfo(name)
+        if contents is None:
+            tarinfo.type = tarfile.DIRTYPE
+            tar_file.addfile(tarinfo)
+        else:
+            tarinfo.size = len(contents)
+            tar_file.addfile(tarinfo, StringIO.StringIO(contents))
+    tar_file.close()
+    return output.getvalue()
+
+
+def make_contents(size):
+    """Returns size bytes that don't compress, larger than a pipe buffer."""
+    rand = random.Random(size)
+    return ''.join(chr(rand.randint(0, 255)) for i in xrange(size))
+
+
+def encrypt(data, key=AES_KEY, iv=AES_IV):
+    proc = subprocess.Popen(['openssl', 'enc', '-aes-128-cbc',
+                             '-K', key, '-iv', iv],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return proc.communicate(data)[0]
+
+
+class FakeKey(object):
+    def __init__(self, contents):
+        self.contents = contents
+
+    def get_contents_as_string(self):
+        if isinstance(self.contents, Exception):
+            raise self.contents
+        return self.contents
+
+
+class FakeBucket(object):
+    def __init__(self, keys):
+        self.keys = keys
+
+    def get_key(self, name):
+        return FakeKey(self.keys[name])
+
+
+class FakeConnection(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, name):
+        return self.bucket
+
 
 class TestS3ImageService(test.TestCase):
     def setUp(self):
@@ -133,10 +217,193 @@ class TestS3ImageService(test.TestCase):
              'no_device': True}]
         self.assertEqual(block_device_mapping, expected_bdm)
 
-    def test_s3_malicious_tarballs(self):
+    def test_check_tarball_member(self):
+        self.image_service._check_tarball_member('/tmp/image', 'image')
+        self.image_service._check_tarball_member('/tmp/image', 'a/../b')
         self.assertRaises(exception.Error,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'abs.tar.gz'))
+                          self.image_service._check_tarball_member,
+                          '/tmp/image', '/etc/passwd')
         self.assertRaises(exception.Error,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'rel.tar.gz'))
+                          self.image_service._check_tarball_member,
+                          '/tmp/image', '../../etc/passwd')
+
+    def _create_image(self):
+        metadata = {'properties': {'image_state': 'pending'}}
+        image = self.image_service.service.create(self.context, metadata)
+        return image['id'], metadata
+
+    def _record_uploads(self):
+        uploads = []
+        update = self.image_service.service.update
+
+        def fake_update(context, image_id, metadata, data=None):
+            if data is not None:
+                uploads.append(data.read())
+            return update(context, image_id, metadata)
+
+        self.stubs.Set(self.image_service.service, 'update', fake_update)
+        return uploads
+
+    def _upload_tarball(self, tarball):
+        image_uuid, metadata = self._create_image()
+        self.image_service._upload_tarball_stream(
+                self.context, image_uuid, metadata, tarball)
+        return metadata
+
+    def _assertRegistrationFails(self, image_state, f, *args):
+        try:
+            f(*args)
+        except s3.ImageRegistrationFailed, exc:
+            self.assertEqual(exc.image_state, image_state)
+        else:
+            self.fail('ImageRegistrationFailed not raised')
+
+    def test_upload_tarball_stream(self):
+        uploads = self._record_uploads()
+        contents = make_contents(256 * 1024)
+        tarball = StringIO.StringIO(make_tarball(('image', contents),
+                                                 ('image.extra', 'extra')))
+        metadata = self._upload_tarball(tarball)
+        self.assertEqual(uploads, [contents])
+        self.assertEqual(metadata['properties']['image_state'], 'uploading')
+        # the rest of the stream is consumed
+        self.assertEqual(tarball.read(), '')
+
+    def test_upload_tarball_stream_malicious_tarballs(self):
+        self.flags(image_decryption_dir='/unused')
+        uploads = self._record_uploads()
+        for name in ('abs.tar.gz', 'rel.tar.gz'):
+            tarball = open(os.path.join(os.path.dirname(__file__), name))
+            try:
+                self._assertRegistrationFails('failed_untar',
+                                              self._upload_tarball, tarball)
+            finally:
+                tarball.close()
+        self.assertEqual(uploads, [])
+
+    def test_upload_tarball_stream_malicious_later_member(self):
+        tarball = make_tarball(('image', 'contents'),
+                               ('../../etc/passwd', 'root'))
+        self._assertRegistrationFails('failed_untar', self._upload_tarball,
+                                      StringIO.StringIO(tarball))
+
+    def test_upload_tarball_stream_not_regular_file(self):
+        uploads = self._record_uploads()
+        tarball = make_tarball(('image', None), ('image/disk', 'contents'))
+        self._assertRegistrationFails('failed_untar', self._upload_tarball,
+                                      StringIO.StringIO(tarball))
+        self.assertEqual(uploads, [])
+
+    def test_upload_tarball_stream_empty_tarball(self):
+        self._assertRegistrationFails('failed_untar', self._upload_tarball,
+                                      StringIO.StringIO(make_tarball()))
+
+    def test_upload_tarball_stream_upload_fails(self):
+        def fake_update(context, image_id, metadata, data=None):
+            if data is not None:
+                raise IOError()
+
+        self.stubs.Set(self.image_service.service, 'update', fake_update)
+        tarball = make_tarball(('image', 'contents'))
+        self._assertRegistrationFails('failed_upload', self._upload_tarball,
+                                      StringIO.StringIO(tarball))
+
+    def _stream_image(self, parts, key=AES_KEY):
+        image_uuid, metadata = self._create_image()
+        filenames = [str(i) for i in xrange(len(parts))]
+        bucket = FakeBucket(dict(zip(filenames, parts)))
+        self.image_service._stream_image(self.context, bucket, filenames,
+                                         key, AES_IV, image_uuid, metadata)
+
+    @staticmethod
+    def _split(data, count):
+        size = len(data) / count + 1
+        return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+    def test_stream_image(self):
+        self.flags(s3_image_part_concurrency=2)
+        uploads = self._record_uploads()
+        contents = make_contents(256 * 1024)
+        encrypted = encrypt(make_tarball(('image', contents)))
+        self._stream_image(self._split(encrypted, 5))
+        self.assertEqual(uploads, [contents])
+
+    def test_stream_image_download_fails(self):
+        encrypted = encrypt(make_tarball(('image', make_contents(1024))))
+        parts = self._split(encrypted, 2)
+        parts[1] = IOError()
+        self._assertRegistrationFails('failed_download', self._stream_image,
+                                      parts)
+
+    def test_stream_image_bad_key(self):
+        encrypted = encrypt(make_tarball(('image', make_contents(1024))))
+        self._assertRegistrationFails('failed_decrypt', self._stream_image,
+                                      [encrypted], AES_IV)
+
+    def test_stream_image_not_a_tarball(self):
+        # more than a pipe buffer, so openssl only exits once it's drained
+        encrypted = encrypt(make_contents(256 * 1024))
+        self._assertRegistrationFails('failed_untar', self._stream_image,
+                                      self._split(encrypted, 4))
+
+    def test_stream_image_upload_fails(self):
+        def fake_update(context, image_id, metadata, data=None):
+            if data is not None:
+                data.read(1024)
+                raise IOError()
+
+        self.stubs.Set(self.image_service.service, 'update', fake_update)
+        encrypted = encrypt(make_tarball(('image', make_contents(256 * 1024))))
+        self._assertRegistrationFails('failed_upload', self._stream_image,
+                                      self._split(encrypted, 4))
+
+    def _s3_create(self, parts):
+        bucket = FakeBucket({'image.manifest.xml': image_manifest_xml,
+                             'image.part.0': parts[0],
+                             'image.part.1': parts[1]})
+        self.stubs.Set(self.image_service, '_conn',
+                       lambda context: FakeConnection(bucket))
+        self.stubs.Set(self.image_service, '_decrypt_key_and_iv',
+                       lambda context, key, iv: (AES_KEY, AES_IV))
+        self.stubs.Set(eventlet, 'spawn_n', lambda f: f())
+        metadata = {'properties': {
+            'image_location': 'bucket/image.manifest.xml'}}
+        image = self.image_service._s3_create(self.context, metadata)
+        return self.image_service.show(self.context, image['id'])
+
+    def test_s3_create_image_available(self):
+        encrypted = encrypt(make_tarball(('image', make_contents(1024))))
+        image = self._s3_create(self._split(encrypted, 2))
+        self.assertEqual(image['properties']['image_state'], 'available')
+        self.assertEqual(image['status'], 'active')
+
+    def test_s3_create_image_failed_download(self):
+        encrypted = encrypt(make_tarball(('image', make_contents(1024))))
+        image = self._s3_create([encrypted, IOError()])
+        self.assertEqual(image['properties']['image_state'],
+                         'failed_download')
+
+    def test_download_parts_in_order(self):
+        self.flags(s3_image_part_concurrency=2)
+        fetched = []
+
+        class FakeKey(object):
+            def __init__(self, name):
+                self.name = name
+
+            def get_contents_as_string(self):
+                fetched.append(self.name)
+                # NOTE: later parts finish first
+                eventlet.sleep(0.01 / (int(self.name) + 1))
+                return 'part%s' % self.name
+
+        class FakeBucket(object):
+            def get_key(self, name):
+                return FakeKey(name)
+
+        filenames = [str(i) for i in xrange(5)]
+        parts = s3.S3ImageService._download_parts(FakeBucket(), filenames)
+        self.assertEqual(parts.next(), 'part0')
+        # only the first window of parts has been requested so far
+        self.assertEqual(fetched, ['0', '1'])
+        self.assertEqual(list(parts), ['part1', 'part2', 'part3', 'part4'])
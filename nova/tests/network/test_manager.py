@@ -193,6 +193,25 @@ class FlatNetworkTestCase(test.TestCase):
                       for ip_num in xrange(1, num_fixed_ips + 1)]
             self.assertDictListMatch(info['ips'], check)
 
+    def test_get_instances_nw_info(self):
+        def fake_get_instance_nw_info(context, instance_id, instance_uuid,
+                                      rxtx_factor, host, project_id):
+            if instance_uuid == 'gone':
+                raise exception.InstanceNotFound(instance_id=instance_id)
+            if instance_uuid == 'broken':
+                raise exception.NovaException('boom')
+            return [instance_uuid]
+
+        self.stubs.Set(self.network, 'get_instance_nw_info',
+                       fake_get_instance_nw_info)
+        instances = [dict(instance_id=i, instance_uuid=uuid, rxtx_factor=1,
+                          host=HOST, project_id='testproject')
+                     for i, uuid in enumerate(['one', 'gone', 'broken',
+                                               'two'])]
+        nw_infos = self.network.get_instances_nw_info(self.context,
+                                                      instances)
+        self.assertEqual(nw_infos, {'one': ['one'], 'two': ['two']})
+
     def test_validate_networks(self):
         self.mox.StubOutWithMock(db, 'network_get')
         self.mox.StubOutWithMock(db, 'network_get_all_by_uuids')
@@ -553,22 +572,24 @@ class VlanNetworkTestCase(test.TestCase):
             return {'address': '10.0.0.1'}
 
         def fake2(*args, **kwargs):
-            return 25
+            return {'floating_ips': {'in_use': 25, 'reserved': 0}}
 
         def fake3(*args, **kwargs):
-            return 0
+            return {'floating_ips': {'in_use': 0, 'reserved': 0}}
 
         self.stubs.Set(self.network.db, 'floating_ip_allocate_address', fake1)
 
         # this time should raise
-        self.stubs.Set(self.network.db, 'floating_ip_count_by_project', fake2)
+        self.stubs.Set(self.network.db, 'quota_usage_get_all_by_project',
+                       fake2)
         self.assertRaises(exception.QuotaError,
                           self.network.allocate_floating_ip,
                           ctxt,
                           ctxt.project_id)
 
         # this time should not
-        self.stubs.Set(self.network.db, 'floating_ip_count_by_project', fake3)
+        self.stubs.Set(self.network.db, 'quota_usage_get_all_by_project',
+                       fake3)
         self.network.allocate_floating_ip(ctxt, ctxt.project_id)
 
     def test_deallocate_floating_ip(self):
@@ -152,6 +152,49 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(res2, False)
         self.assertEqual(res3, False)
 
+    def test_service_is_up_from_capabilities(self):
+        self.flags(scheduler_capability_liveness=True, service_down_time=60)
+        now = datetime.datetime.fromtimestamp(3100)
+        timestamp = datetime.datetime.fromtimestamp(3080)
+        self.host_manager.service_states = {
+                'host1': {'compute': dict(timestamp=timestamp)}}
+        service = {'host': 'host1', 'topic': 'compute'}
+
+        self.mox.StubOutWithMock(utils, 'utcnow')
+        self.mox.StubOutWithMock(utils, 'service_is_up')
+        utils.utcnow().AndReturn(now)
+
+        self.mox.ReplayAll()
+        self.assertTrue(self.host_manager.service_is_up(service))
+
+    def test_service_is_up_falls_back_to_db_when_stale(self):
+        self.flags(scheduler_capability_liveness=True, service_down_time=60)
+        now = datetime.datetime.fromtimestamp(3100)
+        timestamp = datetime.datetime.fromtimestamp(3000)
+        self.host_manager.service_states = {
+                'host1': {'compute': dict(timestamp=timestamp)}}
+        service = {'host': 'host1', 'topic': 'compute'}
+
+        self.mox.StubOutWithMock(utils, 'utcnow')
+        self.mox.StubOutWithMock(utils, 'service_is_up')
+        utils.utcnow().AndReturn(now)
+        utils.service_is_up(service).AndReturn(False)
+
+        self.mox.ReplayAll()
+        self.assertFalse(self.host_manager.service_is_up(service))
+
+    def test_service_is_up_disabled_uses_db(self):
+        self.flags(scheduler_capability_liveness=False)
+        self.host_manager.service_states = {
+                'host1': {'compute': dict(timestamp=utils.utcnow())}}
+        service = {'host': 'host1', 'topic': 'compute'}
+
+        self.mox.StubOutWithMock(utils, 'service_is_up')
+        utils.service_is_up(service).AndReturn(False)
+
+        self.mox.ReplayAll()
+        self.assertFalse(self.host_manager.service_is_up(service))
+
     def test_delete_expired_host_services(self):
         host1_compute_capabs = dict(free_memory=1234, host_memory=5678,
                 timestamp=datetime.datetime.fromtimestamp(3000))
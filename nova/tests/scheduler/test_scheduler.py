@@ -303,6 +303,35 @@ class SchedulerManagerTestCase(test.TestCase):
                          self.context, self.topic,
                          *self.fake_args, **self.fake_kwargs)
 
+    def test_rollup_instance_usage_disabled(self):
+        self.mox.StubOutWithMock(db, 'instance_usage_rollup_get_range')
+        self.mox.ReplayAll()
+        self.manager._rollup_instance_usage(self.context)
+
+    def test_rollup_instance_usage_catches_up(self):
+        self.flags(instance_usage_rollup=True,
+                   instance_usage_rollup_max_hours=2)
+        now = datetime.datetime(2012, 5, 1, 10, 30, 0)
+        last = datetime.datetime(2012, 5, 1, 6, 0, 0)
+        self.stubs.Set(utils, 'utcnow', lambda: now)
+        self.mox.StubOutWithMock(db, 'instance_usage_rollup_get_range')
+        self.mox.StubOutWithMock(db, 'instance_usage_rollup_hour')
+
+        db.instance_usage_rollup_get_range(self.context).AndReturn(
+                (last, last))
+        db.instance_usage_rollup_hour(self.context,
+                datetime.datetime(2012, 5, 1, 7, 0, 0))
+        db.instance_usage_rollup_hour(self.context,
+                datetime.datetime(2012, 5, 1, 8, 0, 0))
+        db.instance_usage_rollup_get_range(self.context).AndReturn(
+                (last, datetime.datetime(2012, 5, 1, 8, 0, 0)))
+        db.instance_usage_rollup_hour(self.context,
+                datetime.datetime(2012, 5, 1, 9, 0, 0))
+
+        self.mox.ReplayAll()
+        self.manager._rollup_instance_usage(self.context)
+        self.manager._rollup_instance_usage(self.context)
+
 
 class SchedulerTestCase(test.TestCase):
     """Test case for base scheduler driver class"""
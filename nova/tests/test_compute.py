@@ -23,6 +23,7 @@ import datetime
 import sys
 import time
 
+from eventlet import greenthread
 import mox
 import webob.exc
 
@@ -50,6 +51,7 @@ from nova.scheduler import driver as scheduler_driver
 from nova import test
 from nova.tests import fake_network
 from nova import utils
+from nova.virt import driver
 import nova.volume
 
 
@@ -1431,6 +1433,73 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(power_state.NOSTATE, instances[0]['power_state'])
 
+    def test_sync_power_states_bulk(self):
+        """Power states are read in one call and written in one update"""
+        params = {'host': self.compute.host,
+                  'power_state': power_state.RUNNING}
+        instance1 = self._create_fake_instance(params)
+        instance2 = self._create_fake_instance(params)
+        instance3 = self._create_fake_instance(params)
+        vm_infos = {instance1['name']: {'state': power_state.RUNNING},
+                    instance2['name']: {'state': power_state.PAUSED}}
+
+        self.mox.StubOutWithMock(self.compute.driver, 'get_info')
+        self.mox.StubOutWithMock(self.compute.driver, 'get_info_bulk')
+        self.compute.driver.get_info_bulk(mox.IgnoreArg()).AndReturn(vm_infos)
+        self.mox.StubOutWithMock(self.compute.db,
+                                 'instance_update_power_states')
+        self.compute.db.instance_update_power_states(mox.IgnoreArg(), {
+                instance2['id']: {'power_state': power_state.PAUSED},
+                instance3['id']: {'power_state': power_state.NOSTATE,
+                                  'vm_state': vm_states.SHUTOFF}})
+        self.mox.ReplayAll()
+
+        self.compute._sync_power_states(context.get_admin_context())
+
+    def test_handle_lifecycle_event(self):
+        """Lifecycle events update the power state of idle instances"""
+        params = {'host': self.compute.host,
+                  'power_state': power_state.RUNNING}
+        instance1 = self._create_fake_instance(params)
+        instance2 = self._create_fake_instance(params)
+        instance3 = self._create_fake_instance(
+                dict(params, task_state=task_states.REBOOTING))
+
+        spawned = []
+        self.stubs.Set(greenthread, 'spawn_n',
+                       lambda func, *args: spawned.append(func))
+        for instance in (instance1, instance2, instance3):
+            self.compute.handle_lifecycle_event(driver.LifecycleEvent(
+                    instance['name'], power_state.SHUTOFF))
+        # a repeated event is ignored
+        self.compute.handle_lifecycle_event(driver.LifecycleEvent(
+                instance1['name'], power_state.SHUTOFF))
+        self.assertEqual(len(spawned), 1)
+
+        self.stubs.Set(self.compute.driver, 'get_info',
+                       lambda instance: self.fail('get_info called'))
+        spawned[0]()
+
+        ctxt = context.get_admin_context()
+        for instance in (instance1, instance2):
+            instance = db.instance_get(ctxt, instance['id'])
+            self.assertEqual(instance['power_state'], power_state.SHUTOFF)
+            self.assertEqual(instance['vm_state'], vm_states.SHUTOFF)
+        instance3 = db.instance_get(ctxt, instance3['id'])
+        self.assertEqual(instance3['power_state'], power_state.RUNNING)
+
+    def test_sync_power_states_with_events(self):
+        """The full sync becomes a safety net when events are received"""
+        self.flags(hypervisor_events_sync_interval=600)
+        self.compute._events_active = True
+        self.mox.StubOutWithMock(self.compute.driver, 'get_info_bulk')
+        self.compute.driver.get_info_bulk(mox.IgnoreArg()).AndReturn({})
+        self.mox.ReplayAll()
+
+        ctxt = context.get_admin_context()
+        self.compute._sync_power_states(ctxt)
+        self.compute._sync_power_states(ctxt)
+
     def test_add_instance_fault(self):
         exc_info = None
         instance_uuid = str(utils.gen_uuid())
@@ -1563,7 +1632,8 @@ class ComputeTestCase(BaseTestCase):
 
     def test_heal_instance_info_cache(self):
         # Update on every call for the test
-        self.flags(heal_instance_info_cache_interval=-1)
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=1)
         ctxt = context.get_admin_context()
 
         instance_map = {}
@@ -1637,6 +1707,63 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(call_info['get_by_uuid'], 3)
         self.assertEqual(call_info['get_nw_info'], 4)
 
+    def test_heal_instance_info_cache_batch(self):
+        self.flags(heal_instance_info_cache_interval=-1,
+                   heal_instance_info_cache_batch_size=2)
+        ctxt = context.get_admin_context()
+        instances = [{'uuid': 'fake-uuid-%s' % x, 'host': FLAGS.host}
+                     for x in xrange(5)]
+        calls = []
+        healed = []
+        now = [1000]
+
+        def fake_instance_get_all_by_host(context, host):
+            calls.append('get_all_by_host')
+            return [inst for inst in instances if inst['host'] == host]
+
+        def fake_instance_get_all_by_filters(context, filters):
+            calls.append(('get_all_by_filters', filters['uuid']))
+            return [inst for inst in instances
+                    if inst['uuid'] in filters['uuid']]
+
+        def fake_get_instances_nw_info(context, instances):
+            healed.append([inst['uuid'] for inst in instances])
+            # the network manager fails to update fake-uuid-1
+            return dict((inst['uuid'], []) for inst in instances
+                        if inst['uuid'] != 'fake-uuid-1')
+
+        def fake_time():
+            now[0] += 1
+            return now[0]
+
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                       fake_instance_get_all_by_host)
+        self.stubs.Set(db, 'instance_get_all_by_filters',
+                       fake_instance_get_all_by_filters)
+        self.stubs.Set(self.compute.network_api, 'get_instances_nw_info',
+                       fake_get_instances_nw_info)
+        self.stubs.Set(time, 'time', fake_time)
+
+        self.compute._heal_instance_info_cache(ctxt)
+        # Make an instance switch hosts
+        instances[3]['host'] = 'not-me'
+        self.compute._heal_instance_info_cache(ctxt)
+        self.compute._heal_instance_info_cache(ctxt)
+        self.assertEqual(healed, [['fake-uuid-0', 'fake-uuid-1'],
+                                  ['fake-uuid-2'], ['fake-uuid-4']])
+        self.assertEqual(calls, ['get_all_by_host',
+                                 ('get_all_by_filters',
+                                  ['fake-uuid-2', 'fake-uuid-3']),
+                                 ('get_all_by_filters', ['fake-uuid-4'])])
+
+        # The next cycle lists the instances again, and starts with the
+        # one whose cache was never updated
+        self.compute._heal_instance_info_cache(ctxt)
+        self.assertEqual(healed[-1], ['fake-uuid-1', 'fake-uuid-0'])
+        self.assertEqual(calls[-1], 'get_all_by_host')
+        self.assertEqual(sorted(self.compute._info_cache_heal_times),
+                         ['fake-uuid-0', 'fake-uuid-2', 'fake-uuid-4'])
+
 
 class ComputeAPITestCase(BaseTestCase):
 
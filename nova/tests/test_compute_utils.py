@@ -24,6 +24,7 @@ from nova import test
 from nova import log as logging
 from nova import utils
 import nova.image.fake
+import nova.rpc
 from nova.compute import utils as compute_utils
 from nova.compute import instance_types
 from nova.notifier import test_notifier
@@ -103,3 +104,59 @@ class UsageInfoTestCase(test.TestCase):
         image_ref_url = "%s/images/1" % utils.generate_glance_url()
         self.assertEquals(payload['image_ref_url'], image_ref_url)
         self.compute.terminate_instance(self.context, instance['uuid'])
+
+    def _fake_instance(self, uuid, network_info=None):
+        return {'uuid': uuid,
+                'project_id': self.project_id,
+                'user_id': self.user_id,
+                'instance_type': {'name': 'm1.fake'},
+                'instance_type_id': 1,
+                'memory_mb': 512,
+                'root_gb': 1,
+                'ephemeral_gb': 0,
+                'display_name': uuid,
+                'created_at': utils.utcnow(),
+                'launched_at': utils.utcnow(),
+                'image_ref': 1,
+                'vm_state': 'active',
+                'task_state': None,
+                'info_cache': {'network_info': network_info}}
+
+    def test_notify_usage_exists_bulk(self):
+        """Ensure bulk 'exists' notifications only use cached network info
+        and the prefetched bandwidth usage, and are published at once."""
+        def fake_get_nw_info(cls, ctxt, instance):
+            self.fail('network info should only come from the cache')
+
+        self.stubs.Set(nova.network.API, 'get_instance_nw_info',
+                       fake_get_nw_info)
+        begin, end = utils.current_audit_period()
+        network_info = [{'id': 1,
+                         'address': 'aa:aa:aa:aa:aa:01',
+                         'network': {'id': 1,
+                                     'label': 'public',
+                                     'subnets': []}}]
+        db.bw_usage_update(self.context, 'aa:aa:aa:aa:aa:01', begin, 100, 200)
+        instances = [self._fake_instance('fake-uuid-1', network_info),
+                     self._fake_instance('fake-uuid-2')]
+
+        self.flags(notification_driver='nova.notifier.rabbit_notifier')
+        batches = []
+
+        def fake_notify_many(context, topic, msgs):
+            batches.append((topic, msgs))
+
+        self.stubs.Set(nova.rpc, 'notify_many', fake_notify_many)
+        compute_utils.notify_usage_exists_bulk(instances, begin, end)
+        self.assertEquals(len(batches), 1)
+        topic, msgs = batches[0]
+        self.assertEquals(topic, 'notifications.info')
+        self.assertEquals(len(msgs), 2)
+        payloads = dict((msg['payload']['instance_id'], msg['payload'])
+                        for msg in msgs)
+        self.assertEquals(payloads['fake-uuid-1']['bandwidth'],
+                          {'public': {'bw_in': 100, 'bw_out': 200}})
+        self.assertEquals(payloads['fake-uuid-2']['bandwidth'], {})
+        for payload in payloads.values():
+            self.assertEquals(payload['audit_period_beginning'], str(begin))
+            self.assertEquals(payload['audit_period_ending'], str(end))
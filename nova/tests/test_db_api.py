@@ -127,6 +127,27 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(0, len(results))
         db.instance_update(ctxt, instance.id, {"task_state": None})
 
+    def test_instance_get_active_by_window_joined_paged(self):
+        ctxt = context.get_admin_context()
+        now = utils.utcnow()
+        begin = now - datetime.timedelta(hours=1)
+        instance_ids = []
+        for i in xrange(5):
+            instance = db.instance_create(ctxt, {'launched_at': begin})
+            instance_ids.append(instance['id'])
+
+        pages = []
+        marker = None
+        while True:
+            page = db.instance_get_active_by_window_joined(ctxt, begin, now,
+                    marker=marker, limit=2)
+            if not page:
+                break
+            pages.append([instance['id'] for instance in page])
+            marker = page[-1]['id']
+        self.assertEqual(pages, [instance_ids[0:2], instance_ids[2:4],
+                                 instance_ids[4:]])
+
     def test_network_create_safe(self):
         ctxt = context.get_admin_context()
         values = {'host': 'localhost', 'project_id': 'project1'}
@@ -180,6 +201,28 @@ class DbApiTestCase(test.TestCase):
         instance_meta = db.instance_metadata_get(ctxt, instance.id)
         self.assertEqual('bar', instance_meta['host'])
 
+    def test_instance_update_power_states(self):
+        ctxt = context.get_admin_context()
+        instance1 = db.instance_create(ctxt, {'power_state': 1,
+                                              'vm_state': 'active'})
+        instance2 = db.instance_create(ctxt, {'power_state': 1,
+                                              'vm_state': 'active'})
+        instance3 = db.instance_create(ctxt, {'power_state': 1,
+                                              'vm_state': 'active'})
+
+        db.instance_update_power_states(ctxt, {
+                instance1['id']: {'power_state': 4, 'vm_state': 'stopped'},
+                instance2['id']: {'power_state': 3}})
+
+        instance1 = db.instance_get(ctxt, instance1['id'])
+        self.assertEqual(instance1['power_state'], 4)
+        self.assertEqual(instance1['vm_state'], 'stopped')
+        instance2 = db.instance_get(ctxt, instance2['id'])
+        self.assertEqual(instance2['power_state'], 3)
+        self.assertEqual(instance2['vm_state'], 'active')
+        instance3 = db.instance_get(ctxt, instance3['id'])
+        self.assertEqual(instance3['power_state'], 1)
+
     def test_instance_fault_create(self):
         """Ensure we can create an instance fault"""
         ctxt = context.get_admin_context()
@@ -281,6 +324,23 @@ class DbApiTestCase(test.TestCase):
         db.dnsdomain_unregister(ctxt, domain1)
         db.dnsdomain_unregister(ctxt, domain2)
 
+    def test_service_heartbeat(self):
+        ctxt = context.get_admin_context()
+        values = {'host': 'foo', 'binary': 'nova-fake', 'topic': 'fake',
+                  'report_count': 3, 'availability_zone': 'nova'}
+        service = db.service_create(ctxt, values)
+        db.service_heartbeat(ctxt, service['id'],
+                             {'availability_zone': 'zone1'})
+        service = db.service_get(ctxt, service['id'])
+        self.assertEqual(service['report_count'], 4)
+        self.assertEqual(service['availability_zone'], 'zone1')
+        self.assertNotEqual(service['updated_at'], None)
+
+    def test_service_heartbeat_not_found(self):
+        ctxt = context.get_admin_context()
+        self.assertRaises(exception.ServiceNotFound,
+                          db.service_heartbeat, ctxt, 99999)
+
     def test_network_get_associated_fixed_ips(self):
         ctxt = context.get_admin_context()
         values = {'host': 'foo', 'hostname': 'myname'}
@@ -750,3 +810,69 @@ class TestIpAllocation(test.TestCase):
         fixed_ip = db.fixed_ip_get_by_address(self.ctxt, address)
         self.assertEqual(fixed_ip.instance_id, self.instance.id)
         self.assertEqual(fixed_ip.network_id, self.network.id)
+
+
+class InstanceUsageTestCase(test.TestCase):
+    def setUp(self):
+        super(InstanceUsageTestCase, self).setUp()
+        self.ctxt = context.get_admin_context()
+        self.instance_type = db.instance_type_create(self.ctxt,
+                {'name': 'usage.test', 'flavorid': 'usage.test',
+                 'memory_mb': 512, 'vcpus': 2, 'root_gb': 10,
+                 'ephemeral_gb': 5, 'swap': 0})
+        self.start = datetime.datetime(2012, 5, 1, 10, 0, 0)
+
+    def _create_instance(self, project_id, launched, terminated=None):
+        values = {'project_id': project_id,
+                  'instance_type_id': self.instance_type['id'],
+                  'launched_at': (self.start +
+                                  datetime.timedelta(hours=launched))}
+        if terminated is not None:
+            values['terminated_at'] = (self.start +
+                                       datetime.timedelta(hours=terminated))
+        return db.instance_create(self.ctxt, values)
+
+    def _totals_by_project(self, totals):
+        return dict((t['project_id'], t) for t in totals)
+
+    def test_totals_clip_to_window(self):
+        self._create_instance('p1', -2, 3)
+        self._create_instance('p1', 1)
+        self._create_instance('p2', 4.5)
+        self._create_instance('p2', -5, -1)
+        end = self.start + datetime.timedelta(hours=5)
+        totals = self._totals_by_project(
+                db.instance_usage_totals_by_window(self.ctxt, self.start,
+                                                   end))
+        self.assertEqual(sorted(totals), ['p1', 'p2'])
+        self.assertAlmostEqual(totals['p1']['hours'], 7.0, places=3)
+        self.assertAlmostEqual(totals['p1']['vcpus_hours'], 14.0, places=3)
+        self.assertAlmostEqual(totals['p1']['memory_mb_hours'], 3584.0,
+                               places=2)
+        self.assertAlmostEqual(totals['p1']['local_gb_hours'], 105.0,
+                               places=2)
+        self.assertAlmostEqual(totals['p2']['hours'], 0.5, places=3)
+
+        totals = db.instance_usage_totals_by_window(self.ctxt, self.start,
+                                                    end, project_id='p2')
+        self.assertEqual([t['project_id'] for t in totals], ['p2'])
+
+    def test_rollup_hour(self):
+        self.assertEqual(db.instance_usage_rollup_get_range(self.ctxt),
+                         (None, None))
+        self._create_instance('p1', 0.5, 3)
+        self._create_instance('p2', -1)
+        hour = datetime.timedelta(hours=1)
+        for i in xrange(3):
+            db.instance_usage_rollup_hour(self.ctxt, self.start + i * hour)
+        # rolling up an hour again replaces its rows
+        db.instance_usage_rollup_hour(self.ctxt, self.start)
+
+        self.assertEqual(db.instance_usage_rollup_get_range(self.ctxt),
+                         (self.start, self.start + 2 * hour))
+        totals = self._totals_by_project(
+                db.instance_usage_rollup_totals(self.ctxt, self.start,
+                                                self.start + 3 * hour))
+        self.assertAlmostEqual(totals['p1']['hours'], 2.5, places=3)
+        self.assertAlmostEqual(totals['p2']['hours'], 3.0, places=3)
+        self.assertAlmostEqual(totals['p2']['vcpus_hours'], 6.0, places=3)
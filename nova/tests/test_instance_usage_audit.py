@@ -0,0 +1,90 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+
+import nova.compute.utils
+from nova import context
+from nova import db
+from nova import test
+from nova import utils
+
+
+TOPDIR = os.path.normpath(os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir,
+                            os.pardir))
+USAGE_AUDIT_PATH = os.path.join(TOPDIR, 'bin', 'instance-usage-audit')
+
+sys.dont_write_bytecode = True
+usage_audit = imp.load_source('instance_usage_audit.py', USAGE_AUDIT_PATH)
+sys.dont_write_bytecode = False
+
+
+class AuditBulkTestCase(test.TestCase):
+    def setUp(self):
+        super(AuditBulkTestCase, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.flags(page_size=1,
+                   checkpoint_file=os.path.join(tmpdir, 'checkpoint'))
+        self.context = context.get_admin_context()
+        self.begin, self.end = utils.current_audit_period()
+
+        instances = [{'id': 1}, {'id': 2}, {'id': 3}]
+
+        def fake_get_active_by_window(context, begin, end, marker=None,
+                                      limit=None):
+            remaining = [i for i in instances
+                         if marker is None or i['id'] > marker]
+            return remaining[:limit]
+
+        self.stubs.Set(db, 'instance_get_active_by_window_joined',
+                       fake_get_active_by_window)
+
+        self.published = []
+        self.results = []
+
+        def fake_notify_usage_exists_bulk(instances, begin, end):
+            result = self.results.pop(0) if self.results else True
+            if result:
+                self.published.extend(i['id'] for i in instances)
+            return result
+
+        self.stubs.Set(nova.compute.utils, 'notify_usage_exists_bulk',
+                       fake_notify_usage_exists_bulk)
+
+    def _audit(self):
+        return usage_audit.audit_bulk(self.context, self.begin, self.end)
+
+    def test_audit_bulk(self):
+        self.assertTrue(self._audit())
+        self.assertEqual(self.published, [1, 2, 3])
+        self.assertFalse(os.path.exists(usage_audit.FLAGS.checkpoint_file))
+
+    def test_failed_publish_keeps_checkpoint(self):
+        self.results = [True, False]
+        self.assertFalse(self._audit())
+        self.assertEqual(self.published, [1])
+        self.assertEqual(usage_audit.read_checkpoint(self.begin, self.end),
+                         1)
+
+        self.assertTrue(self._audit())
+        self.assertEqual(self.published, [1, 2, 3])
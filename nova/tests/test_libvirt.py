@@ -16,6 +16,7 @@
 
 import copy
 import eventlet
+import functools
 import mox
 import os
 import re
@@ -2117,6 +2118,214 @@ class LibvirtConnectionTestCase(test.TestCase):
         inst.update(params)
         return db.instance_create(context.get_admin_context(), inst)
 
+    def _fake_domains_conn(self, domains):
+        """Make self.libvirtconnection talk to domains, a dict of ids
+        to (vcpus, xml), counting the domains looked up."""
+
+        test_case = self
+        self.looked_up = []
+
+        class FakeDomain(object):
+            def __init__(self, dom_id):
+                self.dom_id = dom_id
+
+            def name(self):
+                return 'instance-%08x' % self.dom_id
+
+            def vcpus(self):
+                return ([], [None] * domains[self.dom_id][0])
+
+            def XMLDesc(self, flags):
+                return domains[self.dom_id][1]
+
+        class FakeConn(object):
+            def getCapabilities(self):
+                return ''
+
+            def listDomainsID(self):
+                return domains.keys()
+
+            def lookupByID(self, dom_id):
+                test_case.looked_up.append(dom_id)
+                return FakeDomain(dom_id)
+
+        self.libvirtconnection._wrapped_conn = FakeConn()
+
+    def test_get_vcpu_used(self):
+        domains = {1: (2, None), 2: (4, None)}
+        self._fake_domains_conn(domains)
+        conn = self.libvirtconnection
+
+        self.assertEqual(conn.get_vcpu_used(), 6)
+        self.assertEqual(sorted(self.looked_up), [1, 2])
+
+        # Only the domains that were not seen before are looked up
+        domains[3] = (1, None)
+        del domains[1]
+        self.looked_up = []
+        self.assertEqual(conn.get_vcpu_used(), 5)
+        self.assertEqual(self.looked_up, [3])
+
+    def test_get_disk_available_least(self):
+        xml = ("<domain type='kvm'><devices>"
+               "<disk type='file'><driver name='qemu' type='qcow2'/>"
+               "<source file='%(path)s/disk'/></disk>"
+               "<disk type='file'><driver name='qemu' type='raw'/>"
+               "<source file='%(path)s/disk.local'/></disk>"
+               "<disk type='block'><driver name='qemu' type='raw'/>"
+               "<source dev='/dev/sdb'/></disk>"
+               "</devices></domain>")
+        domains = {1: (1, xml % {'path': self.temp_path.rstrip('/')})}
+        self._fake_domains_conn(domains)
+        conn = self.libvirtconnection
+        GB = 1024 ** 3
+        disk_sizes = []
+
+        def fake_get_disk_size(path):
+            disk_sizes.append(path)
+            return 10 * GB
+
+        def fake_getsize(path):
+            return 2 * GB
+
+        self.stubs.Set(connection.libvirt_utils, 'get_disk_size',
+                       fake_get_disk_size)
+        self.stubs.Set(os.path, 'getsize', fake_getsize)
+
+        # qcow2 disk: 10G - 2G, raw disk: 0 - 2G
+        self.assertEqual(conn._get_disk_available_least(100 * GB), 94)
+        self.assertEqual(conn._get_disk_available_least(100 * GB), 94)
+        self.assertEqual(disk_sizes, [self.temp_path + 'disk'])
+
+        # The virtual sizes of resized disks are read again
+        conn._forget_disk_sizes({'name': 'instance-00000001'})
+        self.assertEqual(conn._get_disk_available_least(100 * GB), 94)
+        self.assertEqual(len(disk_sizes), 2)
+
+    def test_update_available_resource(self):
+        compute_node = {'id': 1, 'vcpus': 4, 'memory_mb': 2000,
+                        'local_gb': 100, 'vcpus_used': 2,
+                        'memory_mb_used': 1000, 'local_gb_used': 50,
+                        'hypervisor_type': 'QEMU',
+                        'hypervisor_version': 13091, 'cpu_info': '{}',
+                        'service_id': 1, 'disk_available_least': 40}
+        service = {'id': 1, 'compute_node': [compute_node]}
+        resources = {'vcpus_used': 2, 'memory_mb_used': 1000,
+                     'local_gb_used': 50}
+        updates = []
+
+        def fake_get_fs_info(path):
+            return {'total': 100 * 1024 ** 3, 'free': 0,
+                    'used': resources['local_gb_used'] * 1024 ** 3}
+
+        def fake_compute_node_update(context, compute_id, values):
+            updates.append(values)
+            compute_node.update(values)
+
+        conn = self.libvirtconnection
+        self.stubs.Set(db, 'service_get_all_compute_by_host',
+                       lambda context, host: [service])
+        self.stubs.Set(db, 'compute_node_update', fake_compute_node_update)
+        self.stubs.Set(conn, 'get_vcpu_total', lambda: 4)
+        self.stubs.Set(conn, 'get_vcpu_used',
+                       lambda: resources['vcpus_used'])
+        self.stubs.Set(conn, '_get_memory_mb_info',
+                       lambda: (2000, resources['memory_mb_used']))
+        self.stubs.Set(connection.libvirt_utils, 'get_fs_info',
+                       fake_get_fs_info)
+        self.stubs.Set(conn, 'get_hypervisor_type', lambda: 'QEMU')
+        self.stubs.Set(conn, 'get_hypervisor_version', lambda: 13091)
+        self.stubs.Set(conn, 'get_cpu_info', lambda: '{}')
+        self.stubs.Set(conn, '_get_disk_available_least',
+                       lambda available: 40)
+
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(updates, [])
+
+        # Small changes of memory and disk usage are not written
+        resources['memory_mb_used'] = 1020
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(updates, [])
+
+        resources['memory_mb_used'] = 1021
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0]['memory_mb_used'], 1021)
+
+        resources['vcpus_used'] = 3
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(len(updates), 2)
+
+        self.flags(libvirt_resource_update_threshold=0)
+        resources['local_gb_used'] = 51
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(len(updates), 3)
+
+        # The record is still written now and then so that the utilization
+        # of the host is recomputed from its instances
+        self.flags(libvirt_resource_update_max_skips=2)
+        conn.update_available_resource(None, 'host1')
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(len(updates), 3)
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(len(updates), 4)
+        conn.update_available_resource(None, 'host1')
+        self.assertEqual(len(updates), 4)
+
+    def test_prepare_images(self):
+        self.flags(libvirt_image_prepare_concurrency=2)
+        running = []
+        max_running = []
+
+        def step(name):
+            running.append(name)
+            max_running.append(len(running))
+            eventlet.sleep(0.01)
+            running.remove(name)
+
+        steps = [(name, functools.partial(step, name))
+                 for name in ('kernel', 'ramdisk', 'disk')]
+        timings = []
+        connection.LibvirtConnection._prepare_images(steps, timings)
+        self.assertEqual(max(max_running), 2)
+        self.assertEqual(sorted(name for name, seconds, error in timings),
+                         ['disk', 'kernel', 'ramdisk'])
+        for name, seconds, error in timings:
+            self.assertTrue(seconds >= 0.01)
+            self.assertEqual(error, None)
+
+    def test_prepare_images_waits_for_all_steps(self):
+        self.flags(libvirt_image_prepare_concurrency=4)
+        done = []
+
+        def fail():
+            raise exception.ImageNotFound(image_id='fake')
+
+        def slow():
+            eventlet.sleep(0.01)
+            done.append('disk')
+
+        steps = [('kernel', fail), ('disk', slow)]
+        timings = []
+        self.assertRaises(exception.ImageNotFound,
+                          connection.LibvirtConnection._prepare_images,
+                          steps, timings)
+        self.assertEqual(done, ['disk'])
+        self.assertEqual([(name, error is not None)
+                          for name, seconds, error in timings],
+                         [('kernel', True), ('disk', False)])
+
+    def test_record_image_timings(self):
+        ctxt = context.get_admin_context()
+        ins_ref = self._create_instance()
+        connection.LibvirtConnection._record_image_timings(ins_ref,
+                [('disk', 12.345, None), ('disk.local', 1, 'mkfs failed')])
+        actions = db.instance_get_actions(ctxt, ins_ref['uuid'])
+        self.assertEqual(sorted((action['action'], action['error'])
+                                for action in actions),
+                         [('create_image disk 12.35s', None),
+                          ('create_image disk.local 1.00s', 'mkfs failed')])
+
     def test_migrate_disk_and_power_off_exception(self):
         """Test for nova.virt.libvirt.connection.LivirtConnection
         .migrate_disk_and_power_off. """
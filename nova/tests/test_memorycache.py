@@ -0,0 +1,118 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright 2010 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import commands
+import datetime
+
+from nova.common import memorycache
+from nova import test
+from nova import utils
+
+
+class MemorycacheTestCase(test.TestCase):
+    def setUp(self):
+        super(MemorycacheTestCase, self).setUp()
+        utils.set_time_override(datetime.datetime(2012, 1, 1))
+        self.addCleanup(utils.clear_time_override)
+        self.client = memorycache.Client()
+
+    def test_get_set(self):
+        self.assertEqual(self.client.get('foo'), None)
+        self.assertTrue(self.client.set('foo', 'bar'))
+        self.assertEqual(self.client.get('foo'), 'bar')
+
+    def test_expiry(self):
+        self.client.set('foo', 'bar', time=10)
+        self.client.set('forever', 'bar')
+        utils.advance_time_seconds(9)
+        self.assertEqual(self.client.get('foo'), 'bar')
+        utils.advance_time_seconds(1)
+        self.assertEqual(self.client.get('foo'), None)
+        self.assertEqual(self.client.get('forever'), 'bar')
+
+    def test_absolute_expiry(self):
+        now = utils.utcnow_ts()
+        self.client.set('foo', 'bar', time=now + 10)
+        utils.advance_time_seconds(9)
+        self.assertEqual(self.client.get('foo'), 'bar')
+        utils.advance_time_seconds(1)
+        self.assertEqual(self.client.get('foo'), None)
+
+    def test_expired_keys_dropped_on_set(self):
+        for i in xrange(10):
+            self.client.set('key%d' % i, i, time=5)
+        utils.advance_time_seconds(5)
+        self.client.set('other', 'value')
+        self.assertEqual(len(self.client.cache), 1)
+
+    def test_reset_key_not_expired_early(self):
+        self.client.set('foo', 'bar', time=5)
+        self.client.set('foo', 'baz', time=20)
+        utils.advance_time_seconds(10)
+        self.client.set('other', 'value')
+        self.assertEqual(self.client.get('foo'), 'baz')
+
+    def test_max_size(self):
+        self.flags(memorycache_max_size=2)
+        client = memorycache.Client()
+        client.set('a', 1)
+        client.set('b', 2)
+        client.get('a')
+        client.set('c', 3)
+        self.assertEqual(client.get('a'), 1)
+        self.assertEqual(client.get('b'), None)
+        self.assertEqual(client.get('c'), 3)
+
+    def test_add(self):
+        self.assertTrue(self.client.add('foo', 'bar', time=5))
+        self.assertFalse(self.client.add('foo', 'baz'))
+        self.assertEqual(self.client.get('foo'), 'bar')
+        utils.advance_time_seconds(5)
+        self.assertTrue(self.client.add('foo', 'baz'))
+        self.assertEqual(self.client.get('foo'), 'baz')
+
+    def test_add_none_value(self):
+        self.client.set('foo', None)
+        self.assertFalse(self.client.add('foo', 'bar'))
+
+    def test_incr_keeps_expiry(self):
+        self.assertEqual(self.client.incr('foo'), None)
+        self.client.set('foo', '1', time=10)
+        utils.advance_time_seconds(5)
+        self.assertEqual(self.client.incr('foo', 2), 3)
+        self.assertEqual(self.client.get('foo'), '3')
+        utils.advance_time_seconds(5)
+        self.assertEqual(self.client.incr('foo'), None)
+
+    def test_decr(self):
+        self.client.set('foo', '2')
+        self.assertEqual(self.client.decr('foo'), 1)
+        self.assertEqual(self.client.decr('foo', 5), 0)
+        self.assertEqual(self.client.get('foo'), '0')
+
+    def test_delete(self):
+        self.client.set('foo', 'bar')
+        self.client.delete('foo')
+        self.assertEqual(self.client.get('foo'), None)
+
+    def test_cas(self):
+        self.client.set('foo', 'bar')
+        self.assertEqual(self.client.gets('foo'), 'bar')
+        self.client.set('foo', 'baz')
+        self.assertFalse(self.client.cas('foo', 'qux'))
+        self.assertEqual(self.client.gets('foo'), 'baz')
+        self.assertTrue(self.client.cas('foo', 'qux'))
+        self.assertEqual(self.client.get('foo'), 'qux')
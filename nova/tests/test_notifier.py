@@ -17,6 +17,7 @@ import nova
 from nova import flags
 from nova import log
 import nova.notifier.no_op_notifier
+import nova.notifier.test_notifier
 from nova.notifier import api as notifier_api
 from nova import test
 
@@ -131,3 +132,134 @@ class NotifierTestCase(test.TestCase):
 
         self.assertEqual(3, example_api(1, 2))
         self.assertEqual(self.notify_called, True)
+
+    def test_driver_is_imported_once(self):
+        imports = []
+        real_import_object = nova.utils.import_object
+
+        def fake_import_object(name):
+            imports.append(name)
+            return real_import_object(name)
+
+        self.stubs.Set(nova.utils, 'import_object', fake_import_object)
+        self.stubs.Set(notifier_api, '_drivers', {})
+        for i in xrange(3):
+            notifier_api.notify('publisher_id', 'event_type',
+                    nova.notifier.api.WARN, dict(a=3))
+        self.assertEqual(imports, ['nova.notifier.no_op_notifier'])
+
+    def test_notify_many_sends_one_batch(self):
+        self.stubs.Set(nova.flags.FLAGS, 'notification_driver',
+                'nova.notifier.rabbit_notifier')
+        batches = []
+
+        def mock_notify_many(context, topic, msgs):
+            batches.append((topic, msgs))
+
+        self.stubs.Set(nova.rpc, 'notify_many', mock_notify_many)
+        self.assertTrue(notifier_api.notify_many('publisher_id',
+                'event_type', nova.notifier.api.INFO, [dict(a=1), dict(a=2)]))
+        self.assertEqual(len(batches), 1)
+        topic, msgs = batches[0]
+        self.assertEqual(topic, 'notifications.info')
+        self.assertEqual([msg['payload'] for msg in msgs],
+                         [dict(a=1), dict(a=2)])
+        self.assertEqual(msgs[0]['event_type'], 'event_type')
+
+    def test_notify_many_reports_failure(self):
+        self.stubs.Set(nova.flags.FLAGS, 'notification_driver',
+                'nova.notifier.rabbit_notifier')
+
+        def mock_notify_many(context, topic, msgs):
+            raise IOError()
+
+        self.stubs.Set(nova.rpc, 'notify_many', mock_notify_many)
+        self.assertFalse(notifier_api.notify_many('publisher_id',
+                'event_type', nova.notifier.api.INFO, [dict(a=1), dict(a=2)]))
+
+    def test_notify_many_bad_priority(self):
+        self.assertRaises(nova.notifier.api.BadPriorityException,
+                notifier_api.notify_many, 'publisher_id',
+                'event_type', 'not a priority', [dict(a=1)])
+
+
+class AsyncNotifierTestCase(test.TestCase):
+    """Test case for notifications published from a queue"""
+    def setUp(self):
+        super(AsyncNotifierTestCase, self).setUp()
+        self.flags(notification_driver='nova.notifier.test_notifier',
+                   notification_async=True)
+        nova.notifier.test_notifier.NOTIFICATIONS = []
+        notifier_api._publisher.reset()
+
+    def tearDown(self):
+        notifier_api._publisher.reset()
+        super(AsyncNotifierTestCase, self).tearDown()
+
+    def _notify(self, count):
+        for i in xrange(count):
+            notifier_api.notify('publisher_id', 'event_type',
+                    nova.notifier.api.INFO, dict(a=i))
+
+    def test_notifications_are_queued(self):
+        self._notify(3)
+        self.assertEqual(nova.notifier.test_notifier.NOTIFICATIONS, [])
+        notifier_api.flush()
+        payloads = [msg['payload'] for msg in
+                    nova.notifier.test_notifier.NOTIFICATIONS]
+        self.assertEqual(payloads, [dict(a=0), dict(a=1), dict(a=2)])
+        stats = notifier_api.stats()
+        self.assertEqual(stats['queued'], 3)
+        self.assertEqual(stats['sent'], 3)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_batches_use_notify_many(self):
+        self.flags(notification_driver='nova.notifier.rabbit_notifier')
+        batches = []
+
+        def mock_notify_many(context, topic, msgs):
+            batches.append((topic, len(msgs)))
+
+        self.stubs.Set(nova.rpc, 'notify_many', mock_notify_many)
+        self._notify(3)
+        notifier_api.flush()
+        self.assertEqual(batches, [('notifications.info', 3)])
+
+    def test_failures_counted(self):
+        self.flags(notification_driver='nova.notifier.rabbit_notifier')
+
+        def mock_notify(context, topic, msg):
+            raise IOError()
+
+        self.stubs.Set(nova.rpc, 'notify', mock_notify)
+        self._notify(1)
+        notifier_api.flush()
+        stats = notifier_api.stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['sent'], 0)
+
+    def test_full_queue_drops(self):
+        self.flags(notification_queue_size=1,
+                   notification_queue_full='drop')
+        self._notify(3)
+        notifier_api.flush()
+        self.assertEqual(len(nova.notifier.test_notifier.NOTIFICATIONS), 1)
+        stats = notifier_api.stats()
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['sent'], 1)
+
+    def test_full_queue_blocks(self):
+        self.flags(notification_queue_size=1)
+        self._notify(3)
+        notifier_api.flush()
+        self.assertEqual(len(nova.notifier.test_notifier.NOTIFICATIONS), 3)
+        self.assertEqual(notifier_api.stats()['dropped'], 0)
+
+    def test_driver_failures_are_counted(self):
+        def broken_notify(message):
+            raise Exception('broken')
+
+        self.stubs.Set(nova.notifier.test_notifier, 'notify', broken_notify)
+        self._notify(1)
+        notifier_api.flush()
+        self.assertEqual(notifier_api.stats()['failed'], 1)
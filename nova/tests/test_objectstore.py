@@ -21,6 +21,7 @@ Unittets for S3 objectstore clone.
 """
 
 import boto
+import hashlib
 import os
 import shutil
 import tempfile
@@ -128,6 +129,38 @@ class S3APITestCase(test.TestCase):
 
         self._ensure_no_buckets(bucket.get_all_keys())
 
+    def test_get_key_range(self):
+        bucket_name = 'testbucket'
+        key_name = 'somekey'
+        key_contents = '0123456789' * 10000
+
+        b = self.conn.create_bucket(bucket_name)
+        k = b.new_key(key_name)
+        k.set_contents_from_string(key_contents)
+        md5 = hashlib.md5(key_contents).hexdigest()
+        self.assertEquals(k.etag, '"%s"' % md5)
+
+        key = self.conn.get_bucket(bucket_name).get_key(key_name)
+        self.assertEquals(key.get_contents_as_string(), key_contents)
+        contents = key.get_contents_as_string(
+                headers={'Range': 'bytes=5-14'})
+        self.assertEquals(contents, key_contents[5:15])
+
+    def test_list_keys_with_prefix_and_marker(self):
+        bucket_name = 'testbucket'
+        b = self.conn.create_bucket(bucket_name)
+        for key_name in ['a1', 'b1', 'b2', 'b3', 'b4', 'c1']:
+            b.new_key(key_name).set_contents_from_string(key_name)
+        b.get_key('b2').delete()
+
+        keys = b.get_all_keys(prefix='b', marker='b1', max_keys=2)
+        self.assertEquals([k.name for k in keys], ['b3', 'b4'])
+        self.assertFalse(keys.is_truncated)
+
+        keys = b.get_all_keys(max_keys=2)
+        self.assertEquals([k.name for k in keys], ['a1', 'b1'])
+        self.assertTrue(keys.is_truncated)
+
     def test_unknown_bucket(self):
         bucket_name = 'falalala'
         self.assertRaises(boto_exception.S3ResponseError,
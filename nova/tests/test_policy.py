@@ -61,6 +61,26 @@ class PolicyFileTestCase(test.TestCase):
             self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
                               self.context, action, self.target)
 
+    def test_policy_file_checked_at_interval(self):
+        with utils.tempdir() as tmpdir:
+            tmpfilename = os.path.join(tmpdir, 'policy')
+            self.flags(policy_file=tmpfilename,
+                       policy_file_check_interval=3600)
+
+            action = "example:test"
+            with open(tmpfilename, "w") as policyfile:
+                policyfile.write("""{"example:test": []}""")
+            policy.enforce(self.context, action, self.target)
+            with open(tmpfilename, "w") as policyfile:
+                policyfile.write("""{"example:test": ["false:false"]}""")
+            mtime = os.path.getmtime(tmpfilename)
+            os.utime(tmpfilename, (mtime + 10, mtime + 10))
+            policy.enforce(self.context, action, self.target)
+
+            self.flags(policy_file_check_interval=0)
+            self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                              self.context, action, self.target)
+
 
 class PolicyTestCase(test.TestCase):
     def setUp(self):
@@ -151,6 +171,56 @@ class PolicyTestCase(test.TestCase):
         policy.enforce(admin_context, lowercase_action, self.target)
         policy.enforce(admin_context, uppercase_action, self.target)
 
+    def _count_to_dict(self):
+        calls = []
+        to_dict = self.context.to_dict
+
+        def counting_to_dict():
+            calls.append(1)
+            return to_dict()
+        self.stubs.Set(self.context, 'to_dict', counting_to_dict)
+        return calls
+
+    def test_results_remembered_for_context(self):
+        calls = self._count_to_dict()
+        action = "example:my_file"
+        policy.enforce(self.context, action, {'project_id': 'fake'})
+        policy.enforce(self.context, action, {'project_id': 'fake',
+                                              'host': 'somewhere'})
+        self.assertEqual(len(calls), 1)
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, {'project_id': 'another'})
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, {'project_id': 'another'})
+        self.assertEqual(len(calls), 2)
+
+        self.context.roles.append('compute_admin')
+        policy.enforce(self.context, action, {'project_id': 'another'})
+        self.assertEqual(len(calls), 3)
+
+    def test_http_results_not_remembered(self):
+        calls = self._count_to_dict()
+
+        def fakeurlopen(url, post_data):
+            return StringIO.StringIO("True")
+        self.stubs.Set(urllib2, 'urlopen', fakeurlopen)
+        policy.enforce(self.context, "example:get_http", {})
+        policy.enforce(self.context, "example:get_http", {})
+        self.assertEqual(len(calls), 2)
+
+    def test_changed_rules_not_remembered(self):
+        action = "example:allowed"
+        policy.enforce(self.context, action, self.target)
+        common_policy.get_brain().add_rule(action, [["false:false"]])
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, self.target)
+
+    def test_recursive_rule(self):
+        common_policy.get_brain().add_rule("example:a", [["rule:example:b"]])
+        common_policy.get_brain().add_rule("example:b",
+                [["role:member"], ["rule:example:a"]])
+        policy.enforce(self.context, "example:a", self.target)
+
 
 class DefaultPolicyTestCase(test.TestCase):
 
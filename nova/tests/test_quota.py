@@ -26,6 +26,8 @@ from nova import rpc
 from nova import test
 from nova import volume
 from nova.compute import instance_types
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy.session import get_session
 from nova.scheduler import driver as scheduler_driver
 
 
@@ -287,6 +289,176 @@ class QuotaTestCase(test.TestCase):
                           self.project_id)
         db.floating_ip_destroy(context.get_admin_context(), address)
 
+    def _get_usages(self):
+        return quota.get_project_usages(self.context, self.project_id)
+
+    def test_usages_counted_once(self):
+        instance_id = self._create_instance(cores=2)
+        db.instance_update(self.context, instance_id, {'memory_mb': 512})
+        self._create_volume(size=5)
+        usages = self._get_usages()
+        self.assertEqual(usages['instances'], 1)
+        self.assertEqual(usages['cores'], 2)
+        self.assertEqual(usages['volumes'], 1)
+        self.assertEqual(usages['gigabytes'], 5)
+
+        self.mox.StubOutWithMock(db.sqlalchemy.api,
+                                 '_instance_data_get_for_project')
+        self.mox.StubOutWithMock(db.sqlalchemy.api,
+                                 '_volume_data_get_for_project')
+        self.mox.ReplayAll()
+        instance_id = self._create_instance(cores=1)
+        self.assertEqual(self._get_usages()['cores'], 3)
+        db.instance_destroy(self.context, instance_id)
+        self.assertEqual(self._get_usages()['cores'], 2)
+
+    def test_usages_follow_instances(self):
+        self.assertEqual(self._get_usages()['instances'], 0)
+        instance_id = self._create_instance(cores=2)
+        db.instance_update(self.context, instance_id,
+                           {'vcpus': 4, 'memory_mb': 2048})
+        usages = self._get_usages()
+        self.assertEqual(usages['instances'], 1)
+        self.assertEqual(usages['cores'], 4)
+        self.assertEqual(usages['ram'], 2048)
+        db.instance_destroy(self.context, instance_id)
+        db.instance_destroy(self.context.elevated(read_deleted='yes'),
+                            instance_id)
+        usages = self._get_usages()
+        self.assertEqual(usages['instances'], 0)
+        self.assertEqual(usages['cores'], 0)
+        self.assertEqual(usages['ram'], 0)
+
+    def test_usages_follow_volumes(self):
+        volume_id = self._create_volume(size=10)
+        self.assertEqual(self._get_usages()['gigabytes'], 10)
+        db.volume_destroy(self.context, volume_id)
+        usages = self._get_usages()
+        self.assertEqual(usages['volumes'], 0)
+        self.assertEqual(usages['gigabytes'], 0)
+
+    def test_usages_follow_floating_ips(self):
+        admin_context = context.get_admin_context()
+        db.floating_ip_create(admin_context, {'address': '192.168.0.100',
+                                              'pool': 'nova'})
+        db.floating_ip_create(admin_context, {'address': '192.168.0.101',
+                                              'project_id': self.project_id})
+        self.assertEqual(self._get_usages()['floating_ips'], 1)
+        address = db.floating_ip_allocate_address(self.context,
+                                                  self.project_id, 'nova')
+        self.assertEqual(self._get_usages()['floating_ips'], 2)
+        db.floating_ip_set_auto_assigned(self.context, address)
+        self.assertEqual(self._get_usages()['floating_ips'], 1)
+        db.floating_ip_deallocate(self.context, address)
+        db.floating_ip_destroy(admin_context, '192.168.0.101')
+        self.assertEqual(self._get_usages()['floating_ips'], 0)
+
+    def _get_usage_rows(self):
+        return get_session().query(models.QuotaUsage).\
+                filter_by(project_id=self.project_id).\
+                all()
+
+    def _update_usage_row(self, resource, **values):
+        session = get_session()
+        with session.begin():
+            session.query(models.QuotaUsage).\
+                    filter_by(project_id=self.project_id).\
+                    filter_by(resource=resource).\
+                    update(values)
+
+    def test_usages_read_without_creating_rows(self):
+        self.assertEqual(self._get_usages()['instances'], 0)
+        self.assertEqual(self._get_usage_rows(), [])
+        self._create_instance(cores=2)
+        resources = sorted(row.resource for row in self._get_usage_rows())
+        self.assertEqual(resources, ['cores', 'instances'])
+        self.assertEqual(self._get_usages()['volumes'], 0)
+
+    def test_usage_rows_created_concurrently(self):
+        count = db.sqlalchemy.api._quota_usage_count
+        project_id = self.project_id
+
+        def fake_count(context, project_id, resources, session):
+            # Another transaction creates the row while this one counts
+            row = models.QuotaUsage()
+            row.project_id = project_id
+            row.resource = 'instances'
+            row.in_use = 0
+            row.reserved = 0
+            row.save()
+            self.stubs.Set(db.sqlalchemy.api, '_quota_usage_count', count)
+            return count(context, project_id, resources, session)
+
+        self.stubs.Set(db.sqlalchemy.api, '_quota_usage_count', fake_count)
+        self._create_instance(cores=2)
+        rows = [row for row in self._get_usage_rows()
+                if row.resource == 'instances']
+        self.assertEqual(len(rows), 1)
+        usages = self._get_usages()
+        self.assertEqual(usages['instances'], 1)
+        self.assertEqual(usages['cores'], 2)
+
+    def test_stale_usages_resynced(self):
+        self.flags(quota_cores=100)
+        self._create_instance(cores=2)
+        self._update_usage_row('cores', in_use=10)
+        quota.reserve(self.context, cores=1)
+        self.assertEqual(self._get_usages()['cores'], 11)
+
+        self._update_usage_row('cores', synced_at=None)
+        self.flags(quota_usage_max_age=0)
+        quota.reserve(self.context, cores=1)
+        self.assertEqual(self._get_usages()['cores'], 12)
+
+        self.flags(quota_usage_max_age=60)
+        quota.reserve(self.context, cores=1)
+        self.assertEqual(self._get_usages()['cores'], 5)
+
+    def test_negative_usages_resynced(self):
+        self.flags(quota_usage_max_age=0)
+        instance_id = self._create_instance(cores=2)
+        self._create_instance(cores=2)
+        self._update_usage_row('instances', in_use=0)
+        db.instance_destroy(self.context, instance_id)
+        self.assertEqual(self._get_usages()['instances'], 1)
+
+    def test_reserve(self):
+        reservations = quota.reserve(self.context, instances=2, cores=2)
+        self.assertEqual(self._get_usages()['instances'], 2)
+        self.assertEqual(quota.allowed_instances(self.context, 1,
+            self._get_instance_type('m1.small')), 0)
+        self.assertRaises(exception.OverQuota, quota.reserve,
+                          self.context, instances=1)
+
+        quota.rollback(self.context, reservations)
+        self.assertEqual(self._get_usages()['instances'], 0)
+        reservations = quota.reserve(self.context, instances=1)
+        self._create_instance()
+        quota.commit(self.context, reservations)
+        self.assertEqual(self._get_usages()['instances'], 1)
+
+    def test_expired_reservations_released(self):
+        self.flags(reservation_expire=-1)
+        quota.reserve(self.context, instances=2)
+        quota.reserve(self.context, instances=2)
+        self.assertEqual(self._get_usages()['instances'], 2)
+
+    def test_create_commits_reservation(self):
+        self.flags(image_service='nova.image.fake.FakeImageService')
+        api = compute.API(image_service=self.StubImageService())
+        self.stubs.Set(api, '_schedule_run_instance',
+                       lambda *args: [])
+        inst_type = instance_types.get_instance_type_by_name('m1.small')
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        api.create(self.context, min_count=1, max_count=2,
+                   instance_type=inst_type, image_href=image_uuid)
+        self.assertEqual(self._get_usages()['instances'], 0)
+
+        self.stubs.Set(api, '_schedule_run_instance', None)
+        self.assertRaises(TypeError, api.create, self.context,
+                          instance_type=inst_type, image_href=image_uuid)
+        self.assertEqual(self._get_usages()['instances'], 0)
+
     def test_too_many_metadata_items(self):
         metadata = {}
         for i in range(FLAGS.quota_metadata_items + 1):
@@ -121,6 +121,15 @@ class ServiceTestCase(test.TestCase):
 
         self.assert_(app)
 
+    def test_stop_flushes_notifications(self):
+        flushed = []
+        self.stubs.Set(service.notifier_api, 'flush',
+                       lambda: flushed.append(True))
+        app = service.Service.create(host='foo', binary='nova-fake',
+                                     topic='fake')
+        app.stop()
+        self.assertEqual(flushed, [True])
+
     def test_report_state_newly_disconnected(self):
         host = 'foo'
         binary = 'bar'
@@ -191,6 +200,150 @@ class ServiceTestCase(test.TestCase):
 
         self.assert_(not serv.model_disconnected)
 
+    def test_report_state_atomic(self):
+        self.flags(report_state_atomic=True)
+        host = 'foo'
+        binary = 'bar'
+        topic = 'test'
+        service_ref = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova',
+                          'id': 1}
+
+        service.db.service_get_by_args(mox.IgnoreArg(),
+                                      host,
+                                      binary).AndReturn(service_ref)
+        service.db.service_heartbeat(mox.IgnoreArg(), service_ref['id'],
+                                     {'availability_zone': 'nova'})
+
+        self.mox.ReplayAll()
+        serv = service.Service(host,
+                               binary,
+                               topic,
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.model_disconnected = True
+        serv.report_state()
+
+        self.assert_(not serv.model_disconnected)
+
+    def test_report_state_atomic_recreates_service(self):
+        self.flags(report_state_atomic=True)
+        host = 'foo'
+        binary = 'bar'
+        topic = 'test'
+        service_create = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova'}
+        service_ref = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova',
+                          'id': 1}
+        new_service_ref = dict(service_ref, id=2)
+
+        service.db.service_get_by_args(mox.IgnoreArg(),
+                                      host,
+                                      binary).AndReturn(service_ref)
+        service.db.service_heartbeat(mox.IgnoreArg(), service_ref['id'],
+                                     mox.IgnoreArg()).AndRaise(
+                                             exception.NotFound())
+        service.db.service_create(mox.IgnoreArg(),
+                                  service_create).AndReturn(new_service_ref)
+        service.db.service_heartbeat(mox.IgnoreArg(), new_service_ref['id'],
+                                     {'availability_zone': 'nova'})
+
+        self.mox.ReplayAll()
+        serv = service.Service(host,
+                               binary,
+                               topic,
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.report_state()
+
+        self.assert_(not serv.model_disconnected)
+        self.assertEqual(serv.service_id, new_service_ref['id'])
+
+
+class PeriodicTaskManager(manager.Manager):
+    def __init__(self, *args, **kwargs):
+        super(PeriodicTaskManager, self).__init__(*args, **kwargs)
+        self.runs = []
+
+    @manager.periodic_task
+    def _every_tick(self, context):
+        self.runs.append('every_tick')
+
+    @manager.periodic_task(ticks_between_runs=2)
+    def _every_third_tick(self, context):
+        self.runs.append('every_third_tick')
+
+    @manager.periodic_task(spacing=7)
+    def _failing(self, context):
+        raise exception.NovaException('boom')
+
+
+class PeriodicTaskTestCase(test.TestCase):
+    def test_periodic_task_stats(self):
+        mgr = PeriodicTaskManager()
+        ctxt = context.get_admin_context()
+        for i in xrange(3):
+            mgr.periodic_tasks(ctxt)
+
+        self.assertEqual(sorted(mgr.runs), ['every_third_tick', 'every_tick',
+                                            'every_tick', 'every_tick'])
+        stats = mgr.periodic_task_stats(ctxt)
+        self.assertEqual(sorted(stats), ['_every_third_tick', '_every_tick',
+                                         '_failing'])
+        self.assertEqual(stats['_every_tick']['runs'], 3)
+        self.assertEqual(stats['_every_tick']['failures'], 0)
+        self.assertEqual(stats['_every_tick']['histogram']['<=0.1'], 3)
+        self.assertEqual(stats['_failing']['runs'], 3)
+        self.assertEqual(stats['_failing']['failures'], 3)
+        self.assertTrue('last_run' in stats['_every_third_tick'])
+
+    def test_start_periodic_tasks(self):
+        started = {}
+
+        class FakeTimer(object):
+            def __init__(self, f, context, task_name, task, spacing):
+                self.task_name = task_name
+
+            def start(self, interval, initial_delay):
+                started[self.task_name] = (interval, initial_delay)
+
+        self.stubs.Set(manager.utils, 'FixedIntervalLoopingCall', FakeTimer)
+        mgr = PeriodicTaskManager()
+        timers = mgr.start_periodic_tasks(60)
+        self.assertEqual(len(timers), 3)
+        self.assertEqual(started, {'_every_tick': (60, 60),
+                                   '_every_third_tick': (180, 180),
+                                   '_failing': (7, 7)})
+
+        started.clear()
+        mgr.start_periodic_tasks(60, fuzzy_delay=30)
+        for task_name, (interval, initial_delay) in started.iteritems():
+            self.assertTrue(interval - min(interval, 30) <= initial_delay)
+            self.assertTrue(initial_delay <= interval)
+
+    def test_run_periodic_task_overrun(self):
+        now = [100.0]
+
+        def slow_task(mgr, context):
+            now[0] += 10
+
+        self.stubs.Set(manager.time, 'time', lambda: now[0])
+        mgr = PeriodicTaskManager()
+        mgr._run_periodic_task(None, '_slow', slow_task, spacing=5)
+        stats = mgr.periodic_task_stats(None)['_slow']
+        self.assertEqual(stats['overruns'], 1)
+        self.assertEqual(stats['histogram']['<=10'], 1)
+
 
 class TestWSGIService(test.TestCase):
 
@@ -529,6 +529,96 @@ class ToPrimitiveTestCase(test.TestCase):
         self.assertTrue(ret[1].startswith('<function foo at 0x'))
         self.assertEquals(ret[2], '<built-in function dir>')
 
+    def test_level_cutoff(self):
+        class MysteryClass(object):
+            def __init__(self, child=None):
+                self.a = 1
+                self.child = child
+
+        x = MysteryClass(MysteryClass(MysteryClass(MysteryClass())))
+        ret = utils.to_primitive(x, convert_instances=True)
+        self.assertEquals(ret['child']['child']['a'], 1)
+        self.assertEquals(ret['child']['child']['child'], '?')
+        self.assertEquals(utils.to_primitive(1, level=4), '?')
+
+    def test_dict_subclass(self):
+        class IterKeysDict(dict):
+            def __iter__(self):
+                return iter(['fake'])
+
+        x = IterKeysDict(a=1)
+        self.assertEquals(utils.to_primitive(x), dict(a=1))
+
+    def test_model(self):
+        class Model(object):
+            def __init__(self, **kwargs):
+                self.values = kwargs
+
+            def iteritems(self):
+                return self.values.iteritems()
+
+        created_at = datetime.datetime(2012, 1, 2, 3, 4, 5)
+        for i in xrange(2):
+            x = Model(id=i, created_at=created_at, fixed_ips=[Model(id=7)])
+            self.assertEquals(utils.to_primitive(x),
+                              dict(id=i, created_at=str(created_at),
+                                   fixed_ips=[dict(id=7)]))
+        self.assertTrue(Model in utils._PRIMITIVE_MAPPING_TYPES)
+
+    def test_instance_iteritems_not_remembered(self):
+        class MysteryClass(object):
+            pass
+
+        x = MysteryClass()
+        x.iteritems = lambda: iter([('a', 1)])
+        self.assertEquals(utils.to_primitive(x), dict(a=1))
+        self.assertFalse(MysteryClass in utils._PRIMITIVE_MAPPING_TYPES)
+        y = MysteryClass()
+        self.assertEquals(utils.to_primitive(y), y)
+
+    def test_mock(self):
+        x = self.mox.CreateMockAnything()
+        self.assertEquals(utils.to_primitive([x]), ['mock'])
+
+
+class LRUCacheTestCase(test.TestCase):
+    def test_eviction(self):
+        cache = utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('b' in cache)
+        self.assertEqual(list(cache), ['a', 'c'])
+
+    def test_set_existing(self):
+        cache = utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertEqual(list(cache), ['a', 'c'])
+        self.assertEqual(cache['a'], 3)
+
+    def test_pop_and_popitem(self):
+        cache = utils.LRUCache(3)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a', None), None)
+        self.assertRaises(KeyError, cache.pop, 'a')
+        self.assertEqual(cache.popitem(), ('b', 2))
+        self.assertRaises(KeyError, cache.popitem)
+        self.assertEqual(cache.get('b'), None)
+
+    def test_clear(self):
+        cache = utils.LRUCache(3)
+        cache['a'] = 1
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(list(cache), [])
+
 
 class MonkeyPatchTestCase(test.TestCase):
     """Unit test for utils.monkey_patch()."""
@@ -1186,3 +1276,32 @@ class AuditPeriodTest(test.TestCase):
                                            day=1,
                                            month=6,
                                            year=2011))
+
+
+class FixedIntervalLoopingCallTestCase(test.TestCase):
+    def test_runs_at_fixed_intervals(self):
+        now = [100.0]
+        sleeps = []
+        calls = []
+        durations = [1, 3, 12, 0]
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        def f():
+            calls.append(now[0])
+            now[0] += durations[len(calls) - 1]
+            if len(calls) == 4:
+                raise utils.LoopingCallDone()
+
+        self.stubs.Set(utils.time, 'time', lambda: now[0])
+        self.stubs.Set(utils.greenthread, 'sleep', fake_sleep)
+        timer = utils.FixedIntervalLoopingCall(f)
+        timer.start(interval=10, initial_delay=5)
+        timer.wait()
+
+        # the third call overran its interval, so the run due at 130 is
+        # skipped
+        self.assertEqual(calls, [105.0, 115.0, 125.0, 145.0])
+        self.assertEqual(sleeps, [5, 9.0, 7.0, 8.0])
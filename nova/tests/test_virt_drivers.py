@@ -16,15 +16,22 @@
 
 import base64
 import netaddr
+import Queue
 import sys
 import traceback
 
+from eventlet import greenthread
+from eventlet import timeout
+
+from nova.compute import power_state
 from nova import exception
 from nova import flags
 from nova import image
 from nova import log as logging
 from nova import test
 from nova.tests import utils as test_utils
+from nova import utils
+from nova.virt import driver
 
 libvirt = None
 FLAGS = flags.FLAGS
@@ -258,6 +265,53 @@ class _VirtDriverTestCase(test.TestCase):
                           self.connection.get_info,
                           {'name': 'I just made this name up'})
 
+    @catch_notimplementederror
+    def test_get_info_bulk(self):
+        instance_ref, network_info = self._get_running_instance()
+        unknown = {'name': 'I just made this name up'}
+        infos = self.connection.get_info_bulk([instance_ref, unknown])
+        self.assertEqual(infos.keys(), [instance_ref['name']])
+        self.assertEqual(infos[instance_ref['name']],
+                         self.connection.get_info(instance_ref))
+
+    def test_emit_event_wakes_waiter(self):
+        lifecycle_event = driver.LifecycleEvent('instance-00000001',
+                                                power_state.RUNNING)
+        received = []
+        self.connection.register_event_listener(received.append)
+        greenthread.spawn_n(self.connection.emit_event, lifecycle_event)
+        self.assertEqual(self.connection.wait_for_event('instance-00000001',
+                                                        5),
+                         lifecycle_event)
+        self.assertEqual(received, [lifecycle_event])
+
+    def test_wait_for_event_timeout(self):
+        self.assertEqual(self.connection.wait_for_event('instance-00000001',
+                                                        0.01),
+                         None)
+
+    def test_poll_power_state_sees_event_emitted_while_polling(self):
+        self.flags(hypervisor_event_poll_interval=60)
+        self.connection._events_started = True
+        instance = {'name': 'instance-00000001'}
+        polls = []
+
+        def poll():
+            polls.append(None)
+            if len(polls) == 1:
+                self.connection.emit_event(driver.LifecycleEvent(
+                        instance['name'], power_state.RUNNING))
+            else:
+                raise utils.LoopingCallDone(True)
+
+        done = self.connection._poll_power_state(instance, poll)
+        result = None
+        with timeout.Timeout(5, False):
+            result = done.wait()
+        self.assertEqual(result, True)
+        self.assertEqual(len(polls), 2)
+        self.assertEqual(self.connection._event_waiters, {})
+
     @catch_notimplementederror
     def test_get_diagnostics(self):
         instance_ref, network_info = self._get_running_instance()
@@ -476,6 +530,37 @@ class LibvirtConnTestCase(_VirtDriverTestCase):
             nova.virt.libvirt.firewall.libvirt = self.saved_libvirt
         super(LibvirtConnTestCase, self).tearDown()
 
+    def test_lifecycle_event_callback(self):
+        import fakelibvirt
+
+        class FakePipe(object):
+            def __init__(self):
+                self.data = ''
+
+            def write(self, data):
+                self.data += data
+
+            def flush(self):
+                pass
+
+        class FakeDomain(object):
+            def name(self):
+                return 'instance-00000001'
+
+        self.connection._event_queue = Queue.Queue()
+        self.connection._event_notify_send = FakePipe()
+        callback = self.connection._lifecycle_event_callback
+        callback(None, FakeDomain(), fakelibvirt.VIR_DOMAIN_EVENT_DEFINED,
+                 0, self.connection)
+        callback(None, FakeDomain(), fakelibvirt.VIR_DOMAIN_EVENT_STOPPED,
+                 0, self.connection)
+
+        lifecycle_event = self.connection._event_queue.get(block=False)
+        self.assertEqual(lifecycle_event.name, 'instance-00000001')
+        self.assertEqual(lifecycle_event.state, power_state.SHUTOFF)
+        self.assertTrue(self.connection._event_queue.empty())
+        self.assertEqual(self.connection._event_notify_send.data, ' ')
+
     def test_force_hard_reboot(self):
         self.flags(libvirt_wait_soft_reboot_seconds=0)
         self.test_reboot()
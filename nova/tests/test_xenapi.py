@@ -244,6 +244,190 @@ class XenAPIVMTestCase(test.TestCase):
         instances = self.conn.list_instances()
         self.assertEquals(instances, [])
 
+    def test_process_vm_events(self):
+        def vm_rec(name_label, state, **kwargs):
+            rec = {'name_label': name_label, 'power_state': state,
+                   'is_a_template': False, 'is_control_domain': False}
+            rec.update(kwargs)
+            return rec
+
+        results = {
+            '': {'token': '1', 'events': [
+                {'operation': 'add', 'ref': 'vm1',
+                 'snapshot': vm_rec('instance-1', 'Running')},
+                {'operation': 'add', 'ref': 'vm2',
+                 'snapshot': vm_rec('instance-2', 'Halted')},
+                {'operation': 'add', 'ref': 'dom0',
+                 'snapshot': vm_rec('dom0', 'Running',
+                                    is_control_domain=True)}]},
+            '1': {'token': '2', 'events': [
+                {'operation': 'mod', 'ref': 'vm1',
+                 'snapshot': vm_rec('instance-1', 'Running')},
+                {'operation': 'mod', 'ref': 'vm2',
+                 'snapshot': vm_rec('instance-2', 'Running')},
+                {'operation': 'del', 'ref': 'vm1'}]}}
+
+        def fake_call_xenapi(method, classes, token, timeout):
+            self.assertEqual(method, 'event.from')
+            self.assertEqual(classes, ['vm'])
+            return results[token]
+
+        self.stubs.Set(self.conn._session, 'call_xenapi', fake_call_xenapi)
+        received = []
+        self.conn.register_event_listener(received.append)
+        self.conn._vm_states = {}
+
+        self.assertEqual(self.conn._process_vm_events('', 0.0), '1')
+        self.assertEqual([(e.name, e.state) for e in received],
+                         [('instance-1', power_state.RUNNING),
+                          ('instance-2', power_state.SHUTDOWN)])
+
+        received[:] = []
+        self.assertEqual(self.conn._process_vm_events('1', 30.0), '2')
+        self.assertEqual([(e.name, e.state) for e in received],
+                         [('instance-2', power_state.RUNNING),
+                          ('instance-1', power_state.NOSTATE)])
+
+    def _count_xenapi_calls(self):
+        session = self.conn._session
+        calls = []
+        call_xenapi = session._call_xenapi
+
+        def fake_call_xenapi(method, *args):
+            calls.append(method)
+            return call_xenapi(method, *args)
+
+        self.stubs.Set(session, '_call_xenapi', fake_call_xenapi)
+        return calls
+
+    def test_record_cache(self):
+        session = self.conn._session
+        vm_ref = xenapi_fake.create_vm('foo', 'Running')
+        calls = self._count_xenapi_calls()
+
+        with session.record_cache():
+            session.call_xenapi('VM.get_all_records')
+            session.call_xenapi('VM.get_record', vm_ref)
+            with session.record_cache():
+                session.call_xenapi('VM.get_record', vm_ref)
+            session.call_xenapi('VM.get_record', vm_ref)
+            self.assertEqual(calls, ['VM.get_all_records'])
+
+            # a call changing state empties the cache
+            session.call_xenapi('VM.clean_reboot', vm_ref)
+            session.call_xenapi('VM.get_record', vm_ref)
+            session.call_xenapi('VM.get_record', vm_ref)
+            self.assertEqual(calls, ['VM.get_all_records', 'VM.clean_reboot',
+                                     'VM.get_record'])
+
+        session.call_xenapi('VM.get_record', vm_ref)
+        self.assertEqual(len(calls), 4)
+
+    def test_lookup_vm_vdis(self):
+        session = self.conn._session
+        vm_ref = xenapi_fake.create_vm('foo', 'Running')
+        sr_ref = xenapi_fake.create_sr(name_label='sr', type='lvm')
+        vdi_refs = [xenapi_fake.create_vdi('vdi-%d' % i, False, sr_ref,
+                                           False)
+                    for i in xrange(3)]
+        for vdi_ref in vdi_refs[:2]:
+            xenapi_fake.create_vbd(vm_ref, vdi_ref)
+        # an empty CD drive
+        xenapi_fake._create_object('VBD', {'VM': vm_ref,
+                                           'VDI': 'OpaqueRef:NULL',
+                                           'userdevice': '3'})
+        calls = self._count_xenapi_calls()
+
+        found = vm_utils.VMHelper.lookup_vm_vdis(session, vm_ref)
+        self.assertEqual(sorted(found), sorted(vdi_refs[:2]))
+        self.assertEqual(calls, ['VBD.get_all_records_where',
+                                 'VDI.get_all_records_where'])
+
+        other_vm_ref = xenapi_fake.create_vm('bar', 'Running')
+        self.assertEqual(vm_utils.VMHelper.lookup_vm_vdis(session,
+                                                          other_vm_ref),
+                         None)
+
+    def test_list_vms(self):
+        session = self.conn._session
+        host_ref = session.get_xenapi_host()
+        vm_ref = xenapi_fake.create_vm('foo', 'Running', host_ref=host_ref)
+        xenapi_fake.create_vm('halted', 'Halted')
+        xenapi_fake.create_vm('template', 'Halted', is_a_template=True,
+                              host_ref=host_ref)
+        calls = self._count_xenapi_calls()
+
+        vms = dict(vm_utils.VMHelper.list_vms(session))
+        self.assertEqual(vms.keys(), [vm_ref])
+        self.assertEqual(calls, ['VM.get_all_records_where'])
+
+    def test_call_plugin_async(self):
+        session = self.conn._session
+        calls = self._count_xenapi_calls()
+
+        result = session.call_plugin('agent', 'version', {})
+        self.assertEqual(result, xenapi_fake.as_json(returncode='0',
+                                                     message='1.0'))
+        self.assertEqual(calls, ['task.get_status', 'task.get_result',
+                                 'task.destroy'])
+        self.assertEqual(xenapi_fake.get_all('task'), [])
+        stats = session.get_stats()['calls']['plugin agent.version']
+        self.assertEqual(stats['count'], 1)
+
+    def test_call_plugin_async_backs_off(self):
+        session = self.conn._session
+        call_xenapi = session._call_xenapi
+        pending = [5]
+        sleeps = []
+
+        def fake_call_xenapi(method, *args):
+            if method == 'task.get_status' and pending[0]:
+                pending[0] -= 1
+                return 'pending'
+            return call_xenapi(method, *args)
+
+        self.stubs.Set(session, '_call_xenapi', fake_call_xenapi)
+        self.stubs.Set(xenapi_conn.greenthread, 'sleep', sleeps.append)
+        self.flags(xenapi_task_poll_interval=0.3)
+
+        session.call_plugin('agent', 'version', {})
+        self.assertEqual(sleeps, [0.05, 0.1, 0.2, 0.3, 0.3])
+
+    def test_call_plugin_async_failure(self):
+        def fake_call_plugin(*args):
+            raise xenapi_fake.Failure(['XENAPI_PLUGIN_EXCEPTION', 'version',
+                                       'Failure', "['AGENT_ERROR', 'boom']"])
+
+        self.stubs.Set(stubs.FakeSessionForVMTests, 'host_call_plugin',
+                       fake_call_plugin)
+        session = self.conn._session
+        try:
+            session.call_plugin('agent', 'version', {})
+            self.fail('call_plugin should have raised')
+        except xenapi_fake.Failure, exc:
+            self.assertEqual(exc.details, ['AGENT_ERROR', 'boom'])
+        self.assertEqual(xenapi_fake.get_all('task'), [])
+
+    def test_plugin_calls_use_long_call_sessions(self):
+        self.flags(xenapi_async_plugin_calls=False)
+        session = self.conn._session
+        self.assertEqual(session.get_stats()['lanes'],
+                         {'short': dict(size=5, free=5, waiting=0),
+                          'long': dict(size=2, free=2, waiting=0)})
+        host_ref = session.get_xenapi_host()
+        self.stubs.Set(session, 'get_xenapi_host', lambda: host_ref)
+
+        # short calls holding every session do not block plugin calls
+        short_sessions = session._lanes['short']
+        held = [short_sessions.get() for i in xrange(5)]
+        try:
+            session.call_plugin('agent', 'version', {})
+        finally:
+            for held_session in held:
+                short_sessions.put(held_session)
+        stats = session.get_stats()['calls']['plugin agent.version']
+        self.assertEqual(stats['count'], 1)
+
     def test_get_rrd_server(self):
         self.flags(xenapi_connection_url='myscheme://myaddress/')
         server_info = vm_utils.get_rrd_server()
@@ -252,7 +436,8 @@ class XenAPIVMTestCase(test.TestCase):
 
     def test_get_diagnostics(self):
         def fake_get_rrd(host, vm_uuid):
-            with open('xenapi/vm_rrd.xml') as f:
+            with open(os.path.join(os.path.dirname(__file__),
+                                   'xenapi', 'vm_rrd.xml')) as f:
                 return re.sub(r'\s', '', f.read())
         self.stubs.Set(vm_utils, 'get_rrd', fake_get_rrd)
 
@@ -332,6 +517,8 @@ class XenAPIVMTestCase(test.TestCase):
 
         # Get Nova record for VM
         vm_info = conn.get_info({'name': instance_id})
+        vm_infos = conn.get_info_bulk([{'name': str(instance_id)}])
+        self.assertEquals(vm_infos, {str(instance_id): vm_info})
         # Get XenAPI record for VM
         vms = [rec for ref, rec
                in xenapi_fake.get_all_records('VM').iteritems()
@@ -1368,6 +1555,100 @@ class XenAPIBWUsageTestCase(test.TestCase):
         self.assertEqual(result, [])
 
 
+class XenAPIRRDTestCase(test.TestCase):
+    def _rrd_updates(self):
+        with open(os.path.join(os.path.dirname(__file__),
+                               'xenapi', 'vm_rrd_updates.xml')) as f:
+            return f.read()
+
+    def test_parse_rrd_update(self):
+        metrics = vm_utils.parse_rrd_update(self._rrd_updates(), 985)
+        # Infinity and NaN are left out of averages, and NaN counts as 0
+        # when integrating
+        self.assertEqual(metrics, {
+            'aaaa': {'cpu0': 0.3, 'vif_0_tx': 250.0},
+            'bbbb': {'cpu0': 1.5, 'vif_0_rx': 1000.0},
+        })
+
+    def test_parse_rrd_update_until(self):
+        metrics = vm_utils.parse_rrd_update(self._rrd_updates(), 985, 995)
+        self.assertEqual(metrics, {
+            'aaaa': {'cpu0': 0.1, 'vif_0_tx': 125.0},
+            'bbbb': {'cpu0': 1.5, 'vif_0_rx': 750.0},
+        })
+
+    def test_parse_rrd_update_no_rows(self):
+        xml = ('<xport><meta><legend><entry>AVERAGE:vm:aaaa:cpu0</entry>'
+               '<entry>AVERAGE:vm:aaaa:vif_0_tx</entry></legend></meta>'
+               '<data></data></xport>')
+        metrics = vm_utils.parse_rrd_update(xml, 985)
+        self.assertEqual(metrics, {'aaaa': {'cpu0': 0.0, 'vif_0_tx': 0.0}})
+
+
+class XenAPISparseCopyTestCase(test.TestCase):
+    def _make_file(self, path, size, chunks):
+        with open(path, 'wb') as f:
+            for offset, data in chunks:
+                f.seek(offset)
+                f.write(data)
+            f.truncate(size)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _check_sparse_copy(self):
+        size = 4 * 4096 + 100
+        with utils.tempdir() as tmpdir:
+            src_path = os.path.join(tmpdir, 'src')
+            dst_path = os.path.join(tmpdir, 'dst')
+            self._make_file(src_path, size, [(4096 + 5, 'x' * 10),
+                                             (4 * 4096, 'y' * 100)])
+            self._make_file(dst_path, 0, [])
+            written, skipped = vm_utils._sparse_copy(src_path, dst_path,
+                                                     size, block_size=4096)
+            self.assertEqual(self._read(dst_path), self._read(src_path))
+        self.assertEqual(written, 4096 + 100)
+        self.assertEqual(skipped, size - written)
+
+    def test_sparse_copy(self):
+        self._check_sparse_copy()
+
+    def test_sparse_copy_without_seek_data(self):
+        self.stubs.Set(vm_utils, 'SEEK_DATA', None)
+        self._check_sparse_copy()
+
+    def test_sparse_copy_extends_trailing_zeros(self):
+        with utils.tempdir() as tmpdir:
+            src_path = os.path.join(tmpdir, 'src')
+            dst_path = os.path.join(tmpdir, 'dst')
+            self._make_file(src_path, 3 * 4096, [(0, 'x' * 4096)])
+            self._make_file(dst_path, 0, [])
+            # Only the first two blocks are copied
+            written, skipped = vm_utils._sparse_copy(src_path, dst_path,
+                                                     2 * 4096,
+                                                     block_size=4096)
+            self.assertEqual(self._read(dst_path),
+                             'x' * 4096 + '\0' * 4096)
+        self.assertEqual((written, skipped), (4096, 4096))
+
+    def test_stream_disk_skips_zeros(self):
+        with utils.tempdir() as tmpdir:
+            dev_path = os.path.join(tmpdir, 'dev')
+            self._make_file(dev_path, 0, [])
+            self.stubs.Set(utils, 'make_dev_path', lambda dev: dev_path)
+            stats = []
+            self.stubs.Set(vm_utils, '_log_copy_stats',
+                           lambda name, start, *args: stats.append(args))
+
+            image = ['a' * 10, '\0' * 20, 'b' * 10]
+            vm_utils._stream_disk('xvdb', vm_utils.ImageType.DISK_RAW,
+                                  40, image)
+            self.assertEqual(self._read(dev_path),
+                             'a' * 10 + '\0' * 20 + 'b' * 10)
+        self.assertEqual(stats, [(20, 20)])
+
+
 # TODO(salvatore-orlando): this class and
 # nova.tests.test_libvirt.IPTablesFirewallDriverTestCase share a lot of code.
 # Consider abstracting common code in a base class for firewall driver testing.
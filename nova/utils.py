@@ -722,6 +722,49 @@ class LoopingCall(object):
         return self.done.wait()
 
 
+class FixedIntervalLoopingCall(LoopingCall):
+    """A LoopingCall calling f at fixed wall-clock intervals.
+
+    The time f takes is not added to the interval. When a call runs past
+    the time the next one was due, the calls missed meanwhile are skipped
+    rather than made back to back.
+    """
+
+    def start(self, interval, initial_delay=None):
+        self._running = True
+        done = event.Event()
+
+        def _inner():
+            if initial_delay:
+                greenthread.sleep(initial_delay)
+            next_run = time.time()
+            try:
+                while self._running:
+                    self.f(*self.args, **self.kw)
+                    if not self._running:
+                        break
+                    next_run += interval
+                    now = time.time()
+                    if next_run < now:
+                        next_run += (int((now - next_run) / interval) + 1) * \
+                                    interval
+                    greenthread.sleep(next_run - now)
+            except LoopingCallDone, e:
+                self.stop()
+                done.send(e.retvalue)
+            except Exception:
+                LOG.exception(_('in fixed interval looping call'))
+                done.send_exception(*sys.exc_info())
+                return
+            else:
+                done.send(True)
+
+        self.done = done
+
+        greenthread.spawn(_inner)
+        return self.done
+
+
 def xhtml_escape(value):
     """Escapes a string so it is valid within XML or XHTML.
 
@@ -742,6 +785,50 @@ def utf8(value):
     return value
 
 
+def _primitive_value(value, convert_instances, level):
+    return value
+
+
+def _primitive_list(value, convert_instances, level):
+    return [to_primitive(v, convert_instances=convert_instances, level=level)
+            for v in value]
+
+
+def _primitive_dict(value, convert_instances, level):
+    o = {}
+    for k, v in value.iteritems():
+        o[k] = to_primitive(v, convert_instances=convert_instances,
+                            level=level)
+    return o
+
+
+def _primitive_datetime(value, convert_instances, level):
+    return str(value)
+
+
+# Converters for the types that make up nearly every RPC message and
+# notification payload, keyed on the exact type so that subclasses
+# (which may override iteration) still get the full inspection.
+_PRIMITIVE_CONVERTERS = {
+    str: _primitive_value,
+    unicode: _primitive_value,
+    int: _primitive_value,
+    long: _primitive_value,
+    float: _primitive_value,
+    bool: _primitive_value,
+    type(None): _primitive_value,
+    list: _primitive_list,
+    tuple: _primitive_list,
+    dict: _primitive_dict,
+    datetime.datetime: _primitive_datetime,
+}
+
+# Classes found to expose iteritems() (database models, mostly). They
+# are recorded the first time to_primitive() inspects one of them so
+# later instances can skip the inspection.
+_PRIMITIVE_MAPPING_TYPES = set()
+
+
 def to_primitive(value, convert_instances=False, level=0):
     """Convert a complex object into primitives.
 
@@ -756,6 +843,24 @@ def to_primitive(value, convert_instances=False, level=0):
     Therefore, convert_instances=True is lossy ... be aware.
 
     """
+    value_type = type(value)
+    converter = _PRIMITIVE_CONVERTERS.get(value_type)
+    if converter is not None:
+        if level > 3:
+            return '?'
+        return converter(value, convert_instances, level)
+
+    if value_type in _PRIMITIVE_MAPPING_TYPES:
+        if getattr(value, '__module__', None) == 'mox':
+            return 'mock'
+        if level > 3:
+            return '?'
+        try:
+            return _primitive_dict(dict(value.iteritems()),
+                                   convert_instances, level)
+        except TypeError:
+            return unicode(value)
+
     nasty = [inspect.ismodule, inspect.isclass, inspect.ismethod,
              inspect.isfunction, inspect.isgeneratorfunction,
              inspect.isgenerator, inspect.istraceback, inspect.isframe,
@@ -799,6 +904,11 @@ def to_primitive(value, convert_instances=False, level=0):
         elif isinstance(value, datetime.datetime):
             return str(value)
         elif hasattr(value, 'iteritems'):
+            # Only remember classes that define iteritems() themselves;
+            # old-style instances all share a single type.
+            if (value_type is not types.InstanceType and
+                hasattr(value_type, 'iteritems')):
+                _PRIMITIVE_MAPPING_TYPES.add(value_type)
             return to_primitive(dict(value.iteritems()),
                                 convert_instances=convert_instances,
                                 level=level)
@@ -1712,3 +1822,98 @@ class UndoManager(object):
                 LOG.exception(msg)
 
             self._rollback()
+
+
+class LRUCache(object):
+    """A dict-like container holding at most max_size items.
+
+    Storing an item beyond max_size evicts the least recently used
+    one.  Lookups and stores are O(1): items are kept in a circular
+    doubly linked list, most recently used at the back.
+    """
+
+    # Indexes into the [prev, next, key, value] link lists
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        """Checks for a key without marking it as used."""
+        return key in self._map
+
+    def __iter__(self):
+        """Iterates over the keys, least recently used first."""
+        root = self._root
+        link = root[self.NEXT]
+        while link is not root:
+            yield link[self.KEY]
+            link = link[self.NEXT]
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _append(self, link):
+        root = self._root
+        last = root[self.PREV]
+        link[self.PREV] = last
+        link[self.NEXT] = root
+        last[self.NEXT] = root[self.PREV] = link
+
+    def __getitem__(self, key):
+        link = self._map[key]
+        self._unlink(link)
+        self._append(link)
+        return link[self.VALUE]
+
+    def __setitem__(self, key, value):
+        link = self._map.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[self.VALUE] = value
+        else:
+            link = [None, None, key, value]
+            self._map[key] = link
+        self._append(link)
+
+        while len(self._map) > self.max_size:
+            self.popitem()
+
+    def __delitem__(self, key):
+        self._unlink(self._map.pop(key))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            link = self._map.pop(key)
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self._unlink(link)
+        return link[self.VALUE]
+
+    def popitem(self):
+        """Removes and returns the least recently used (key, value)."""
+        link = self._root[self.NEXT]
+        if link is self._root:
+            raise KeyError('popitem(): cache is empty')
+        del self[link[self.KEY]]
+        return link[self.KEY], link[self.VALUE]
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
@@ -22,15 +22,30 @@ Driver base-classes:
     types that support that contract
 """
 
+from eventlet import event
+from eventlet import timeout
+
 from nova import context as nova_context
 from nova import db
+from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.compute import power_state
+from nova.openstack.common import cfg
+from nova import utils
+
 
+driver_opts = [
+    cfg.FloatOpt('hypervisor_event_poll_interval',
+                 default=5.0,
+                 help='Number of seconds between polls of the state of an '
+                      'instance being waited on, when the driver reports '
+                      'lifecycle events and polling is only a safety net'),
+    ]
 
 LOG = logging.getLogger(__name__)
 FLAGS = flags.FLAGS
+FLAGS.register_opts(driver_opts)
 
 
 class InstanceInfo(object):
@@ -40,6 +55,21 @@ class InstanceInfo(object):
         self.state = state
 
 
+class LifecycleEvent(object):
+    """The power state of an instance changed on the hypervisor.
+
+    An instance that went away is reported with power_state.NOSTATE.
+    """
+
+    def __init__(self, name, state):
+        self.name = name
+        self.state = state
+
+    def __repr__(self):
+        return '<LifecycleEvent %s: %s>' % (self.name,
+                                            power_state.name(self.state))
+
+
 def block_device_info_get_root(block_device_info):
     block_device_info = block_device_info or {}
     return block_device_info.get('root_device_name')
@@ -122,6 +152,126 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_info_bulk(self, instances):
+        """Get the current status of several instances at once.
+
+        Returns a dict mapping the name of each of the given instances
+        known by the hypervisor to the dict get_info() would return for
+        it. Instances the hypervisor does not know about are left out.
+
+        .. note::
+
+            This implementation works for all drivers, but it is
+            not particularly efficient. Maintainers of the virt drivers are
+            encouraged to override this method with something that reads
+            the state of all the VMs in a single call.
+        """
+        infos = {}
+        for instance in instances:
+            try:
+                infos[instance['name']] = self.get_info(instance)
+            except exception.InstanceNotFound:
+                pass
+        return infos
+
+    def register_event_listener(self, callback):
+        """Register a callback to receive instance lifecycle events.
+
+        callback is called from a greenthread with a LifecycleEvent each
+        time the hypervisor reports an instance changing power state.
+        """
+        self._event_callback = callback
+
+    def start_event_monitor(self):
+        """Start watching the hypervisor for instance lifecycle events.
+
+        Returns True if the driver will emit LifecycleEvents from now on,
+        False if it does not support them, in which case callers have to
+        keep polling get_info().
+        """
+        return False
+
+    def emit_event(self, lifecycle_event):
+        """Deliver a LifecycleEvent to the listener and to any waiters."""
+        waiters = getattr(self, '_event_waiters', {})
+        for waiter in waiters.pop(lifecycle_event.name, []):
+            waiter.send(lifecycle_event)
+
+        callback = getattr(self, '_event_callback', None)
+        if callback is None:
+            return
+        try:
+            callback(lifecycle_event)
+        except Exception:
+            LOG.exception(_("Error handling lifecycle event %s"),
+                          lifecycle_event)
+
+    def add_event_waiter(self, instance_name):
+        """Start collecting the next LifecycleEvent of an instance.
+
+        Returns the waiter to pass to wait_for_event(), so that an event
+        emitted in between is not missed.
+        """
+        if not hasattr(self, '_event_waiters'):
+            self._event_waiters = {}
+        waiter = event.Event()
+        self._event_waiters.setdefault(instance_name, []).append(waiter)
+        return waiter
+
+    def remove_event_waiter(self, instance_name, waiter):
+        """Forget a waiter returned by add_event_waiter()."""
+        waiters = getattr(self, '_event_waiters', {}).get(instance_name)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self._event_waiters[instance_name]
+
+    def wait_for_event(self, instance_name, wait_timeout, waiter=None):
+        """Wait for the next LifecycleEvent of an instance.
+
+        waiter is one returned by add_event_waiter(), a new one is added
+        if it is None. Returns the event, or None if none arrived within
+        wait_timeout seconds.
+        """
+        if waiter is None:
+            waiter = self.add_event_waiter(instance_name)
+        with timeout.Timeout(wait_timeout, False):
+            return waiter.wait()
+
+        self.remove_event_waiter(instance_name, waiter)
+        return None
+
+    def _poll_power_state(self, instance, poll):
+        """Call poll until it raises utils.LoopingCallDone.
+
+        poll is called every half a second, unless the driver emits
+        lifecycle events: it then runs each time an event arrives for
+        the instance, and every hypervisor_event_poll_interval seconds
+        in case an event got lost.
+
+        Returns the LoopingCall's done event, as LoopingCall.start() does.
+        """
+        if not getattr(self, '_events_started', False):
+            timer = utils.LoopingCall(poll)
+            return timer.start(interval=0.5, now=True)
+
+        def _poll_and_wait():
+            # The waiter is added first, as poll() may yield while the
+            # event it is waiting for gets emitted
+            waiter = self.add_event_waiter(instance['name'])
+            try:
+                poll()
+            except Exception:
+                with utils.save_and_reraise_exception():
+                    self.remove_event_waiter(instance['name'], waiter)
+            self.wait_for_event(instance['name'],
+                                FLAGS.hypervisor_event_poll_interval,
+                                waiter)
+
+        timer = utils.LoopingCall(_poll_and_wait)
+        return timer.start(interval=0, now=True)
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
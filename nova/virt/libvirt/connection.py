@@ -50,7 +50,10 @@ import sys
 import time
 import uuid
 
+from eventlet import greenio
+from eventlet import greenpool
 from eventlet import greenthread
+from eventlet import patcher
 from eventlet import tpool
 
 from xml.dom import minidom
@@ -74,6 +77,9 @@ from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import utils as libvirt_utils
 
 
+native_threading = patcher.original('threading')
+native_Queue = patcher.original('Queue')
+
 libvirt = None
 Template = None
 
@@ -160,7 +166,24 @@ libvirt_opts = [
     cfg.BoolOpt('libvirt_nonblocking',
                 default=False,
                 help='Use a separated OS thread pool to realize non-blocking'
-                     ' libvirt calls')
+                     ' libvirt calls'),
+    cfg.IntOpt('libvirt_image_prepare_concurrency',
+               default=4,
+               help='Number of images of an instance (kernel, ramdisk, disks,'
+                    ' swap, config drive) prepared concurrently when'
+                    ' spawning it. 1 prepares them one after the other.'),
+    cfg.IntOpt('libvirt_resource_update_max_skips',
+               default=10,
+               help='Number of consecutive times the compute node record'
+                    ' may be left as is because no resource changed. It is'
+                    ' written after that many, so the free memory, free'
+                    ' disk, running VMs and workload derived from the'
+                    ' instances of the host are recomputed.'),
+    cfg.FloatOpt('libvirt_resource_update_threshold',
+                 default=0.01,
+                 help='Fraction of the total memory or disk of the host that'
+                      ' its usage must change by before the compute node'
+                      ' record is updated. 0 updates it on every change.'),
     ]
 
 FLAGS = flags.FLAGS
@@ -202,6 +225,10 @@ class LibvirtConnection(driver.ComputeDriver):
         self._host_state = None
         self._initiator = None
         self._wrapped_conn = None
+        self._cpu_info = None
+        self._vcpus_by_domain_id = {}
+        self._disk_virtual_sizes = {}
+        self._skipped_resource_updates = 0
         self.container = None
         self.read_only = read_only
         if FLAGS.firewall_driver not in firewall.drivers:
@@ -256,6 +283,9 @@ class LibvirtConnection(driver.ComputeDriver):
     def _get_connection(self):
         if not self._wrapped_conn or not self._test_connection():
             LOG.debug(_('Connecting to libvirt: %s'), self.uri)
+            # libvirtd may have been restarted, reusing domain IDs
+            self._cpu_info = None
+            self._vcpus_by_domain_id = {}
             if not FLAGS.libvirt_nonblocking:
                 self._wrapped_conn = self._connect(self.uri,
                                                self.read_only)
@@ -264,6 +294,11 @@ class LibvirtConnection(driver.ComputeDriver):
                     (libvirt.virDomain, libvirt.virConnect),
                     self._connect, self.uri, self.read_only)
 
+            if getattr(self, '_events_started', False):
+                self._wrapped_conn.domainEventRegisterAny(
+                        None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                        self._lifecycle_event_callback, self)
+
         return self._wrapped_conn
 
     _conn = property(_get_connection)
@@ -280,6 +315,70 @@ class LibvirtConnection(driver.ComputeDriver):
                 return False
             raise
 
+    def start_event_monitor(self):
+        """Receive domain lifecycle events from libvirt.
+
+        libvirt runs its event loop, and so the event callbacks, in a
+        native thread. The events are handed over to a greenthread
+        through a queue, with a pipe to wake it up, and emitted from
+        there.
+        """
+        if not hasattr(libvirt, 'virEventRegisterDefaultImpl'):
+            LOG.warn(_("This version of libvirt does not report domain "
+                       "lifecycle events"))
+            return False
+
+        # The event loop implementation has to be registered before the
+        # connection is opened for it to deliver events
+        libvirt.virEventRegisterDefaultImpl()
+        self._event_queue = native_Queue.Queue()
+        rpipe, wpipe = os.pipe()
+        self._event_notify_send = greenio.GreenPipe(wpipe, 'wb', 0)
+        self._event_notify_recv = greenio.GreenPipe(rpipe, 'rb', 0)
+
+        event_thread = native_threading.Thread(target=self._run_event_loop)
+        event_thread.setDaemon(True)
+        event_thread.start()
+        greenthread.spawn_n(self._dispatch_events)
+
+        self._events_started = True
+        self._wrapped_conn = None
+        self._get_connection()
+        return True
+
+    @staticmethod
+    def _run_event_loop():
+        """Run the libvirt event loop. Called in a native thread."""
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    @staticmethod
+    def _lifecycle_event_callback(conn, dom, event, detail, opaque):
+        """Queue a domain lifecycle event. Called in a native thread."""
+        state = {libvirt.VIR_DOMAIN_EVENT_STARTED: power_state.RUNNING,
+                 libvirt.VIR_DOMAIN_EVENT_RESUMED: power_state.RUNNING,
+                 libvirt.VIR_DOMAIN_EVENT_SUSPENDED: power_state.PAUSED,
+                 libvirt.VIR_DOMAIN_EVENT_STOPPED: power_state.SHUTOFF,
+                 libvirt.VIR_DOMAIN_EVENT_UNDEFINED: power_state.NOSTATE,
+                 }.get(event)
+        if state is None:
+            return
+        self = opaque
+        self._event_queue.put(driver.LifecycleEvent(dom.name(), state))
+        self._event_notify_send.write(' ')
+        self._event_notify_send.flush()
+
+    def _dispatch_events(self):
+        """Emit the queued lifecycle events as they arrive."""
+        while True:
+            self._event_notify_recv.read(1)
+            while True:
+                try:
+                    lifecycle_event = self._event_queue.get(block=False)
+                except native_Queue.Empty:
+                    break
+                self.emit_event(lifecycle_event)
+
     @property
     def uri(self):
         if FLAGS.libvirt_type == 'uml':
@@ -417,8 +516,7 @@ class LibvirtConnection(driver.ComputeDriver):
                          instance=instance)
                 raise utils.LoopingCallDone
 
-        timer = utils.LoopingCall(_wait_for_destroy)
-        timer.start(interval=0.5, now=True)
+        self._poll_power_state(instance, _wait_for_destroy)
 
         try:
             self.firewall_driver.unfilter_instance(instance,
@@ -457,6 +555,7 @@ class LibvirtConnection(driver.ComputeDriver):
             disk.destroy_container(self.container)
         if os.path.exists(target):
             shutil.rmtree(target)
+        self._forget_disk_sizes(instance)
 
     def get_volume_connector(self, instance):
         if not self._initiator:
@@ -714,8 +813,8 @@ class LibvirtConnection(driver.ComputeDriver):
                 LOG.info(_("Instance shutdown successfully."),
                          instance=instance)
                 dom.create()
-                timer = utils.LoopingCall(self._wait_for_running, instance)
-                return timer.start(interval=0.5, now=True)
+                return self._poll_power_state(
+                        instance, lambda: self._wait_for_running(instance))
             greenthread.sleep(1)
         return False
 
@@ -756,8 +855,7 @@ class LibvirtConnection(driver.ComputeDriver):
                          instance=instance)
                 raise utils.LoopingCallDone
 
-        timer = utils.LoopingCall(_wait_for_reboot)
-        return timer.start(interval=0.5, now=True)
+        return self._poll_power_state(instance, _wait_for_reboot)
 
     @exception.wrap_exception()
     def pause(self, instance):
@@ -900,8 +998,7 @@ class LibvirtConnection(driver.ComputeDriver):
                          instance=instance)
                 raise utils.LoopingCallDone
 
-        timer = utils.LoopingCall(_wait_for_boot)
-        return timer.start(interval=0.5, now=True)
+        return self._poll_power_state(instance, _wait_for_boot)
 
     def _flush_libvirt_console(self, pty):
         out, err = utils.execute('dd',
@@ -1110,24 +1207,33 @@ class LibvirtConnection(driver.ComputeDriver):
                            'kernel_id': instance['kernel_id'],
                            'ramdisk_id': instance['ramdisk_id']}
 
+        # The images are independent of each other, so they are only
+        # collected here and then prepared concurrently
+        steps = []
+
+        def prepare(name, method, **kwargs):
+            steps.append((name, functools.partial(method, **kwargs)))
+
         if disk_images['kernel_id']:
             fname = disk_images['kernel_id']
-            self._cache_image(fn=libvirt_utils.fetch_image,
-                              context=context,
-                              target=basepath('kernel'),
-                              fname=fname,
-                              image_id=disk_images['kernel_id'],
-                              user_id=instance['user_id'],
-                              project_id=instance['project_id'])
+            prepare('kernel', self._cache_image,
+                    fn=libvirt_utils.fetch_image,
+                    context=context,
+                    target=basepath('kernel'),
+                    fname=fname,
+                    image_id=disk_images['kernel_id'],
+                    user_id=instance['user_id'],
+                    project_id=instance['project_id'])
             if disk_images['ramdisk_id']:
                 fname = disk_images['ramdisk_id']
-                self._cache_image(fn=libvirt_utils.fetch_image,
-                                  context=context,
-                                  target=basepath('ramdisk'),
-                                  fname=fname,
-                                  image_id=disk_images['ramdisk_id'],
-                                  user_id=instance['user_id'],
-                                  project_id=instance['project_id'])
+                prepare('ramdisk', self._cache_image,
+                        fn=libvirt_utils.fetch_image,
+                        context=context,
+                        target=basepath('ramdisk'),
+                        fname=fname,
+                        image_id=disk_images['ramdisk_id'],
+                        user_id=instance['user_id'],
+                        project_id=instance['project_id'])
 
         root_fname = hashlib.sha1(str(disk_images['image_id'])).hexdigest()
         size = instance['root_gb'] * 1024 * 1024 * 1024
@@ -1139,15 +1245,16 @@ class LibvirtConnection(driver.ComputeDriver):
 
         if not self._volume_in_mapping(self.default_root_device,
                                        block_device_info):
-            self._cache_image(fn=libvirt_utils.fetch_image,
-                              context=context,
-                              target=basepath('disk'),
-                              fname=root_fname,
-                              cow=FLAGS.use_cow_images,
-                              image_id=disk_images['image_id'],
-                              user_id=instance['user_id'],
-                              project_id=instance['project_id'],
-                              size=size)
+            prepare('disk', self._cache_image,
+                    fn=libvirt_utils.fetch_image,
+                    context=context,
+                    target=basepath('disk'),
+                    fname=root_fname,
+                    cow=FLAGS.use_cow_images,
+                    image_id=disk_images['image_id'],
+                    user_id=instance['user_id'],
+                    project_id=instance['project_id'],
+                    size=size)
 
         ephemeral_gb = instance['ephemeral_gb']
         if ephemeral_gb and not self._volume_in_mapping(
@@ -1156,12 +1263,13 @@ class LibvirtConnection(driver.ComputeDriver):
             fn = functools.partial(self._create_ephemeral,
                                    fs_label='ephemeral0',
                                    os_type=instance.os_type)
-            self._cache_image(fn=fn,
-                              target=basepath('disk.local'),
-                              fname="ephemeral_%s_%s_%s" %
-                              ("0", ephemeral_gb, instance.os_type),
-                              cow=FLAGS.use_cow_images,
-                              ephemeral_size=ephemeral_gb)
+            prepare('disk.local', self._cache_image,
+                    fn=fn,
+                    target=basepath('disk.local'),
+                    fname="ephemeral_%s_%s_%s" %
+                    ("0", ephemeral_gb, instance.os_type),
+                    cow=FLAGS.use_cow_images,
+                    ephemeral_size=ephemeral_gb)
         else:
             swap_device = self.default_second_device
 
@@ -1169,12 +1277,13 @@ class LibvirtConnection(driver.ComputeDriver):
             fn = functools.partial(self._create_ephemeral,
                                    fs_label='ephemeral%d' % eph['num'],
                                    os_type=instance.os_type)
-            self._cache_image(fn=fn,
-                              target=basepath(_get_eph_disk(eph)),
-                              fname="ephemeral_%s_%s_%s" %
-                              (eph['num'], eph['size'], instance.os_type),
-                              cow=FLAGS.use_cow_images,
-                              ephemeral_size=eph['size'])
+            prepare(_get_eph_disk(eph), self._cache_image,
+                    fn=fn,
+                    target=basepath(_get_eph_disk(eph)),
+                    fname="ephemeral_%s_%s_%s" %
+                    (eph['num'], eph['size'], instance.os_type),
+                    cow=FLAGS.use_cow_images,
+                    ephemeral_size=eph['size'])
 
         swap_mb = 0
 
@@ -1186,11 +1295,12 @@ class LibvirtConnection(driver.ComputeDriver):
             swap_mb = inst_type['swap']
 
         if swap_mb > 0:
-            self._cache_image(fn=self._create_swap,
-                              target=basepath('disk.swap'),
-                              fname="swap_%s" % swap_mb,
-                              cow=FLAGS.use_cow_images,
-                              swap_mb=swap_mb)
+            prepare('disk.swap', self._cache_image,
+                    fn=self._create_swap,
+                    target=basepath('disk.swap'),
+                    fname="swap_%s" % swap_mb,
+                    cow=FLAGS.use_cow_images,
+                    swap_mb=swap_mb)
 
         # For now, we assume that if we're not using a kernel, we're using a
         # partitioned disk image where the target partition is the first
@@ -1207,16 +1317,24 @@ class LibvirtConnection(driver.ComputeDriver):
 
         if config_drive_id:
             fname = config_drive_id
-            self._cache_image(fn=libvirt_utils.fetch_image,
-                              target=basepath('disk.config'),
-                              fname=fname,
-                              image_id=config_drive_id,
-                              user_id=instance['user_id'],
-                              project_id=instance['project_id'],)
+            prepare('disk.config', self._cache_image,
+                    fn=libvirt_utils.fetch_image,
+                    target=basepath('disk.config'),
+                    fname=fname,
+                    image_id=config_drive_id,
+                    user_id=instance['user_id'],
+                    project_id=instance['project_id'],)
         elif config_drive:
             label = 'config'
-            self._create_local(basepath('disk.config'), 64, unit='M',
-                               fs_format='msdos', label=label)  # 64MB
+            prepare('disk.config', self._create_local,
+                    target=basepath('disk.config'), local_size=64, unit='M',
+                    fs_format='msdos', label=label)  # 64MB
+
+        timings = []
+        try:
+            self._prepare_images(steps, timings)
+        finally:
+            self._record_image_timings(instance, timings)
 
         if instance['key_data']:
             key = str(instance['key_data'])
@@ -1279,6 +1397,8 @@ class LibvirtConnection(driver.ComputeDriver):
                 if locals()[injection]:
                     LOG.info(_('Injecting %(injection)s into image %(img_id)s')
                              % locals(), instance=instance)
+            start_time = time.time()
+            error = None
             try:
                 disk.inject_data(injection_path,
                                  key, net, metadata, admin_password,
@@ -1290,6 +1410,9 @@ class LibvirtConnection(driver.ComputeDriver):
                 LOG.warn(_('Ignoring error injecting data into image '
                            '%(img_id)s (%(e)s)') % locals(),
                          instance=instance)
+                error = unicode(e)
+            self._record_image_timings(instance, [('inject',
+                    time.time() - start_time, error)])
 
         if FLAGS.libvirt_type == 'lxc':
             self.container = disk.setup_container(basepath('disk'),
@@ -1301,8 +1424,68 @@ class LibvirtConnection(driver.ComputeDriver):
 
         files_to_inject = instance.get('injected_files')
         if files_to_inject:
+            start_time = time.time()
             self._inject_files(instance, files_to_inject,
                                partition=target_partition)
+            self._record_image_timings(instance, [('inject_files',
+                    time.time() - start_time, None)])
+
+    @staticmethod
+    def _prepare_images(steps, timings):
+        """Run the steps preparing the images of an instance.
+
+        Up to libvirt_image_prepare_concurrency steps run at a time, each
+        in its own greenthread, so that glance downloads and the qemu-img
+        and mkfs processes they wait on overlap. All the steps are waited
+        for before the first failure is raised, so that no image is still
+        being written while the instance gets cleaned up.
+
+        Appends a (name, seconds, error) tuple to timings for each step.
+        """
+
+        def run_step(name, fn):
+            # Failures are returned rather than raised, as eventlet prints
+            # the traceback of every greenthread dying from an exception
+            start_time = time.time()
+            try:
+                fn()
+            except Exception as e:
+                timings.append((name, time.time() - start_time, unicode(e)))
+                return sys.exc_info()
+            timings.append((name, time.time() - start_time, None))
+
+        concurrency = FLAGS.libvirt_image_prepare_concurrency
+        if concurrency <= 1 or len(steps) <= 1:
+            results = (run_step(name, fn) for name, fn in steps)
+        else:
+            pool = greenpool.GreenPool(concurrency)
+            results = [thread.wait() for thread in
+                       [pool.spawn(run_step, name, fn) for name, fn in steps]]
+        for exc_info in results:
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    @staticmethod
+    def _record_image_timings(instance, timings):
+        """Log how long the steps creating the images of an instance took,
+        and add them to the actions of the instance."""
+
+        if not timings:
+            return
+        LOG.info(_('Image creation times: %s') %
+                 ', '.join('%s %.2fs' % (name, seconds)
+                           for name, seconds, error in timings),
+                 instance=instance)
+        context = nova_context.get_admin_context()
+        for name, seconds, error in timings:
+            try:
+                db.instance_action_create(context,
+                        {'instance_uuid': instance['uuid'],
+                         'action': 'create_image %s %.2fs' % (name, seconds),
+                         'error': error})
+            except Exception:
+                LOG.exception(_('Failed to record the image creation time'),
+                              instance=instance)
 
     @staticmethod
     def _volume_in_mapping(mount_device, block_device_info):
@@ -1484,6 +1667,55 @@ class LibvirtConnection(driver.ComputeDriver):
                 'num_cpu': num_cpu,
                 'cpu_time': cpu_time}
 
+    def _list_all_domains(self):
+        """Return the domain objects for all running and defined domains.
+
+        Uses listAllDomains() when libvirt provides it, which returns
+        every domain in a single call, instead of looking up the
+        running domains by ID and the defined ones by name.
+        """
+        if hasattr(self._conn, 'listAllDomains'):
+            return self._conn.listAllDomains(0)
+
+        domains = []
+        for domain_id in self._conn.listDomainsID():
+            if domain_id == 0:
+                continue  # We skip domains with ID 0 (hypervisors).
+            try:
+                domains.append(self._conn.lookupByID(domain_id))
+            except libvirt.libvirtError as ex:
+                # the domain may have gone away since it was listed
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+        for name in self._conn.listDefinedDomains():
+            try:
+                domains.append(self._conn.lookupByName(name))
+            except libvirt.libvirtError as ex:
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+        return domains
+
+    def get_info_bulk(self, instances):
+        """Efficient override of base get_info_bulk method."""
+        names = set(instance['name'] for instance in instances)
+        infos = {}
+        for virt_dom in self._list_all_domains():
+            try:
+                name = virt_dom.name()
+                if name not in names:
+                    continue
+                (state, max_mem, mem, num_cpu, cpu_time) = virt_dom.info()
+            except libvirt.libvirtError as ex:
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+                continue
+            infos[name] = {'state': state,
+                           'max_mem': max_mem,
+                           'mem': mem,
+                           'num_cpu': num_cpu,
+                           'cpu_time': cpu_time}
+        return infos
+
     def _create_new_domain(self, xml, persistent=True, launch_flags=0):
         # NOTE(justinsb): libvirt has two types of domain:
         # * a transient domain disappears when the guest is shutdown
@@ -1638,38 +1870,59 @@ class LibvirtConnection(driver.ComputeDriver):
     def get_vcpu_used(self):
         """ Get vcpu usage number of physical computer.
 
+        The vcpus of a domain are looked up once, when its ID is first
+        seen: a running domain keeps its vcpus, and a domain that is
+        restarted or resized gets a new ID.
+
         :returns: The total number of vcpu that currently used.
 
         """
 
-        total = 0
+        vcpus_by_domain_id = {}
         for dom_id in self._conn.listDomainsID():
-            dom = self._conn.lookupByID(dom_id)
-            vcpus = dom.vcpus()
+            vcpus = self._vcpus_by_domain_id.get(dom_id)
             if vcpus is None:
-                # dom.vcpus is not implemented for lxc, but returning 0 for
-                # a used count is hardly useful for something measuring usage
-                total += 1
-            else:
-                total += len(vcpus[1])
-        return total
+                dom = self._conn.lookupByID(dom_id)
+                dom_vcpus = dom.vcpus()
+                if dom_vcpus is None:
+                    # dom.vcpus is not implemented for lxc, but returning 0
+                    # for a used count is hardly useful for something
+                    # measuring usage
+                    vcpus = 1
+                else:
+                    vcpus = len(dom_vcpus[1])
+            vcpus_by_domain_id[dom_id] = vcpus
+        self._vcpus_by_domain_id = vcpus_by_domain_id
+        return sum(vcpus_by_domain_id.itervalues())
 
-    def get_memory_mb_used(self):
-        """Get the free memory size(MB) of physical computer.
+    @staticmethod
+    def _get_memory_mb_info():
+        """Get the total and used memory size(MB) of physical computer
+        from a single read of /proc/meminfo.
 
-        :returns: the total usage of memory(MB).
+        :returns: a (total, used) tuple of memory(MB).
 
         """
 
         if sys.platform.upper() not in ['LINUX2', 'LINUX3']:
-            return 0
+            return 0, 0
 
         m = open('/proc/meminfo').read().split()
+        total = int(m[m.index('MemTotal:') + 1]) / 1024
         idx1 = m.index('MemFree:')
         idx2 = m.index('Buffers:')
         idx3 = m.index('Cached:')
         avail = (int(m[idx1 + 1]) + int(m[idx2 + 1]) + int(m[idx3 + 1])) / 1024
-        return  self.get_memory_mb_total() - avail
+        return total, total - avail
+
+    def get_memory_mb_used(self):
+        """Get the free memory size(MB) of physical computer.
+
+        :returns: the total usage of memory(MB).
+
+        """
+
+        return self._get_memory_mb_info()[1]
 
     def get_local_gb_used(self):
         """Get the free hdd size(GB) of physical computer.
@@ -1717,13 +1970,22 @@ class LibvirtConnection(driver.ComputeDriver):
         """Get cpuinfo information.
 
         Obtains cpu feature from virConnect.getCapabilities,
-        and returns as a json string.
+        and returns as a json string. The capabilities are only
+        parsed once per connection to libvirt.
 
         :return: see above description
 
         """
 
-        xml = self._conn.getCapabilities()
+        if self._cpu_info is None:
+            self._cpu_info = self._parse_cpu_info(
+                    self._conn.getCapabilities())
+        return self._cpu_info
+
+    @staticmethod
+    def _parse_cpu_info(xml):
+        """Return the cpuinfo of a capabilities xml as a json string."""
+
         xml = ElementTree.fromstring(xml)
         nodes = xml.findall('.//host/cpu')
         if len(nodes) != 1:
@@ -1816,25 +2078,64 @@ class LibvirtConnection(driver.ComputeDriver):
             raise exception.ComputeServiceUnavailable(host=host)
 
         # Updating host information
+        memory_mb, memory_mb_used = self._get_memory_mb_info()
+        stats = libvirt_utils.get_fs_info(FLAGS.instances_path)
+        local_gb = stats['total'] / (1024 ** 3)
+        local_gb_used = stats['used'] / (1024 ** 3)
         dic = {'vcpus': self.get_vcpu_total(),
-               'memory_mb': self.get_memory_mb_total(),
-               'local_gb': self.get_local_gb_total(),
+               'memory_mb': memory_mb,
+               'local_gb': local_gb,
                'vcpus_used': self.get_vcpu_used(),
-               'memory_mb_used': self.get_memory_mb_used(),
-               'local_gb_used': self.get_local_gb_used(),
+               'memory_mb_used': memory_mb_used,
+               'local_gb_used': local_gb_used,
                'hypervisor_type': self.get_hypervisor_type(),
                'hypervisor_version': self.get_hypervisor_version(),
                'cpu_info': self.get_cpu_info(),
                'service_id': service_ref['id'],
-               'disk_available_least': self.get_disk_available_least()}
+               'disk_available_least': self._get_disk_available_least(
+                       (local_gb - local_gb_used) * (1024 ** 3))}
 
         compute_node_ref = service_ref['compute_node']
         if not compute_node_ref:
             LOG.info(_('Compute_service record created for %s ') % host)
             db.compute_node_create(ctxt, dic)
-        else:
+        elif (self._skipped_resource_updates >=
+              FLAGS.libvirt_resource_update_max_skips or
+              self._resources_changed(compute_node_ref[0], dic)):
+            # NOTE: compute_node_update also recomputes the utilization
+            #       of the host from its instances, which may drift even
+            #       when the resources read here did not change.
             LOG.info(_('Compute_service record updated for %s ') % host)
             db.compute_node_update(ctxt, compute_node_ref[0]['id'], dic)
+            self._skipped_resource_updates = 0
+        else:
+            LOG.debug(_('Compute_service record for %s is up to date') %
+                      host)
+            self._skipped_resource_updates += 1
+
+    @staticmethod
+    def _resources_changed(compute_node, resources):
+        """Tell whether resources differ from a compute node record.
+
+        Memory and disk usage fluctuate all the time, so they only count
+        as changed when they moved by more than
+        libvirt_resource_update_threshold of the total.
+        """
+
+        totals = {'memory_mb_used': 'memory_mb',
+                  'local_gb_used': 'local_gb',
+                  'disk_available_least': 'local_gb'}
+        threshold = FLAGS.libvirt_resource_update_threshold
+        for key, value in resources.iteritems():
+            old_value = compute_node[key]
+            if (key in totals and value is not None and
+                old_value is not None and
+                compute_node[totals[key]] == resources[totals[key]]):
+                if abs(value - old_value) > threshold * resources[totals[key]]:
+                    return True
+            elif value != old_value:
+                return True
+        return False
 
     def compare_cpu(self, cpu_info):
         """Checks the host cpu is compatible to a cpu given by xml.
@@ -2172,28 +2473,77 @@ class LibvirtConnection(driver.ComputeDriver):
         """
         # available size of the disk
         dk_sz_gb = self.get_local_gb_total() - self.get_local_gb_used()
+        return self._get_disk_available_least(dk_sz_gb * (1024 ** 3))
+
+    def _get_disk_available_least(self, available_size):
+        """Return disk available least size given the available size of
+        the disk in bytes.
+
+        Uses the disk lists of the domains and the virtual sizes of
+        their qcow2 disks remembered by _get_disk_over_committed_size(),
+        so that qemu-img only runs for disks it has not seen yet.
+        """
 
         # Disk size that all instance uses : virtual_size - disk_size
-        instances_name = self.list_instances()
         instances_sz = 0
-        for i_name in instances_name:
+        disk_virtual_sizes = {}
+        for dom_id in self._conn.listDomainsID():
+            if dom_id == 0:
+                continue
+            dom = self._conn.lookupByID(dom_id)
             try:
-                disk_infos = utils.loads(self.get_instance_disk_info(i_name))
-                for info in disk_infos:
-                    i_vt_sz = int(info['virt_disk_size'])
-                    i_dk_sz = int(info['disk_size'])
-                    instances_sz += i_vt_sz - i_dk_sz
+                instances_sz += self._get_disk_over_committed_size(
+                        dom.XMLDesc(0), disk_virtual_sizes)
             except OSError as e:
                 if e.errno == errno.ENOENT:
+                    i_name = dom.name()
                     LOG.error(_("Getting disk size of %(i_name)s: %(e)s") %
                               locals())
                 else:
                     raise
+        self._disk_virtual_sizes = disk_virtual_sizes
 
         # Disk available least size
-        available_least_size = dk_sz_gb * (1024 ** 3) - instances_sz
+        available_least_size = available_size - instances_sz
         return (available_least_size / 1024 / 1024 / 1024)
 
+    def _get_disk_over_committed_size(self, xml, disk_virtual_sizes):
+        """Return virtual_size - disk_size of the file disks of a domain,
+        counting a virtual size of 0 for raw disks like
+        get_instance_disk_info() does.
+
+        Adds the virtual sizes of its qcow2 disks to disk_virtual_sizes.
+        """
+
+        size = 0
+        doc = ElementTree.fromstring(xml)
+        for disk_node in doc.findall('.//devices/disk'):
+            path_node = disk_node.find('source')
+            if disk_node.get('type') != 'file' or path_node is None:
+                continue
+            path = path_node.get('file')
+            dk_size = int(os.path.getsize(path))
+
+            driver_node = disk_node.find('driver')
+            if driver_node is not None and driver_node.get('type') == 'qcow2':
+                virt_size = self._disk_virtual_sizes.get(path)
+                if virt_size is None:
+                    virt_size = libvirt_utils.get_disk_size(path)
+                disk_virtual_sizes[path] = virt_size
+            else:
+                virt_size = 0
+            size += virt_size - dk_size
+        return size
+
+    def _forget_disk_sizes(self, instance):
+        """Drop the remembered virtual sizes of the disks of an instance,
+        after they were deleted or resized."""
+
+        inst_base = os.path.join(FLAGS.instances_path, instance['name'])
+        for path in self._disk_virtual_sizes.keys():
+            if os.path.dirname(path) == inst_base:
+                del self._disk_virtual_sizes[path]
+
     def unfilter_instance(self, instance_ref, network_info):
         """See comments of same method in firewall_driver."""
         self.firewall_driver.unfilter_instance(instance_ref,
@@ -2304,6 +2654,7 @@ class LibvirtConnection(driver.ComputeDriver):
                    instance['name'])
 
         # resize disks. only "disk" and "disk.local" are necessary.
+        self._forget_disk_sizes(instance)
         disk_info = utils.loads(disk_info)
         for info in disk_info:
             fname = os.path.basename(info['path'])
@@ -2335,8 +2686,8 @@ class LibvirtConnection(driver.ComputeDriver):
         self._create_new_domain(xml)
         self.firewall_driver.apply_instance_filter(instance, network_info)
 
-        timer = utils.LoopingCall(self._wait_for_running, instance)
-        return timer.start(interval=0.5, now=True)
+        return self._poll_power_state(
+                instance, lambda: self._wait_for_running(instance))
 
     @exception.wrap_exception()
     def finish_revert_migration(self, instance, network_info):
@@ -2346,6 +2697,7 @@ class LibvirtConnection(driver.ComputeDriver):
         inst_base = "%s/%s" % (FLAGS.instances_path, instance['name'])
         inst_base_resize = inst_base + "_resize"
         utils.execute('mv', inst_base_resize, inst_base)
+        self._forget_disk_sizes(instance)
 
         xml_path = os.path.join(inst_base, 'libvirt.xml')
         xml = open(xml_path).read()
@@ -2357,8 +2709,8 @@ class LibvirtConnection(driver.ComputeDriver):
         self._create_new_domain(xml)
         self.firewall_driver.apply_instance_filter(instance, network_info)
 
-        timer = utils.LoopingCall(self._wait_for_running, instance)
-        return timer.start(interval=0.5, now=True)
+        return self._poll_power_state(
+                instance, lambda: self._wait_for_running(instance))
 
     def confirm_migration(self, migration, instance, network_info):
         """Confirms a resize, destroying the source VM"""
@@ -43,13 +43,19 @@ class HelperBase(object):
     def get_all_refs_and_recs(cls, session, record_type):
         """Retrieve all refs and recs for a Xen record type.
 
-        Handles race-conditions where the record may be deleted between
-        the `get_all` call and the `get_record` call.
+        All the records are fetched by a single get_all_records call.
         """
+        records = session.call_xenapi('%s.get_all_records' % record_type)
+        return records.iteritems()
 
-        for ref in session.call_xenapi('%s.get_all' % record_type):
-            rec = cls.get_rec(session, record_type, ref)
-            # Check to make sure the record still exists. It may have
-            # been deleted between the get_all call and get_record call
-            if rec:
-                yield ref, rec
+    @classmethod
+    def get_all_refs_and_recs_where(cls, session, record_type, expr):
+        """Retrieve the refs and recs of a Xen record type matching expr.
+
+        The filtering is done by XenAPI, for example with
+        'field "SR" = "OpaqueRef:..."', so only the matching records are
+        sent back, in a single call.
+        """
+        records = session.call_xenapi(
+                '%s.get_all_records_where' % record_type, expr)
+        return records.iteritems()
@@ -53,6 +53,7 @@ A fake XenAPI SDK.
 
 import json
 import random
+import re
 import uuid
 from xml.sax import saxutils
 
@@ -310,6 +311,45 @@ def get_all_records(table):
     return _db_content[table]
 
 
+_QUERY_TERM_RE = re.compile(r'^\s*field\s+"(\w+)"\s*=\s*"([^"]*)"\s*$')
+
+
+def _query_value(value):
+    """Return a field value as XenAPI queries compare it."""
+    if isinstance(value, bool):
+        return str(value).lower()
+    if value is None:
+        return 'OpaqueRef:NULL'
+    return str(value)
+
+
+def get_all_records_where(table, expr):
+    """Filter a table with the subset of the XenAPI query language made
+    of 'field "name" = "value"' terms joined by 'and' and 'or'."""
+    alternatives = []
+    for alternative in expr.split(' or '):
+        terms = []
+        for term in alternative.split(' and '):
+            match = _QUERY_TERM_RE.match(term)
+            if not match:
+                raise Failure(['SYNTAX_ERROR', expr])
+            # XenAPI spells the name_label field name__label in queries
+            terms.append((match.group(1).replace('__', '_'), match.group(2)))
+        alternatives.append(terms)
+
+    def matches(rec):
+        for terms in alternatives:
+            for field, value in terms:
+                if field not in rec or _query_value(rec[field]) != value:
+                    break
+            else:
+                return True
+        return False
+
+    return dict((ref, rec) for ref, rec in _db_content[table].iteritems()
+                if matches(rec))
+
+
 def get_record(table, ref):
     if ref in _db_content[table]:
         return _db_content[table].get(ref)
@@ -629,6 +669,10 @@ class SessionBase(object):
             self._check_arg_count(params, 1)
             return get_all_records(cls)
 
+        if func == 'get_all_records_where':
+            self._check_arg_count(params, 2)
+            return get_all_records_where(cls, params[1])
+
         if func == 'get_record':
             self._check_arg_count(params, 2)
             return get_record(cls, params[1])
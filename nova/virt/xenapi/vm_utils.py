@@ -22,16 +22,21 @@ their attributes like VDIs, VIFs, as well as their lookup functions.
 
 import contextlib
 import cPickle as pickle
-import decimal
+import errno
+import io
 import json
+import math
+import operator
 import os
 import re
+import stat
+import StringIO
+import sys
 import time
 import urllib
 import urlparse
 import uuid
-from xml.dom import minidom
-from xml.parsers import expat
+from xml.etree import cElementTree as ElementTree
 
 from eventlet import greenthread
 
@@ -74,7 +79,12 @@ xenapi_vm_utils_opts = [
                 help='Whether to use sparse_copy for copying data on a '
                      'resize down (False will use standard dd). This speeds '
                      'up resizes down considerably since large runs of zeros '
-                     'won\'t have to be rsynced')
+                     'won\'t have to be rsynced. Also skips writing runs of '
+                     'zeros when streaming images to a new disk'),
+    cfg.IntOpt('xenapi_sparse_copy_block_size',
+               default=1024 * 1024,
+               help='Size in bytes of the blocks sparse_copy reads and '
+                    'checks for zeros; should be a multiple of 4096'),
     ]
 
 FLAGS = flags.FLAGS
@@ -89,6 +99,11 @@ XENAPI_POWER_STATE = {
 
 
 SECTOR_SIZE = 512
+# lseek() whence values for skipping holes; os only has them on Python 3.3+
+SEEK_DATA = getattr(os, 'SEEK_DATA',
+                    sys.platform.startswith('linux') and 3 or None)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE',
+                    sys.platform.startswith('linux') and 4 or None)
 MBR_SIZE_SECTORS = 63
 MBR_SIZE_BYTES = MBR_SIZE_SECTORS * SECTOR_SIZE
 KERNEL_DIR = '/boot/guest'
@@ -229,18 +244,18 @@ class VMHelper(xenapi.HelperBase):
                                                  host))
         return host_free_mem >= mem
 
+    @classmethod
+    def get_vbd_refs_and_recs(cls, session, vm_ref):
+        """Retrieve the refs and recs of all the VBDs of a VM at once"""
+        return cls.get_all_refs_and_recs_where(
+                session, 'VBD', 'field "VM" = "%s"' % vm_ref)
+
     @classmethod
     def find_vbd_by_number(cls, session, vm_ref, number):
         """Get the VBD reference from the device number"""
-        vbd_refs = session.call_xenapi("VM.get_VBDs", vm_ref)
-        if vbd_refs:
-            for vbd_ref in vbd_refs:
-                try:
-                    vbd_rec = session.call_xenapi("VBD.get_record", vbd_ref)
-                    if vbd_rec['userdevice'] == str(number):
-                        return vbd_ref
-                except cls.XenAPI.Failure, exc:
-                    LOG.exception(exc)
+        for vbd_ref, vbd_rec in cls.get_vbd_refs_and_recs(session, vm_ref):
+            if vbd_rec['userdevice'] == str(number):
+                return vbd_ref
         raise volume_utils.StorageError(
                 _('VBD not found in instance %s') % vm_ref)
 
@@ -342,9 +357,7 @@ class VMHelper(xenapi.HelperBase):
     @classmethod
     def get_vdi_for_vm_safely(cls, session, vm_ref):
         """Retrieves the primary VDI for a VM"""
-        vbd_refs = session.call_xenapi("VM.get_VBDs", vm_ref)
-        for vbd in vbd_refs:
-            vbd_rec = session.call_xenapi("VBD.get_record", vbd)
+        for vbd, vbd_rec in cls.get_vbd_refs_and_recs(session, vm_ref):
             # Convention dictates the primary VDI will be userdevice 0
             if vbd_rec['userdevice'] == '0':
                 vdi_rec = session.call_xenapi("VDI.get_record", vbd_rec['VDI'])
@@ -967,12 +980,11 @@ class VMHelper(xenapi.HelperBase):
 
     @classmethod
     def list_vms(cls, session):
-        for vm_ref, vm_rec in cls.get_all_refs_and_recs(session, 'VM'):
-            if (vm_rec["resident_on"] != session.get_xenapi_host() or
-                vm_rec["is_a_template"] or vm_rec["is_control_domain"]):
-                continue
-            else:
-                yield vm_ref, vm_rec
+        expr = ('field "resident_on" = "%s" and '
+                'field "is_a_template" = "false" and '
+                'field "is_control_domain" = "false"' %
+                session.get_xenapi_host())
+        return cls.get_all_refs_and_recs_where(session, 'VM', expr)
 
     @classmethod
     def lookup(cls, session, name_label):
@@ -988,26 +1000,36 @@ class VMHelper(xenapi.HelperBase):
 
     @classmethod
     def lookup_vm_vdis(cls, session, vm_ref):
-        """Look for the VDIs that are attached to the VM"""
+        """Look for the VDIs that are attached to the VM
+
+        The VBDs of the VM and the VDIs they may point to are each read
+        in a single call, however many disks the VM has.
+        """
         # Firstly we get the VBDs, then the VDIs.
         # TODO(Armando): do we leave the read-only devices?
-        vbd_refs = session.call_xenapi("VM.get_VBDs", vm_ref)
+        vbd_recs = [vbd_rec for vbd_ref, vbd_rec
+                    in cls.get_vbd_refs_and_recs(session, vm_ref)]
+        if not vbd_recs:
+            return None
+
+        # NOTE: XenAPI can't filter VDIs by the VBDs using them, so all
+        #       the VDIs a VBD can be plugged into are read at once.
+        vdi_recs = dict(cls.get_all_refs_and_recs_where(
+                session, 'VDI', 'field "managed" = "true"'))
         vdi_refs = []
-        if vbd_refs:
-            for vbd_ref in vbd_refs:
-                try:
-                    vdi_ref = session.call_xenapi("VBD.get_VDI", vbd_ref)
-                    # Test valid VDI
-                    record = session.call_xenapi("VDI.get_record", vdi_ref)
-                    LOG.debug(_('VDI %s is still available'), record['uuid'])
-                except cls.XenAPI.Failure, exc:
-                    LOG.exception(exc)
-                else:
-                    vdi_refs.append(vdi_ref)
-            if len(vdi_refs) > 0:
-                return vdi_refs
+        for vbd_rec in vbd_recs:
+            vdi_ref = vbd_rec['VDI']
+            # Test valid VDI
+            record = vdi_recs.get(vdi_ref)
+            if record is None:
+                LOG.debug(_('VDI %s is not available'), vdi_ref)
             else:
-                return None
+                LOG.debug(_('VDI %s is still available'), record['uuid'])
+                vdi_refs.append(vdi_ref)
+        if len(vdi_refs) > 0:
+            return vdi_refs
+        else:
+            return None
 
     @classmethod
     def preconfigure_instance(cls, session, instance, vdi_ref, network_info):
@@ -1063,17 +1085,9 @@ class VMHelper(xenapi.HelperBase):
             vm_uuid = record["uuid"]
             xml = get_rrd(get_rrd_server(), vm_uuid)
             if xml:
-                rrd = minidom.parseString(xml)
-                for i, node in enumerate(rrd.firstChild.childNodes):
-                    # We don't want all of the extra garbage
-                    if i >= 3 and i <= 11:
-                        ref = node.childNodes
-                        # Name and Value
-                        if len(ref) > 6:
-                            _ref_zero = ref[0].firstChild.data
-                            diags[_ref_zero] = ref[6].firstChild.data
+                diags = parse_rrd_diagnostics(xml)
             return diags
-        except expat.ExpatError as e:
+        except SyntaxError as e:
             LOG.exception(_('Unable to parse rrd of %(vm_uuid)s') % locals())
             return {"Unable to retrieve diagnostics": e}
 
@@ -1085,8 +1099,7 @@ class VMHelper(xenapi.HelperBase):
 
         xml = get_rrd_updates(get_rrd_server(), start_time)
         if xml:
-            doc = minidom.parseString(xml)
-            return parse_rrd_update(doc, start_time, stop_time)
+            return parse_rrd_update(xml, start_time, stop_time)
 
         raise exception.CouldNotFetchMetrics()
 
@@ -1128,14 +1141,15 @@ class VMHelper(xenapi.HelperBase):
 
         if filter_criteria == 'other-config':
             key, value = filter_pattern.split('=', 1)
+            host_pbd_refs = set(ref for ref, _rec in
+                                cls.get_all_refs_and_recs_where(session,
+                                    'PBD', 'field "host" = "%s"' % host))
             for sr_ref, sr_rec in cls.get_all_refs_and_recs(session, 'SR'):
                 if not (key in sr_rec['other_config'] and
                         sr_rec['other_config'][key] == value):
                     continue
-                for pbd_ref in sr_rec['PBDs']:
-                    pbd_rec = cls.get_rec(session, 'PBD', pbd_ref)
-                    if pbd_rec and pbd_rec['host'] == host:
-                        return sr_ref
+                if host_pbd_refs.intersection(sr_rec['PBDs']):
+                    return sr_ref
         elif filter_criteria == 'default-sr' and filter_pattern == 'true':
             pool_ref = session.call_xenapi('pool.get_all')[0]
             return session.call_xenapi('pool.get_default_SR', pool_ref)
@@ -1160,6 +1174,7 @@ class VMHelper(xenapi.HelperBase):
     def find_iso_sr(cls, session):
         """Return the storage repository to hold ISO images"""
         host = session.get_xenapi_host()
+        pbd_recs = dict(cls.get_all_refs_and_recs(session, 'PBD'))
         for sr_ref, sr_rec in cls.get_all_refs_and_recs(session, 'SR'):
             LOG.debug(_("ISO: looking at SR %(sr_rec)s") % locals())
             if not sr_rec['content_type'] == 'iso':
@@ -1176,7 +1191,7 @@ class VMHelper(xenapi.HelperBase):
             LOG.debug(_("ISO: SR MATCHing our criteria"))
             for pbd_ref in sr_rec['PBDs']:
                 LOG.debug(_("ISO: ISO, looking to see if it is host local"))
-                pbd_rec = cls.get_rec(session, 'PBD', pbd_ref)
+                pbd_rec = pbd_recs.get(pbd_ref)
                 if not pbd_rec:
                     LOG.debug(_("ISO: PBD %(pbd_ref)s disappeared") % locals())
                     continue
@@ -1227,94 +1242,100 @@ def get_rrd_updates(server, start_time):
         return None
 
 
-def parse_rrd_meta(doc):
-    data = {}
-    meta = doc.getElementsByTagName('meta')[0]
-    for tag in ('start', 'end', 'step'):
-        data[tag] = int(meta.getElementsByTagName(tag)[0].firstChild.data)
-    legend = meta.getElementsByTagName('legend')[0]
-    data['legend'] = [child.firstChild.data for child in legend.childNodes]
-    return data
+def parse_rrd_diagnostics(xml, count=9):
+    """Return the name and current value of the first count data sources
+    of a VM RRD.
+
+    The data sources precede the archives, which make up nearly all of
+    the document, so parsing stops at the first archive.
+    """
+    diags = {}
+    for event, elem in ElementTree.iterparse(StringIO.StringIO(xml),
+                                             ('start', 'end')):
+        if elem.tag == 'rra' or len(diags) >= count:
+            break
+        if event == 'end' and elem.tag == 'ds':
+            diags[elem.findtext('name')] = elem.findtext('value')
+    return diags
+
 
+def parse_rrd_data(xml):
+    """Stream an rrd_updates document.
 
-def parse_rrd_data(doc):
-    dnode = doc.getElementsByTagName('data')[0]
-    return [dict(
-            time=int(child.getElementsByTagName('t')[0].firstChild.data),
-            values=[decimal.Decimal(valnode.firstChild.data)
-                  for valnode in child.getElementsByTagName('v')])
-            for child in dnode.childNodes]
+    Returns the column legend, the sample times and one list of float
+    samples per column, all ordered oldest first.
+    """
+    legend = []
+    times = []
+    rows = []
+    for event, elem in ElementTree.iterparse(StringIO.StringIO(xml)):
+        if elem.tag == 'entry':
+            legend.append(elem.text)
+        elif elem.tag == 'row':
+            times.append(int(elem.findtext('t')))
+            rows.append([float(v.text) for v in elem.findall('v')])
+            elem.clear()
+    # XenServer lists the newest row first
+    times.reverse()
+    rows.reverse()
+    if rows:
+        columns = [list(col) for col in zip(*rows)]
+    else:
+        columns = [[] for col in legend]
+    return legend, times, columns
 
 
-def parse_rrd_update(doc, start, until=None):
+def parse_rrd_update(xml, start, until=None):
     sum_data = {}
-    meta = parse_rrd_meta(doc)
-    data = parse_rrd_data(doc)
-    for col, collabel in enumerate(meta['legend']):
+    legend, times, columns = parse_rrd_data(xml)
+    if until:
+        rows = len([t for t in times if t <= until])
+        times = times[:rows]
+        columns = [values[:rows] for values in columns]
+    # The sample intervals are shared by every column
+    steps = [t - prev for t, prev in zip(times, [int(start)] + times)]
+    for collabel, values in zip(legend, columns):
         _datatype, _objtype, uuid, name = collabel.split(':')
-        vm_data = sum_data.get(uuid, dict())
+        vm_data = sum_data.setdefault(uuid, {})
         if name.startswith('vif'):
-            vm_data[name] = integrate_series(data, col, start, until)
+            vm_data[name] = integrate_series(values, steps)
         else:
-            vm_data[name] = average_series(data, col, until)
-        sum_data[uuid] = vm_data
+            vm_data[name] = average_series(values)
     return sum_data
 
 
-def average_series(data, col, until=None):
-    vals = [row['values'][col] for row in data
-            if (not until or (row['time'] <= until)) and
-                row['values'][col].is_finite()]
-    if vals:
-        try:
-            return (sum(vals) / len(vals)).quantize(decimal.Decimal('1.0000'))
-        except decimal.InvalidOperation:
-            # (mdragon) Xenserver occasionally returns odd values in
-            # data that will throw an error on averaging (see bug 918490)
-            # These are hard to find, since, whatever those values are,
-            # Decimal seems to think they are a valid number, sortof.
-            # We *think* we've got the the cases covered, but just in
-            # case, log and return NaN, so we don't break reporting of
-            # other statistics.
-            LOG.error(_("Invalid statistics data from Xenserver: %s")
-                      % str(vals))
-            return decimal.Decimal('NaN')
-    else:
-        return decimal.Decimal('0.0000')
-
-
-def integrate_series(data, col, start, until=None):
-    total = decimal.Decimal('0.0000')
-    prev_time = int(start)
-    prev_val = None
-    for row in reversed(data):
-        if not until or (row['time'] <= until):
-            time = row['time']
-            val = row['values'][col]
-            if val.is_nan():
-                val = decimal.Decimal('0.0000')
-            if prev_val is None:
-                prev_val = val
-            if prev_val >= val:
-                total += ((val * (time - prev_time)) +
-                          (decimal.Decimal('0.5000') * (prev_val - val) *
-                          (time - prev_time)))
-            else:
-                total += ((prev_val * (time - prev_time)) +
-                          (decimal.Decimal('0.5000') * (val - prev_val) *
-                          (time - prev_time)))
-            prev_time = time
-            prev_val = val
-    return total.quantize(decimal.Decimal('1.0000'))
+def average_series(values):
+    vals = [val for val in values
+            if not (math.isnan(val) or math.isinf(val))]
+    if not vals:
+        return 0.0
+    average = sum(vals) / len(vals)
+    if math.isinf(average):
+        # (mdragon) Xenserver occasionally returns odd values in
+        # data that will throw an error on averaging (see bug 918490).
+        # Log and return NaN, so we don't break reporting of other
+        # statistics.
+        LOG.error(_("Invalid statistics data from Xenserver: %s")
+                  % str(vals))
+        return float('nan')
+    return round(average, 4)
+
+
+def integrate_series(values, steps):
+    """Integrate values sampled at the end of each of steps with the
+    trapezoidal rule, counting NaN samples as 0. The first sample is
+    taken to hold since the start of the first step.
+    """
+    vals = [0.0 if math.isnan(val) else val for val in values]
+    if not vals:
+        return 0.0
+    heights = map(operator.add, vals[:1] + vals[:-1], vals)
+    return round(0.5 * sum(map(operator.mul, heights, steps)), 4)
 
 
 def _get_all_vdis_in_sr(session, sr_ref):
-    for vdi_ref in session.call_xenapi('SR.get_VDIs', sr_ref):
-        try:
-            vdi_rec = session.call_xenapi('VDI.get_record', vdi_ref)
-            yield vdi_ref, vdi_rec
-        except VMHelper.XenAPI.Failure:
-            continue
+    return VMHelper.get_all_refs_and_recs_where(session, 'VDI',
+                                                'field "SR" = "%s"' % sr_ref)
 
 
 #TODO(sirp): This code comes from XS5.6 pluginlib.py, we should refactor to
@@ -1379,9 +1400,10 @@ def _wait_for_vhd_coalesce(session, instance, sr_ref, vdi_ref,
 
         # Search for any other vdi which parents to original parent and is not
         # in the active vm/instance vdi chain.
+        vdi_recs = list(_get_all_vdis_in_sr(session, sr_ref))
         vdi_uuid = session.call_xenapi('VDI.get_record', vdi_ref)['uuid']
         parent_vdi_uuid = get_vhd_parent_uuid(session, vdi_ref)
-        for _ref, rec in _get_all_vdis_in_sr(session, sr_ref):
+        for _ref, rec in vdi_recs:
             if ((rec['uuid'] != vdi_uuid) and
                (rec['uuid'] != parent_vdi_uuid) and
                (rec['sm_config'].get('vhd-parent') == original_parent_uuid)):
@@ -1391,25 +1413,29 @@ def _wait_for_vhd_coalesce(session, instance, sr_ref, vdi_ref,
         return False
 
     # Check if original parent has any other child. If so, coalesce will
-    # not take place.
-    if _another_child_vhd():
-        parent_uuid = get_vhd_parent_uuid(session, vdi_ref)
-        parent_ref = session.call_xenapi("VDI.get_by_uuid", parent_uuid)
-        base_uuid = get_vhd_parent_uuid(session, parent_ref)
-        return parent_uuid, base_uuid
+    # not take place. The VDI records of the SR read by the check answer
+    # the lookups of the chain that follow.
+    with session.record_cache():
+        if _another_child_vhd():
+            parent_uuid = get_vhd_parent_uuid(session, vdi_ref)
+            parent_ref = session.call_xenapi("VDI.get_by_uuid", parent_uuid)
+            base_uuid = get_vhd_parent_uuid(session, parent_ref)
+            return parent_uuid, base_uuid
 
     max_attempts = FLAGS.xenapi_vhd_coalesce_max_attempts
     for i in xrange(max_attempts):
         VMHelper.scan_sr(session, sr_ref)
-        parent_uuid = get_vhd_parent_uuid(session, vdi_ref)
-        if original_parent_uuid and (parent_uuid != original_parent_uuid):
-            LOG.debug(_("Parent %(parent_uuid)s doesn't match original parent"
-                    " %(original_parent_uuid)s, waiting for coalesce...")
-                    % locals())
-        else:
-            parent_ref = session.call_xenapi("VDI.get_by_uuid", parent_uuid)
-            base_uuid = get_vhd_parent_uuid(session, parent_ref)
-            return parent_uuid, base_uuid
+        with session.record_cache():
+            parent_uuid = get_vhd_parent_uuid(session, vdi_ref)
+            if original_parent_uuid and (parent_uuid != original_parent_uuid):
+                LOG.debug(_("Parent %(parent_uuid)s doesn't match original "
+                            "parent %(original_parent_uuid)s, waiting for "
+                            "coalesce...") % locals())
+            else:
+                parent_ref = session.call_xenapi("VDI.get_by_uuid",
+                                                 parent_uuid)
+                base_uuid = get_vhd_parent_uuid(session, parent_ref)
+                return parent_uuid, base_uuid
 
         greenthread.sleep(FLAGS.xenapi_vhd_coalesce_poll_interval)
 
@@ -1565,11 +1591,22 @@ def _stream_disk(dev, image_type, virtual_size, image_file):
 
     dev_path = utils.make_dev_path(dev)
 
+    start_time = time.time()
+    bytes_written = 0
+    skipped_bytes = 0
     with utils.temporary_chown(dev_path):
         with open(dev_path, 'wb') as f:
             f.seek(offset)
             for chunk in image_file:
-                f.write(chunk)
+                # The disk is newly created, so runs of zeros need not be
+                # written out
+                if FLAGS.xenapi_sparse_copy and _is_zeros(chunk):
+                    f.seek(len(chunk), os.SEEK_CUR)
+                    skipped_bytes += len(chunk)
+                else:
+                    f.write(chunk)
+                    bytes_written += len(chunk)
+    _log_copy_stats('stream_disk', start_time, bytes_written, skipped_bytes)
 
 
 def _write_partition(virtual_size, dev):
@@ -1636,13 +1673,31 @@ def _resize_part_and_fs(dev, start, old_sectors, new_sectors):
     utils.execute('tune2fs', '-j', partition_path, run_as_root=True)
 
 
-def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096):
-    """Copy data, skipping long runs of zeros to create a sparse file."""
+def _is_zeros(data):
+    """Return True if data holds nothing but zero bytes."""
+    return data.count('\0') == len(data)
+
+
+def _log_copy_stats(name, start_time, bytes_written, skipped_bytes):
+    duration = max(time.time() - start_time, 0.001)
+    total_bytes = bytes_written + skipped_bytes
+    throughput = total_bytes / duration / (1024 * 1024)
+    compression_pct = 0.0
+    if total_bytes:
+        compression_pct = float(skipped_bytes) / total_bytes * 100
+    LOG.debug(_("Finished %(name)s of %(total_bytes)d bytes in "
+                "%(duration).2f secs (%(throughput).1f MB/s), "
+                "%(compression_pct).2f%% reduction in size"), locals())
+
+
+def _sparse_copy(src_path, dst_path, virtual_size, block_size=None):
+    """Copy data, skipping long runs of zeros to create a sparse file.
+
+    Returns the number of bytes written and skipped.
+    """
     start_time = time.time()
-    EMPTY_BLOCK = '\0' * block_size
-    bytes_read = 0
-    skipped_bytes = 0
-    left = virtual_size
+    if block_size is None:
+        block_size = FLAGS.xenapi_sparse_copy_block_size
 
     LOG.debug(_("Starting sparse_copy src=%(src_path)s dst=%(dst_path)s "
                 "virtual_size=%(virtual_size)d block_size=%(block_size)d"),
@@ -1653,31 +1708,93 @@ def _sparse_copy(src_path, dst_path, virtual_size, block_size=4096):
     # ownership of the devices.
     with utils.temporary_chown(src_path):
         with utils.temporary_chown(dst_path):
-            with open(src_path, "r") as src:
-                with open(dst_path, "w") as dst:
-                    data = src.read(min(block_size, left))
-                    while data:
-                        if data == EMPTY_BLOCK:
-                            dst.seek(block_size, os.SEEK_CUR)
-                            left -= block_size
-                            bytes_read += block_size
-                            skipped_bytes += block_size
-                        else:
-                            dst.write(data)
-                            data_len = len(data)
-                            left -= data_len
-                            bytes_read += data_len
-
-                        if left <= 0:
-                            break
-
-                        data = src.read(min(block_size, left))
-
-    duration = time.time() - start_time
-    compression_pct = float(skipped_bytes) / bytes_read * 100
-
-    LOG.debug(_("Finished sparse_copy in %(duration).2f secs, "
-                "%(compression_pct).2f%% reduction in size"), locals())
+            with io.open(src_path, 'rb', buffering=0) as src:
+                with io.open(dst_path, 'wb', buffering=0) as dst:
+                    bytes_written, skipped_bytes = _sparse_copy_file(
+                            src, dst, virtual_size, block_size)
+
+    _log_copy_stats('sparse_copy', start_time, bytes_written, skipped_bytes)
+    return bytes_written, skipped_bytes
+
+
+def _sparse_copy_file(src, dst, size, block_size, chunk_size=64 * 1024):
+    """Copy the first size bytes of src to dst, seeking over runs of zeros
+    instead of writing them.
+
+    Data is read block_size bytes at a time and checked for zeros in
+    chunk_size pieces. Holes in src are skipped without being read where
+    the filesystem reports them.
+    """
+    buf = bytearray(block_size)
+    zeros = bytearray(block_size)
+    seek_holes = SEEK_DATA is not None and SEEK_HOLE is not None
+    bytes_written = 0
+    skipped_bytes = 0
+    offset = 0
+    data_end = 0 if seek_holes else size
+    dst_offset = 0
+    while offset < size:
+        if seek_holes and offset >= data_end:
+            try:
+                data_offset = min(os.lseek(src.fileno(), offset, SEEK_DATA),
+                                  size)
+                data_end = os.lseek(src.fileno(), data_offset, SEEK_HOLE)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Nothing but a hole left
+                    data_offset = data_end = size
+                else:
+                    # Not supported here, so read everything
+                    seek_holes = False
+                    data_offset = offset
+                    data_end = size
+            if data_offset > offset:
+                skipped_bytes += data_offset - offset
+                offset = data_offset
+                continue
+
+        length = min(block_size, data_end - offset, size - offset)
+        src.seek(offset)
+        if length == block_size:
+            count = src.readinto(buf)
+            data = buf
+        else:
+            data = src.read(length)
+            count = len(data)
+        if not count:
+            break
+
+        pos = 0
+        while pos < count:
+            # Step over a run of zero chunks, then write out the run of
+            # chunks holding data that follows it
+            start = pos
+            while pos < count:
+                end = min(pos + chunk_size, count)
+                if buffer(data, pos, end - pos) != buffer(zeros, 0, end - pos):
+                    break
+                pos = end
+            skipped_bytes += pos - start
+            start = pos
+            while pos < count:
+                end = min(pos + chunk_size, count)
+                if buffer(data, pos, end - pos) == buffer(zeros, 0, end - pos):
+                    break
+                pos = end
+            if pos > start:
+                if dst_offset != offset + start:
+                    dst.seek(offset + start)
+                dst.write(buffer(data, start, pos - start))
+                bytes_written += pos - start
+                dst_offset = offset + pos
+        offset += count
+
+    # A regular file ending in skipped blocks must still be extended to
+    # the full size
+    if (dst_offset < offset and
+        stat.S_ISREG(os.fstat(dst.fileno()).st_mode)):
+        dst.truncate(offset)
+    return bytes_written, skipped_bytes
 
 
 def _copy_partition(session, src_ref, dst_ref, partition, virtual_size):
@@ -1108,9 +1108,8 @@ class VMOps(object):
 
     def _destroy_rescue_vbds(self, rescue_vm_ref):
         """Destroys all VBDs tied to a rescue VM."""
-        vbd_refs = self._session.call_xenapi("VM.get_VBDs", rescue_vm_ref)
-        for vbd_ref in vbd_refs:
-            vbd_rec = self._session.call_xenapi("VBD.get_record", vbd_ref)
+        for vbd_ref, vbd_rec in VMHelper.get_vbd_refs_and_recs(
+                self._session, rescue_vm_ref):
             if vbd_rec.get("userdevice", None) == "1":  # VBD is always 1
                 VMHelper.unplug_vbd(self._session, vbd_ref)
                 VMHelper.destroy_vbd(self._session, vbd_ref)
@@ -1410,6 +1409,29 @@ class VMOps(object):
         vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
         return VMHelper.compile_info(vm_rec)
 
+    def get_info_bulk(self, instances):
+        """Return data about several VM instances, keyed by name.
+
+        Reads all the VM records with a single VM.get_all_records call
+        rather than looking each instance up by name label.
+        """
+        names = set(instance['name'] for instance in instances)
+        host_ref = self._session.get_xenapi_host()
+        vm_recs = {}
+        for vm_ref, vm_rec in VMHelper.get_all_refs_and_recs(self._session,
+                                                              'VM'):
+            name = vm_rec['name_label']
+            if (name not in names or vm_rec['is_a_template'] or
+                vm_rec['is_control_domain']):
+                continue
+            # Prefer the VM resident on this host if the name label is
+            # used more than once
+            if name in vm_recs and vm_rec['resident_on'] != host_ref:
+                continue
+            vm_recs[name] = vm_rec
+        return dict((name, VMHelper.compile_info(vm_rec))
+                    for name, vm_rec in vm_recs.iteritems())
+
     def get_diagnostics(self, instance):
         """Return data about VM diagnostics."""
         vm_ref = self._get_vm_opaque_ref(instance)
@@ -1424,17 +1446,26 @@ class VMOps(object):
         except exception.CouldNotFetchMetrics:
             LOG.exception(_("Could not get bandwidth info."))
             return {}
+        # Read the VM and VIF records in two calls rather than looking
+        # each VM and VIF up in turn
+        vm_recs = {}
+        expr = ('field "is_a_template" = "false" and '
+                'field "is_control_domain" = "false"')
+        for vm_ref, vm_rec in VMHelper.get_all_refs_and_recs_where(
+                self._session, 'VM', expr):
+            vm_recs[vm_rec['uuid']] = vm_rec
+        vif_recs = dict(VMHelper.get_all_refs_and_recs(self._session, 'VIF'))
+
         bw = {}
         for uuid, data in metrics.iteritems():
-            vm_ref = self._session.call_xenapi("VM.get_by_uuid", uuid)
-            vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
+            vm_rec = vm_recs.get(uuid)
+            if vm_rec is None:
+                continue
             vif_map = {}
-            for vif in [self._session.call_xenapi("VIF.get_record", vrec)
-                        for vrec in vm_rec['VIFs']]:
+            for vif in [vif_recs[vrec] for vrec in vm_rec['VIFs']
+                        if vrec in vif_recs]:
                 vif_map[vif['device']] = vif['MAC']
             name = vm_rec['name_label']
-            if vm_rec["is_a_template"] or vm_rec["is_control_domain"]:
-                continue
             vifs_bw = bw.setdefault(name, {})
             for key, val in data.iteritems():
                 if key.startswith('vif_'):
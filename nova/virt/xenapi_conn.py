@@ -48,11 +48,13 @@ import time
 import urlparse
 import xmlrpclib
 
+from eventlet import corolocal
 from eventlet import greenthread
 from eventlet import queue
 from eventlet import tpool
 from eventlet import timeout
 
+from nova.compute import power_state
 from nova import context
 from nova import db
 from nova import exception
@@ -62,6 +64,7 @@ from nova.openstack.common import cfg
 from nova.virt import driver
 from nova.virt.xenapi import host
 from nova.virt.xenapi import pool
+from nova.virt.xenapi import vm_utils
 from nova.virt.xenapi import vmops
 from nova.virt.xenapi import volumeops
 
@@ -124,6 +127,27 @@ xenapi_opts = [
     cfg.IntOpt('xenapi_login_timeout',
                default=10,
                help='Timeout in seconds for XenAPI login.'),
+    cfg.FloatOpt('xenapi_event_timeout',
+                 default=30.0,
+                 help='Number of seconds each event.from call waits for VM '
+                      'events when lifecycle events are enabled. One '
+                      'session for long running calls is held while '
+                      'waiting.'),
+    cfg.IntOpt('xenapi_long_call_concurrent',
+               default=2,
+               help='Number of XenAPI connections set aside for long '
+                    'running calls (plugin calls and event.from), on top '
+                    'of xenapi_connection_concurrent, so that short calls '
+                    'never wait behind them. 0 shares a single pool.'),
+    cfg.BoolOpt('xenapi_async_plugin_calls',
+                default=True,
+                help='Run plugin calls as XenAPI tasks and poll them, '
+                     'instead of holding a connection until dom0 is done'),
+    cfg.FloatOpt('xenapi_task_poll_interval',
+                 default=0.5,
+                 help='Maximum number of seconds between polls of a running '
+                      'XenAPI task. Polls start 0.05 seconds apart and back '
+                      'off to this'),
     ]
 
 FLAGS = flags.FLAGS
@@ -171,6 +195,66 @@ class XenAPIConnection(driver.ComputeDriver):
         #e.g. to do session logout?
         pass
 
+    def start_event_monitor(self):
+        """Watch VM power state changes through XenAPI event.from.
+
+        The first call returns the current VM records and tells whether
+        the host supports event.from at all; a greenthread then keeps
+        waiting for changes.
+        """
+        self._vm_states = {}
+        try:
+            token = self._process_vm_events('', 0.0)
+        except self._session.XenAPI.Failure, exc:
+            LOG.warn(_("XenAPI event.from is unavailable, not watching "
+                       "for VM events: %s"), exc)
+            return False
+
+        self._events_started = True
+        greenthread.spawn_n(self._watch_vm_events, token)
+        return True
+
+    def _watch_vm_events(self, token):
+        while True:
+            try:
+                token = self._process_vm_events(token,
+                                                FLAGS.xenapi_event_timeout)
+            except Exception:
+                LOG.exception(_("Error waiting for XenAPI VM events"))
+                greenthread.sleep(FLAGS.hypervisor_event_poll_interval)
+                # start over from the current records
+                token = ''
+
+    def _process_vm_events(self, token, wait_timeout):
+        """Emit the power state changes of VMs since token.
+
+        VM.mod events are sent for any change of the record, so only the
+        ones changing the name label or power state are emitted.
+        """
+        result = self._session.call_xenapi('event.from', ['vm'], token,
+                                           wait_timeout)
+        for vm_event in result['events']:
+            vm_ref = vm_event['ref']
+            if vm_event['operation'] == 'del':
+                name_label, _state = self._vm_states.pop(vm_ref,
+                                                         (None, None))
+                if name_label is not None:
+                    self.emit_event(driver.LifecycleEvent(
+                            name_label, power_state.NOSTATE))
+                continue
+
+            vm_rec = vm_event.get('snapshot')
+            if (not vm_rec or vm_rec['is_a_template'] or
+                vm_rec['is_control_domain']):
+                continue
+            vm_state = (vm_rec['name_label'],
+                        vm_utils.XENAPI_POWER_STATE[vm_rec['power_state']])
+            if self._vm_states.get(vm_ref) == vm_state:
+                continue
+            self._vm_states[vm_ref] = vm_state
+            self.emit_event(driver.LifecycleEvent(*vm_state))
+        return result['token']
+
     def list_instances(self):
         """List VM instances"""
         return self._vmops.list_instances()
@@ -293,6 +377,10 @@ class XenAPIConnection(driver.ComputeDriver):
         """Return data about VM instance"""
         return self._vmops.get_info(instance)
 
+    def get_info_bulk(self, instances):
+        """Return data about several VM instances, keyed by name"""
+        return self._vmops.get_info_bulk(instances)
+
     def get_diagnostics(self, instance):
         """Return data about VM diagnostics"""
         return self._vmops.get_diagnostics(instance)
@@ -483,9 +571,19 @@ class XenAPIConnection(driver.ComputeDriver):
 class XenAPISession(object):
     """The session to invoke XenAPI SDK calls"""
 
+    SHORT_CALLS = 'short'
+    LONG_CALLS = 'long'
+    # XenAPI methods which block until something happens in dom0
+    LONG_METHODS = ('event.from', 'event.next')
+
     def __init__(self, url, user, pw):
         self.XenAPI = self.get_imported_xenapi()
         self._sessions = queue.Queue()
+        self._lanes = {self.SHORT_CALLS: self._sessions,
+                       self.LONG_CALLS: self._sessions}
+        self._lane_sizes = {}
+        self._stats = {}
+        self._local = corolocal.local()
         self.host_uuid = None
         self.is_slave = False
         exception = self.XenAPI.Failure(_("Unable to log in to XenAPI "
@@ -513,11 +611,24 @@ class XenAPISession(object):
         return url
 
     def _populate_session_pool(self, url, user, pw, exception):
+        self._lane_sizes[self.SHORT_CALLS] = FLAGS.xenapi_connection_concurrent
         for i in xrange(FLAGS.xenapi_connection_concurrent - 1):
-            session = self._create_session(url)
-            with timeout.Timeout(FLAGS.xenapi_login_timeout, exception):
-                session.login_with_password(user, pw)
-            self._sessions.put(session)
+            self._sessions.put(self._login_session(url, user, pw, exception))
+
+        if FLAGS.xenapi_long_call_concurrent > 0:
+            long_sessions = queue.Queue()
+            for i in xrange(FLAGS.xenapi_long_call_concurrent):
+                long_sessions.put(self._login_session(url, user, pw,
+                                                      exception))
+            self._lanes[self.LONG_CALLS] = long_sessions
+            self._lane_sizes[self.LONG_CALLS] = \
+                    FLAGS.xenapi_long_call_concurrent
+
+    def _login_session(self, url, user, pw, exception):
+        session = self._create_session(url)
+        with timeout.Timeout(FLAGS.xenapi_login_timeout, exception):
+            session.login_with_password(user, pw)
+        return session
 
     def _populate_host_uuid(self):
         if self.is_slave:
@@ -552,22 +663,112 @@ class XenAPISession(object):
             return str(session._session)
 
     @contextlib.contextmanager
-    def _get_session(self):
-        """Return exclusive session for scope of with statement"""
-        session = self._sessions.get()
+    def _get_session(self, lane=SHORT_CALLS, method=None):
+        """Return exclusive session for scope of with statement
+
+        Sessions come from the pool of the given lane. When method is
+        given, the time spent waiting for the session and the time it
+        was held are recorded against it.
+        """
+        sessions = self._lanes[lane]
+        start = time.time()
+        session = sessions.get()
+        acquired = time.time()
         try:
             yield session
         finally:
-            self._sessions.put(session)
+            sessions.put(session)
+            if method is not None:
+                self._record_call(method, acquired - start,
+                                  time.time() - acquired)
+
+    def _record_call(self, method, wait, duration):
+        stats = self._stats.get(method)
+        if stats is None:
+            stats = self._stats[method] = dict(count=0,
+                                               wait_total=0.0,
+                                               wait_max=0.0,
+                                               time_total=0.0,
+                                               time_max=0.0)
+        stats['count'] += 1
+        stats['wait_total'] += wait
+        stats['wait_max'] = max(stats['wait_max'], wait)
+        stats['time_total'] += duration
+        stats['time_max'] = max(stats['time_max'], duration)
+
+    def get_stats(self):
+        """Return the state of the session pools and, per XenAPI method
+        or plugin function, the number of calls and the seconds spent
+        waiting for a session and running them.
+        """
+        lanes = {}
+        for lane, size in self._lane_sizes.iteritems():
+            lanes[lane] = dict(size=size,
+                               free=self._lanes[lane].qsize(),
+                               waiting=self._lanes[lane].getting())
+        calls = {}
+        for method, stats in self._stats.iteritems():
+            calls[method] = dict(stats)
+        return dict(lanes=lanes, calls=calls)
 
     def get_xenapi_host(self):
         """Return the xenapi host on which nova-compute runs on."""
         with self._get_session() as session:
             return session.xenapi.host.get_by_uuid(self.host_uuid)
 
+    @contextlib.contextmanager
+    def record_cache(self):
+        """Cache the records read by the current greenthread in a block.
+
+        Within the with statement, records returned by get_record,
+        get_all_records and get_all_records_where calls are kept, so
+        that reading the same object again, or one that came back with
+        a get_all_records* call, needs no further round trip. Any call
+        that is not a get_* call may change records and empties the
+        cache. Blocks may be nested; the cache lasts until the outermost
+        one ends.
+        """
+        if getattr(self._local, 'records', None) is not None:
+            yield
+            return
+        self._local.records = {}
+        try:
+            yield
+        finally:
+            self._local.records = None
+
     def call_xenapi(self, method, *args):
         """Call the specified XenAPI method on a background thread."""
-        with self._get_session() as session:
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return self._call_xenapi(method, *args)
+
+        record_type, _sep, name = method.rpartition('.')
+        if name == 'get_record':
+            key = (record_type, args[0])
+            if key not in records:
+                records[key] = self._call_xenapi(method, *args)
+            return records[key]
+
+        result = self._call_xenapi(method, *args)
+        if name in ('get_all_records', 'get_all_records_where'):
+            for ref, rec in result.iteritems():
+                records[(record_type, ref)] = rec
+        elif not name.startswith('get_'):
+            records.clear()
+        return result
+
+    def _forget_records(self):
+        """Empty the record cache, if any, after a call changing state."""
+        records = getattr(self._local, 'records', None)
+        if records:
+            records.clear()
+
+    def _call_xenapi(self, method, *args):
+        lane = self.SHORT_CALLS
+        if method in self.LONG_METHODS:
+            lane = self.LONG_CALLS
+        with self._get_session(lane, method) as session:
             f = session.xenapi
             for m in method.split('.'):
                 f = getattr(f, m)
@@ -578,7 +779,8 @@ class XenAPISession(object):
         param record, require using the xenapi_request method of the session
         object. This wraps that call on a background thread.
         """
-        with self._get_session() as session:
+        self._forget_records()
+        with self._get_session(method=method) as session:
             f = session.xenapi_request
             return tpool.execute(f, method, *args)
 
@@ -594,11 +796,51 @@ class XenAPISession(object):
         # the plugin gets executed on the right host when using XS pools
         args['host_uuid'] = self.host_uuid
 
-        with self._get_session() as session:
+        self._forget_records()
+        name = 'plugin %s.%s' % (plugin, fn)
+        if FLAGS.xenapi_async_plugin_calls:
+            start = time.time()
+            try:
+                return self._unwrap_plugin_exceptions(
+                        self._call_plugin_async, host, plugin, fn, args)
+            finally:
+                self._record_call(name, 0.0, time.time() - start)
+
+        with self._get_session(self.LONG_CALLS, name) as session:
             return tpool.execute(self._unwrap_plugin_exceptions,
                                  session.xenapi.host.call_plugin,
                                  host, plugin, fn, args)
 
+    def _call_plugin_async(self, host, plugin, fn, args):
+        """Start a plugin as a XenAPI task and wait for its result.
+
+        A session is held only to start the task and for each poll of
+        its status, not while dom0 runs the plugin.
+        """
+        with self._get_session(self.LONG_CALLS,
+                               'Async.host.call_plugin') as session:
+            task = tpool.execute(session.xenapi.Async.host.call_plugin,
+                                 host, plugin, fn, args)
+        try:
+            # Most plugins are done within a fraction of a second, so the
+            # first polls come quickly and slow down for long running ones
+            interval = min(0.05, FLAGS.xenapi_task_poll_interval)
+            status = self._call_xenapi('task.get_status', task)
+            while status == 'pending':
+                greenthread.sleep(interval)
+                interval = min(interval * 2, FLAGS.xenapi_task_poll_interval)
+                status = self._call_xenapi('task.get_status', task)
+            if status == 'success':
+                return _parse_xmlrpc_value(
+                        self._call_xenapi('task.get_result', task))
+            raise self.XenAPI.Failure(
+                    self._call_xenapi('task.get_error_info', task))
+        finally:
+            try:
+                self._call_xenapi('task.destroy', task)
+            except self.XenAPI.Failure:
+                LOG.exception(_('Unable to destroy task %s'), task)
+
     def _create_session(self, url):
         """Stubout point. This can be replaced with a mock session."""
         return self.XenAPI.Session(url)
@@ -80,8 +80,15 @@ class API(base.Base):
         else:
             snapshot_id = None
 
+        pid = context.project_id
         if quota.allowed_volumes(context, 1, size) < 1:
-            pid = context.project_id
+            LOG.warn(_("Quota exceeded for %(pid)s, tried to create"
+                    " %(size)sG volume") % locals())
+            raise exception.QuotaError(code="VolumeSizeTooLarge")
+        try:
+            reservations = quota.reserve(context, volumes=1,
+                                         gigabytes=int(size))
+        except exception.OverQuota:
             LOG.warn(_("Quota exceeded for %(pid)s, tried to create"
                     " %(size)sG volume") % locals())
             raise exception.QuotaError(code="VolumeSizeTooLarge")
@@ -108,7 +115,12 @@ class API(base.Base):
             'metadata': metadata,
             }
 
-        volume = self.db.volume_create(context, options)
+        try:
+            volume = self.db.volume_create(context, options)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                quota.rollback(context, reservations)
+        quota.commit(context, reservations)
         rpc.cast(context,
                  FLAGS.scheduler_topic,
                  {"method": "create_volume",
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""benchmark_memorycache.py - Measure the in process memcache client
+
+Fills memorycache.Client and the original client, which expunged every
+expired key on each get(), with keys carrying a mix of expiry times and
+reports the time taken per set() and get() by each.
+
+"""
+
+import optparse
+import os
+import random
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from nova.common import memorycache
+from nova import flags
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+
+
+class ReferenceClient(object):
+    """The memorycache.Client prior to the expiry heap."""
+
+    def __init__(self, *args, **kwargs):
+        self.cache = {}
+
+    def get(self, key):
+        for k in self.cache.keys():
+            (timeout, _value) = self.cache[k]
+            if timeout and utils.utcnow_ts() >= timeout:
+                del self.cache[k]
+
+        return self.cache.get(key, (0, None))[1]
+
+    def set(self, key, value, time=0, min_compress_len=0):
+        timeout = 0
+        if time != 0:
+            timeout = utils.utcnow_ts() + time
+        self.cache[key] = (timeout, value)
+        return True
+
+
+def per_op(func, args):
+    start = time.time()
+    for arg in args:
+        func(*arg)
+    return (time.time() - start) / len(args) * 1000000
+
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('-k', '--keys', type='int', default=100000,
+                      help='keys in the cache (default: %default)')
+    parser.add_option('-g', '--gets', type='int', default=100000,
+                      help='gets to time (default: %default)')
+    parser.add_option('-r', '--reference-gets', type='int', default=20,
+                      help='gets to time on the original client '
+                           '(default: %default)')
+    options, args = parser.parse_args()
+
+    FLAGS([])
+    rand = random.Random(42)
+    sets = [('token-%d' % i, 'x' * 64, rand.choice((0, 600, 3600)))
+            for i in xrange(options.keys)]
+    gets = [('token-%d' % rand.randrange(options.keys),)
+            for i in xrange(options.gets)]
+
+    for name, client, ngets in (
+            ('original', ReferenceClient(), options.reference_gets),
+            ('current', memorycache.Client(), options.gets)):
+        set_time = per_op(client.set, sets)
+        get_time = per_op(client.get, gets[:ngets])
+        print '%-9s %d keys: set %8.1f us  get %10.1f us' % (
+                name, options.keys, set_time, get_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""benchmark_rate_limiter.py - Measure the API rate limiter overhead
+
+Runs a mix of requests from many users through limits.Limiter with the
+default limits, keeping state in process and in the in-process
+memcache client, and reports the time spent per request along with
+the number of users whose state was kept.
+
+"""
+
+import optparse
+import os
+import random
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from nova.api.openstack.compute import limits
+from nova import flags
+
+
+FLAGS = flags.FLAGS
+
+REQUESTS = [
+    ('GET', '/v2/fake/servers/detail'),
+    ('GET', '/v2/fake/servers/detail?changes-since=2012-01-01'),
+    ('POST', '/v2/fake/servers'),
+    ('POST', '/v2/fake/servers/1/action'),
+    ('PUT', '/v2/fake/servers/1'),
+    ('DELETE', '/v2/fake/servers/1'),
+]
+
+
+def run(limiter, requests):
+    start = time.time()
+    for verb, url, username in requests:
+        limiter.check_for_delay(verb, url, username)
+    return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('-u', '--users', type='int', default=20000,
+                      help='distinct users (default: %default)')
+    parser.add_option('-n', '--requests', type='int', default=100000,
+                      help='requests to check (default: %default)')
+    parser.add_option('-m', '--max-users', type='int', default=10000,
+                      help='rate_limit_max_users (default: %default)')
+    options, args = parser.parse_args()
+
+    FLAGS([])
+    FLAGS.set_override('rate_limit_max_users', options.max_users)
+
+    rand = random.Random(42)
+    requests = [rand.choice(REQUESTS) + ('user%d' % rand.randrange(
+                    options.users),) for i in xrange(options.requests)]
+
+    for shared in (False, True):
+        FLAGS.set_override('rate_limit_use_memcached', shared)
+        limiter = limits.Limiter(limits.DEFAULT_LIMITS)
+        elapsed = run(limiter, requests)
+        print '%-9s %6.1f us/request, %d users kept' % (
+                shared and 'memcache' or 'in-memory',
+                elapsed / options.requests * 1000000,
+                len(limiter.levels.recent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""benchmark_rrd_parsing.py - Compare XenServer rrd_updates parsing paths
+
+Parses an rrd_updates document, either read from a file or generated
+for a host with many VMs, once with vm_utils.parse_rrd_update() and
+once with the minidom and Decimal based parser it replaced, checks that
+both compute the same metrics and reports the time taken by each.
+
+"""
+
+import decimal
+import math
+import optparse
+import os
+import random
+import re
+import sys
+import time
+from xml.dom import minidom
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from nova.virt.xenapi import vm_utils
+
+
+METRICS = ['cpu0', 'cpu1', 'memory', 'memory_internal_free',
+           'vbd_xvda_read', 'vbd_xvda_write', 'vbd_xvdb_read',
+           'vbd_xvdb_write'] + ['vif_%d_%s' % (i, d) for i in xrange(6)
+                                for d in ('rx', 'tx')]
+
+
+def make_rrd_updates(vms, rows, step=5, end=1328795567):
+    rand = random.Random(42)
+    legend = ['AVERAGE:vm:%08d-0000-0000-0000-000000000000:%s' % (i, m)
+              for i in xrange(vms) for m in METRICS]
+    lines = ['<xport><meta><start>%d</start><step>%d</step><end>%d</end>'
+             '<rows>%d</rows><columns>%d</columns><legend>' % (
+                 end - rows * step, step, end, rows, len(legend))]
+    lines.extend('<entry>%s</entry>' % entry for entry in legend)
+    lines.append('</legend></meta><data>')
+    for row in xrange(rows):
+        values = []
+        for col in legend:
+            if rand.random() < 0.01:
+                values.append('NaN')
+            else:
+                values.append('%.4f' % (rand.random() * 100000))
+        lines.append('<row><t>%d</t>%s</row>' % (
+            end - row * step, ''.join('<v>%s</v>' % v for v in values)))
+    lines.append('</data></xport>')
+    return ''.join(lines)
+
+
+def reference_parse_rrd_update(xml, start, until=None):
+    doc = minidom.parseString(xml)
+    legend = doc.getElementsByTagName('legend')[0]
+    legend = [child.firstChild.data for child in legend.childNodes]
+    dnode = doc.getElementsByTagName('data')[0]
+    data = [dict(
+            time=int(child.getElementsByTagName('t')[0].firstChild.data),
+            values=[decimal.Decimal(valnode.firstChild.data)
+                    for valnode in child.getElementsByTagName('v')])
+            for child in dnode.childNodes]
+    sum_data = {}
+    for col, collabel in enumerate(legend):
+        _datatype, _objtype, uuid, name = collabel.split(':')
+        vm_data = sum_data.setdefault(uuid, {})
+        if name.startswith('vif'):
+            vm_data[name] = reference_integrate(data, col, start, until)
+        else:
+            vm_data[name] = reference_average(data, col, until)
+    return sum_data
+
+
+def reference_average(data, col, until=None):
+    vals = [row['values'][col] for row in data
+            if (not until or (row['time'] <= until)) and
+                row['values'][col].is_finite()]
+    if vals:
+        return (sum(vals) / len(vals)).quantize(decimal.Decimal('1.0000'))
+    return decimal.Decimal('0.0000')
+
+
+def reference_integrate(data, col, start, until=None):
+    total = decimal.Decimal('0.0000')
+    prev_time = int(start)
+    prev_val = None
+    for row in reversed(data):
+        if not until or (row['time'] <= until):
+            val = row['values'][col]
+            if val.is_nan():
+                val = decimal.Decimal('0.0000')
+            if prev_val is None:
+                prev_val = val
+            total += (decimal.Decimal('0.5000') * (prev_val + val) *
+                      (row['time'] - prev_time))
+            prev_time = row['time']
+            prev_val = val
+    return total.quantize(decimal.Decimal('1.0000'))
+
+
+def same_metrics(expected, actual):
+    if sorted(expected) != sorted(actual):
+        return False
+    for uuid, metrics in expected.iteritems():
+        if sorted(metrics) != sorted(actual[uuid]):
+            return False
+        for name, value in metrics.iteritems():
+            value = float(value)
+            other = actual[uuid][name]
+            if math.isnan(value) or math.isnan(other):
+                if not (math.isnan(value) and math.isnan(other)):
+                    return False
+            elif abs(value - other) > 1e-4 * max(1.0, abs(value)):
+                return False
+    return True
+
+
+def best_time(func, args, repeat):
+    times = []
+    for i in xrange(3):
+        start = time.time()
+        for j in xrange(repeat):
+            func(*args)
+        times.append((time.time() - start) / repeat)
+    return min(times)
+
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options] [rrd_updates.xml]')
+    parser.add_option('-m', '--vms', type='int', default=100,
+                      help='VMs in the generated document (default: '
+                           '%default)')
+    parser.add_option('-n', '--rows', type='int', default=120,
+                      help='rows in the generated document (default: '
+                           '%default)')
+    parser.add_option('-r', '--repeat', type='int', default=1,
+                      help='parses to time (default: %default)')
+    options, args = parser.parse_args()
+
+    if args:
+        # XenServer sends no whitespace between elements, which the
+        # minidom parser relies on
+        with open(args[0]) as f:
+            xml = re.sub(r'>\s+<', '><', f.read().strip())
+        start = int(minidom.parseString(xml).getElementsByTagName(
+                'start')[0].firstChild.data)
+    else:
+        xml = make_rrd_updates(options.vms, options.rows)
+        start = 1328795567 - options.rows * 5
+
+    expected = reference_parse_rrd_update(xml, start)
+    if not same_metrics(expected, vm_utils.parse_rrd_update(xml, start)):
+        print 'parse_rrd_update() differs from the minidom parser'
+        sys.exit(1)
+
+    args = (xml, start)
+    old_time = best_time(reference_parse_rrd_update, args, options.repeat)
+    new_time = best_time(vm_utils.parse_rrd_update, args, options.repeat)
+    print 'rrd_updates of %d bytes: minidom %.4fs  streaming %.4fs  ' \
+          'speedup %.1fx' % (len(xml), old_time, new_time,
+                             old_time / new_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""benchmark_to_primitive.py - Compare utils.to_primitive implementations
+
+Converts instance and network info payloads shaped like the ones sent
+over RPC and in notifications with both the current to_primitive() and
+the original inspect-based implementation, checks that the output is
+identical and reports the time taken by each.
+
+"""
+
+import datetime
+import inspect
+import itertools
+import optparse
+import os
+import sys
+import timeit
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from nova import utils
+
+
+def reference_to_primitive(value, convert_instances=False, level=0):
+    """The inspect-based to_primitive() prior to the type dispatch."""
+    nasty = [inspect.ismodule, inspect.isclass, inspect.ismethod,
+             inspect.isfunction, inspect.isgeneratorfunction,
+             inspect.isgenerator, inspect.istraceback, inspect.isframe,
+             inspect.iscode, inspect.isbuiltin, inspect.isroutine,
+             inspect.isabstract]
+    for test in nasty:
+        if test(value):
+            return unicode(value)
+
+    if type(value) == itertools.count:
+        return unicode(value)
+
+    if getattr(value, '__module__', None) == 'mox':
+        return 'mock'
+
+    if level > 3:
+        return '?'
+
+    try:
+        if isinstance(value, (list, tuple)):
+            o = []
+            for v in value:
+                o.append(reference_to_primitive(v,
+                    convert_instances=convert_instances, level=level))
+            return o
+        elif isinstance(value, dict):
+            o = {}
+            for k, v in value.iteritems():
+                o[k] = reference_to_primitive(v,
+                    convert_instances=convert_instances, level=level)
+            return o
+        elif isinstance(value, datetime.datetime):
+            return str(value)
+        elif hasattr(value, 'iteritems'):
+            return reference_to_primitive(dict(value.iteritems()),
+                                          convert_instances=convert_instances,
+                                          level=level)
+        elif hasattr(value, '__iter__'):
+            return reference_to_primitive(list(value), level)
+        elif convert_instances and hasattr(value, '__dict__'):
+            return reference_to_primitive(value.__dict__,
+                                          convert_instances=convert_instances,
+                                          level=level + 1)
+        else:
+            return value
+    except TypeError:
+        return unicode(value)
+
+
+class FakeModel(object):
+    """Stands in for a NovaBase model: attributes exposed by iteritems()."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def iteritems(self):
+        return self.__dict__.iteritems()
+
+
+def make_instance(i):
+    now = datetime.datetime(2012, 3, 4, 5, 6, 7)
+    instance_type = FakeModel(id=1, name='m1.small', memory_mb=2048,
+                              vcpus=1, root_gb=20, ephemeral_gb=0,
+                              flavorid='2', swap=0, rxtx_factor=1.0,
+                              created_at=now, updated_at=None,
+                              deleted_at=None, deleted=False)
+    metadata = [FakeModel(id=j, key='key%d' % j, value=u'value%d' % j,
+                          created_at=now, deleted=False)
+                for j in xrange(3)]
+    return FakeModel(id=i, uuid='aaaaaaaa-bbbb-cccc-dddd-%012d' % i,
+                     user_id='fake', project_id='fake',
+                     image_ref='cedef40a-ed67-4d10-800e-17455edce175',
+                     host='compute%d' % (i % 10), vm_state='active',
+                     task_state=None, power_state=1, memory_mb=2048,
+                     vcpus=1, root_gb=20, ephemeral_gb=0,
+                     display_name=u'server-%d' % i, launched_at=now,
+                     terminated_at=None, created_at=now, updated_at=now,
+                     deleted_at=None, deleted=False, locked=False,
+                     instance_type=instance_type, metadata=metadata,
+                     security_groups=[])
+
+
+def make_nw_info(i):
+    return [(
+        {'bridge': 'br100', 'id': j, 'cidr': '10.0.%d.0/24' % j,
+         'cidr_v6': None, 'injected': False, 'multi_host': False},
+        {'label': 'private', 'gateway': '10.0.%d.1' % j,
+         'broadcast': '10.0.%d.255' % j, 'mac': '02:16:3e:00:%02x:%02x' %
+         (i % 256, j), 'rxtx_cap': 0, 'dns': ['8.8.8.8'],
+         'ips': [{'ip': '10.0.%d.%d' % (j, i % 250 + 2),
+                  'netmask': '255.255.255.0', 'enabled': '1'}],
+         'should_create_bridge': True, 'should_create_vlan': False,
+         'vif_uuid': 'vif-%d-%d' % (i, j)}) for j in xrange(2)]
+
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('-n', '--instances', type='int', default=100,
+                      help='instances per payload (default: %default)')
+    parser.add_option('-r', '--repeat', type='int', default=20,
+                      help='conversions to time (default: %default)')
+    options, args = parser.parse_args()
+
+    payloads = {
+        'instances': [make_instance(i) for i in xrange(options.instances)],
+        'nw_info': [make_nw_info(i) for i in xrange(options.instances)],
+    }
+
+    failed = False
+    for name, payload in sorted(payloads.iteritems()):
+        expected = reference_to_primitive(payload)
+        actual = utils.to_primitive(payload)
+        if actual != expected:
+            print '%s: output differs from the reference' % name
+            failed = True
+            continue
+
+        old = timeit.Timer(lambda: reference_to_primitive(payload))
+        new = timeit.Timer(lambda: utils.to_primitive(payload))
+        old_time = min(old.repeat(3, options.repeat))
+        new_time = min(new.repeat(3, options.repeat))
+        print '%-10s reference %.4fs  current %.4fs  speedup %.1fx' % (
+                name, old_time, new_time, old_time / new_time)
+
+    sys.exit(failed and 1 or 0)
+
+
+if __name__ == '__main__':
+    main()
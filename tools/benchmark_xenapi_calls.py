@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""benchmark_xenapi_calls.py - Count XenAPI round trips of record lookups
+
+Fills nova.virt.xenapi.fake with VMs, VBDs, VIFs and an SR holding many
+VDIs, then runs the XenAPI helpers that read records in bulk next to
+the list-then-get loops they replaced, checks that both return the same
+data and reports the number of XenAPI calls each one made.
+
+"""
+
+import optparse
+import os
+import sys
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from nova import flags
+from nova.virt import xenapi_conn
+from nova.virt.xenapi import fake
+from nova.virt.xenapi import vm_utils
+from nova.virt.xenapi import vmops
+
+
+FLAGS = flags.FLAGS
+
+
+class CountingSession(xenapi_conn.XenAPISession):
+    """A XenAPISession talking to xenapi.fake and counting calls."""
+
+    calls = 0
+
+    def get_imported_xenapi(self):
+        return fake
+
+    def _create_session(self, url):
+        return fake.SessionBase(url)
+
+    def _call_xenapi(self, method, *args):
+        self.calls += 1
+        return super(CountingSession, self)._call_xenapi(method, *args)
+
+    def get_xenapi_host(self):
+        self.calls += 1
+        return super(CountingSession, self).get_xenapi_host()
+
+
+def populate(vms, vdis, vbds):
+    fake.reset()
+    host_ref = fake.get_all('host')[0]
+    sr_ref = fake.create_sr(name_label='Local storage', type='lvm',
+                            host_ref=host_ref)
+    sr_rec = fake.get_record('SR', sr_ref)
+    for i in xrange(vdis):
+        sr_rec['VDIs'].append(fake.create_vdi('vdi-%d' % i, False, sr_ref,
+                                              False))
+    for i in xrange(vms):
+        vm_ref = fake.create_vm('instance-%08x' % i, 'Running',
+                                host_ref=host_ref)
+        fake.create_vm('template-%d' % i, 'Halted', is_a_template=True)
+        for j in xrange(vbds):
+            fake.create_vbd(vm_ref, sr_rec['VDIs'][(i * vbds + j) % vdis])
+        vm_rec = fake.get_record('VM', vm_ref)
+        vm_rec['VIFs'] = [fake._create_object('VIF',
+                                              {'device': str(j),
+                                               'MAC': '02:00:00:00:%02x:%02x'
+                                                      % (i % 256, j)})
+                          for j in xrange(2)]
+    return host_ref, sr_ref
+
+
+def reference_list_vms(session):
+    for vm_ref in session.call_xenapi('VM.get_all'):
+        vm_rec = session.call_xenapi('VM.get_record', vm_ref)
+        if (vm_rec["resident_on"] != session.get_xenapi_host() or
+            vm_rec["is_a_template"] or vm_rec["is_control_domain"]):
+            continue
+        yield vm_ref, vm_rec
+
+
+def reference_vdis_in_sr(session, sr_ref):
+    for vdi_ref in session.call_xenapi('SR.get_VDIs', sr_ref):
+        yield vdi_ref, session.call_xenapi('VDI.get_record', vdi_ref)
+
+
+def reference_lookup_vm_vdis(session, vm_ref):
+    vdi_refs = []
+    for vbd_ref in session.call_xenapi('VM.get_VBDs', vm_ref):
+        vdi_ref = session.call_xenapi('VBD.get_VDI', vbd_ref)
+        session.call_xenapi('VDI.get_record', vdi_ref)
+        vdi_refs.append(vdi_ref)
+    return vdi_refs or None
+
+
+def reference_bw_usage(session, metrics):
+    bw = {}
+    for uuid, data in metrics.iteritems():
+        vm_ref = session.call_xenapi('VM.get_by_uuid', uuid)
+        vm_rec = session.call_xenapi('VM.get_record', vm_ref)
+        vif_map = {}
+        for vif_ref in vm_rec['VIFs']:
+            vif = session.call_xenapi('VIF.get_record', vif_ref)
+            vif_map[vif['device']] = vif['MAC']
+        vifs_bw = bw.setdefault(vm_rec['name_label'], {})
+        for key, val in data.iteritems():
+            vif_bw = vifs_bw.setdefault(vif_map[key.split('_')[1]], {})
+            vif_bw['bw_out' if key.endswith('tx') else 'bw_in'] = int(val)
+    return bw
+
+
+def count(session, func, *args):
+    session.calls = 0
+    result = func(*args)
+    if hasattr(result, 'next'):
+        result = list(result)
+    return session.calls, result
+
+
+def main():
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('-m', '--vms', type='int', default=100,
+                      help='instances on the host (default: %default)')
+    parser.add_option('-d', '--vdis', type='int', default=2000,
+                      help='VDIs in the SR (default: %default)')
+    parser.add_option('-b', '--vbds', type='int', default=3,
+                      help='disks per instance (default: %default)')
+    options, args = parser.parse_args()
+
+    FLAGS([])
+    FLAGS.set_override('xenapi_connection_concurrent', 1)
+    host_ref, sr_ref = populate(options.vms, options.vdis, options.vbds)
+    session = CountingSession('http://fake', 'root', 'pass')
+    helper = vm_utils.VMHelper
+    helper.XenAPI = fake
+
+    vm_refs = [ref for ref, rec in reference_list_vms(session)]
+    metrics = {}
+    for vm_ref in vm_refs:
+        vm_rec = fake.get_record('VM', vm_ref)
+        metrics[vm_rec['uuid']] = {'vif_0_tx': '1', 'vif_0_rx': '2',
+                                   'vif_1_tx': '3', 'vif_1_rx': '4'}
+    helper.compile_metrics = classmethod(lambda cls, start, stop: metrics)
+    ops = vmops.VMOps.__new__(vmops.VMOps)
+    ops._session = session
+
+    cases = [
+        ('list_vms',
+         lambda: sorted(reference_list_vms(session)),
+         lambda: sorted(helper.list_vms(session))),
+        ('vdis in SR',
+         lambda: sorted(reference_vdis_in_sr(session, sr_ref)),
+         lambda: sorted(vm_utils._get_all_vdis_in_sr(session, sr_ref))),
+        ('lookup_vm_vdis',
+         lambda: [sorted(reference_lookup_vm_vdis(session, ref))
+                  for ref in vm_refs],
+         lambda: [sorted(helper.lookup_vm_vdis(session, ref))
+                  for ref in vm_refs]),
+        ('bw usage',
+         lambda: reference_bw_usage(session, metrics),
+         lambda: ops.get_all_bw_usage(0)),
+    ]
+
+    failed = False
+    for name, reference, current in cases:
+        old_calls, expected = count(session, reference)
+        new_calls, actual = count(session, current)
+        if actual != expected:
+            print '%s: output differs from the reference' % name
+            failed = True
+            continue
+        print '%-15s reference %6d calls  current %6d calls' % (
+                name, old_calls, new_calls)
+
+    sys.exit(failed and 1 or 0)
+
+
+if __name__ == '__main__':
+    main()